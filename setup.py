@@ -48,4 +48,5 @@ setup(name='testbird',
       entry_points={
           'console_scripts': [
              'testbird=testbird:main',
+             'testbird-telemetry=testbird.telemetry:main',
           ]},)
@@ -1 +1,6 @@
 from pywps._compat import PY2, urlparse
+
+if PY2:
+    from urlparse import parse_qs
+else:
+    from urllib.parse import parse_qs
@@ -0,0 +1,290 @@
+import os
+import io
+import time
+import zlib
+import shutil
+import struct
+import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pywps import configuration
+
+from .utils import makedirs, get_config_cpus
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Files that are already compressed, deflating them again costs time and saves nothing
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.zip', '.gz', '.bz2')
+
+CHUNK_SIZE = 1024*1024
+
+# Compressed entries up to this size are kept in memory until they are written, larger ones spill to disk
+SPOOL_SIZE = 8 * CHUNK_SIZE
+
+# Sizes and offsets, and the number of entries, from which the zip64 records are needed
+ZIP64_LIMIT = 0xffffffff
+ZIP64_COUNT = 0xffff
+
+LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+CENTRAL_HEADER = struct.Struct('<4s6H3L5H2L')
+END_RECORD = struct.Struct('<4s4H2LH')
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2L4Q')
+ZIP64_END_LOCATOR = struct.Struct('<4sLQL')
+
+
+def output_path(filename):
+    """
+    Path in the WPS output directory, rather than the current working directory, for a file served to the user
+    """
+    outputpath = configuration.get_config_value('server', 'outputpath') or tempfile.gettempdir()
+    makedirs(outputpath)
+    return os.path.join(outputpath, filename)
+
+
+def _fit(value, limit=None, largest=0xffffffff):
+    """
+    A value for a field of the classic zip records, which holds largest in its place once the value reaches limit
+    """
+    return value if value < (ZIP64_LIMIT if limit is None else limit) else largest
+
+
+class ZipEntry(object):
+    """
+    A member of a zip file as ZipWriter writes it, with its CRC and sizes known before it is written
+    """
+    def __init__(self, arcname, date_time, external_attr, compress_type=zipfile.ZIP_STORED):
+        """
+        :param arcname: name in the archive, directories end with '/'
+        :param date_time: (year, month, day, hour, minute, second) it was last modified
+        :param external_attr: file mode and attributes, as in ZipInfo.external_attr
+        :param compress_type: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+        """
+        self.name = arcname if isinstance(arcname, bytes) else arcname.encode('utf-8')
+        try:
+            self.name.decode('ascii')
+            self.flags = 0
+        except UnicodeDecodeError:
+            # General purpose bit 11: the name is UTF-8
+            self.flags = 0x800
+        self.date_time = date_time
+        self.external_attr = external_attr
+        self.compress_type = compress_type
+        self.crc = 0
+        self.compress_size = 0
+        self.file_size = 0
+        self.offset = 0
+
+    def _dostime(self):
+        year, month, day, hour, minute, second = self.date_time
+        return hour << 11 | minute << 5 | second // 2, (max(year, 1980) - 1980) << 9 | month << 5 | day
+
+    def local_header(self):
+        csize, usize, extra = self.compress_size, self.file_size, b''
+        if usize >= ZIP64_LIMIT or csize >= ZIP64_LIMIT:
+            # The zip64 extra field of a local header has both sizes
+            extra = struct.pack('<2H2Q', 1, 16, usize, csize)
+            csize = usize = 0xffffffff
+        dostime, dosdate = self._dostime()
+        return LOCAL_HEADER.pack(b'PK\x03\x04', 45 if extra else 20, self.flags, self.compress_type, dostime,
+                                 dosdate, self.crc, csize, usize, len(self.name), len(extra)) + self.name + extra
+
+    def central_header(self):
+        # Values too large for their field follow in the zip64 extra field, in this order
+        large = [value for value in (self.file_size, self.compress_size, self.offset) if value >= ZIP64_LIMIT]
+        extra = struct.pack('<2H%dQ' % len(large), 1, 8 * len(large), *large) if large else b''
+        version = 45 if extra else 20
+        dostime, dosdate = self._dostime()
+        # Made on Unix, so the file modes are kept
+        return CENTRAL_HEADER.pack(b'PK\x01\x02', 3 << 8 | version, version, self.flags, self.compress_type,
+                                   dostime, dosdate, self.crc, _fit(self.compress_size), _fit(self.file_size),
+                                   len(self.name), len(extra), 0, 0, 0, self.external_attr,
+                                   _fit(self.offset)) + self.name + extra
+
+
+class ZipWriter(object):
+    """
+    Writes a zip file out of entries compressed elsewhere, which zipfile has no public way to do. Only what
+    ZipArchive needs is supported: stored and deflated entries whose CRC and sizes are known before they are
+    written, on a single disk, without comments or encryption, with the zip64 records of APPNOTE.TXT 4.3.14
+    to 4.3.15 and 4.5.3 once the archive outgrows the classic format. Entries can be written from several
+    threads, each is appended whole under a lock.
+    """
+    def __init__(self, fileobj):
+        """
+        :param fileobj: file open for writing in binary mode, at its start
+        """
+        self.fp = fileobj
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def write(self, entry, data):
+        """
+        Appends an entry, setting its offset
+        :param entry: ZipEntry
+        :param data: file object with the entry's compressed data, from its current position
+        """
+        with self._lock:
+            entry.offset = self.fp.tell()
+            self.fp.write(entry.local_header())
+            shutil.copyfileobj(data, self.fp, CHUNK_SIZE)
+            self.entries.append(entry)
+
+    def close(self):
+        """
+        Writes the central directory and end records, leaving the file open
+        """
+        with self._lock:
+            start = self.fp.tell()
+            for entry in self.entries:
+                self.fp.write(entry.central_header())
+            end = self.fp.tell()
+            count, size = len(self.entries), end - start
+            if count >= ZIP64_COUNT or size >= ZIP64_LIMIT or start >= ZIP64_LIMIT:
+                self.fp.write(ZIP64_END_RECORD.pack(b'PK\x06\x06', ZIP64_END_RECORD.size - 12, 3 << 8 | 45, 45,
+                                                    0, 0, count, count, size, start))
+                self.fp.write(ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, end, 1))
+            count = _fit(count, ZIP64_COUNT, 0xffff)
+            self.fp.write(END_RECORD.pack(b'PK\x05\x06', 0, 0, count, count, _fit(size), _fit(start), 0))
+
+
+class ZipArchive(object):
+    """
+    A zip file whose entries are compressed on a pool of threads as soon as they are added, so files can be
+    archived while the rest are still being produced. zlib releases the GIL while compressing, so the threads
+    compress in parallel, alongside whatever the request does next.
+
+    Each entry is deflated into a spool of its own, then appended to the zip file by ZipWriter as soon as it
+    is ready, so entries can be in a different order from the one they were added in.
+    """
+    def __init__(self, filename, threads=None):
+        """
+        :param filename: path of the zip file to write
+        :param threads: number of compressing threads, taken from '[archive] threads' in the pywps config if not
+                        given
+        """
+        self.filename = filename
+        self._fp = open(filename, 'wb')
+        self._writer = ZipWriter(self._fp)
+        self._executor = ThreadPoolExecutor(max_workers=threads or get_config_cpus('archive', 'threads'))
+        self._futures = []
+        self._names = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, path, arcname=None):
+        """
+        Queues a file to be compressed into the archive
+        :param path: file to add
+        :param arcname: name in the archive, by default the file name
+        """
+        arcname = (arcname or os.path.basename(path)).replace(os.sep, '/')
+        if arcname in self._names:
+            return
+        self._names.add(arcname)
+        st = os.stat(path)
+        compress_type = zipfile.ZIP_DEFLATED
+        if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+            compress_type = zipfile.ZIP_STORED
+        entry = ZipEntry(arcname, time.localtime(st.st_mtime)[:6], (st.st_mode & 0xFFFF) << 16, compress_type)
+        self._futures.append(self._executor.submit(self._compress, path, entry))
+
+    def _compress(self, path, entry):
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            # Raw deflate, without the zlib header and checksum
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        else:
+            compressor = None
+        spool = tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=os.path.dirname(os.path.abspath(self.filename)))
+        try:
+            crc = 0
+            with open(path, 'rb') as fin:
+                for chunk in iter(lambda: fin.read(CHUNK_SIZE), b''):
+                    crc = zlib.crc32(chunk, crc)
+                    entry.file_size += len(chunk)
+                    spool.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                spool.write(compressor.flush())
+            entry.crc = crc & 0xffffffff
+            entry.compress_size = spool.tell()
+            spool.seek(0)
+            self._writer.write(entry, spool)
+        finally:
+            spool.close()
+
+    def add_tree(self, root, exclude_hidden=True):
+        """
+        Queues every file and directory under root, named relative to it
+        :param exclude_hidden: leave out files and directories starting with '.', such as the .npcache sidecars
+        """
+        for dirpath, dirnames, filenames in os.walk(root):
+            if exclude_hidden:
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                filenames = [f for f in filenames if not f.startswith('.')]
+            reldir = os.path.relpath(dirpath, root)
+            for name in sorted(dirnames):
+                self.add_dir(os.path.normpath(os.path.join(reldir, name)))
+            for name in sorted(filenames):
+                self.add(os.path.join(dirpath, name), os.path.normpath(os.path.join(reldir, name)))
+
+    def add_dir(self, arcname):
+        """
+        Adds an (empty) directory entry
+        """
+        arcname = arcname.replace(os.sep, '/').rstrip('/') + '/'
+        if arcname in self._names:
+            return
+        self._names.add(arcname)
+        entry = ZipEntry(arcname, time.localtime()[:6], (0o40775 << 16) | 0x10)
+        self._futures.append(self._executor.submit(self._writer.write, entry, io.BytesIO()))
+
+    def close(self):
+        """
+        Waits for every queued file to be written and finishes the zip file
+        :return: path of the zip file
+        """
+        try:
+            for future in self._futures:
+                future.result()
+        except Exception:
+            self.abort()
+            raise
+        self._executor.shutdown()
+        self._writer.close()
+        self._fp.close()
+        LOGGER.debug("Archived %s entries in %s (%s bytes)" % (len(self._names), self.filename,
+                                                               os.path.getsize(self.filename)))
+        return self.filename
+
+    def abort(self):
+        """
+        Stops archiving and removes the partly written zip file
+        """
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown()
+        self._fp.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+def archive_tree(filename, root):
+    """
+    Zips up every file under a directory, the equivalent of shutil.make_archive(name, 'zip', root) that
+    leaves out hidden files
+    :return: path of the zip file
+    """
+    archive = ZipArchive(filename)
+    with archive:
+        archive.add_tree(root)
+    return archive.filename
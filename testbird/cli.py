@@ -10,6 +10,8 @@ import os
 from pywps import configuration
 
 from . import wsgi
+from .static import OutputFiles
+from .tiles import TileServer
 from ._compat import urlparse
 
 import logging
@@ -38,18 +40,17 @@ def _run(application, bind_host=None, daemon=False):
     # call this *after* app is initialized ... needs pywps config.
     host, port = get_host()
     bind_host = bind_host or host
-    # need to serve the wps outputs
-    static_files = {
-        '/outputs': configuration.get_config_value('server', 'outputpath')
-    }
+    # need to serve the wps outputs, with range requests so large files can be fetched in parts
+    application = OutputFiles(application, configuration.get_config_value('server', 'outputpath'))
+    # and map tiles of the NAME results
+    application = TileServer(application)
     run_simple(
         hostname=bind_host,
         port=port,
         application=application,
         use_debugger=True,
         use_reloader=True,
-        use_evalex=not daemon,
-        static_files=static_files)
+        use_evalex=not daemon)
 
 
 def main():
@@ -0,0 +1,242 @@
+import os
+import json
+import math
+import threading
+
+import numpy as np
+
+from .utils import getjasminconfigs, estimatereq
+from .write_inputfile import InputFileGenerator, GridSpec, run_duration
+from .units import day_outputs
+from .telemetry import read_report
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+STATS_FILE = '.runstats.jsonl'
+
+# Only the most recent records are fitted, so the model follows changes to NAME and the hardware
+MAX_RECORDS = 500
+
+# Queue limits on JASMIN, larger jobs go to high-mem or long-serial
+SHORT_SERIAL_MB = 64000
+SHORT_SERIAL_HOURS = 24
+
+# Features each quantity is fitted against, on top of a constant
+TERMS = {
+    'memory_mb': ('particles', 'cells'),
+    'cpu_seconds': ('particle_hours', 'values'),
+    'output_mb': ('values',),
+}
+
+
+def features(params, grid=None):
+    """
+    The size of one day of a run, as far as its cost goes
+    :param params: input parameters
+    :param grid: GridSpec of the run, if it has already been worked out
+    :return: dictionary of
+             particles: most particles alive at once, in millions
+             particle_hours: particles times the hours NAME runs for, in millions
+             cells: cells of the output grid over all levels, in millions
+             values: values output over all the temporal grids, in millions
+    """
+    grid = grid or GridSpec(params)
+    rate = int(InputFileGenerator.ParticlesPerSource.split('/')[0])
+    if params['timestamp'] == '3-hourly':
+        release_hours = 24
+        ntimes = 8
+    else:
+        release_hours = params['dailyreleaselen']
+        ntimes = 1
+    particles = min(InputFileGenerator.MaxNumParticles, rate * release_hours)
+    hours = run_duration(dict(params))
+    return {'particles': particles / 1e6,
+            'particle_hours': particles * hours / 1e6,
+            'cells': grid.ncells / 1e6,
+            'values': grid.ncells * ntimes / 1e6}
+
+
+class Estimate(object):
+    """
+    Expected memory, CPU time and output volume of one array task, i.e. one day of a run
+    """
+    def __init__(self, memory_mb, cpu_seconds, output_mb=None):
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.output_mb = output_mb
+
+    def requirements(self, margin=1.5):
+        """
+        Queue, walltime (HH:MM) and memory (MB) to request, with room for the estimate being short
+        """
+        mem = max(2000, int(math.ceil(self.memory_mb * margin / 1000.0)) * 1000)
+        # Whole half hours, at least one
+        minutes = max(30, int(math.ceil(self.cpu_seconds * margin / 1800.0)) * 30)
+        if mem > SHORT_SERIAL_MB:
+            queue = 'high-mem'
+        elif minutes > SHORT_SERIAL_HOURS * 60:
+            queue = 'long-serial'
+        else:
+            queue = 'short-serial'
+        return queue, "{:02d}:{:02d}".format(minutes // 60, minutes % 60), mem
+
+
+class CostModel(object):
+    """
+    Linear model of the cost of a day of NAME, fitted to the statistics recorded from earlier runs.
+    Each quantity is a constant plus a non-negative multiple of the features it depends on (see TERMS).
+    """
+    def __init__(self, coefficients):
+        """
+        :param coefficients: dictionary of quantity to list of coefficients, the constant first
+        """
+        self.coefficients = coefficients
+
+    @classmethod
+    def calibrate(cls, records, min_samples=5):
+        """
+        :param records: list of dictionaries of the features of a day and the quantities measured for it
+        :param min_samples: fewest measurements of a quantity it is fitted with
+        :return: CostModel, with only the quantities that had enough measurements
+        """
+        coefficients = {}
+        for quantity, terms in TERMS.items():
+            rows = [r for r in records if r.get(quantity) is not None]
+            if len(rows) < max(min_samples, len(terms) + 1):
+                continue
+            a = np.array([[1.0] + [r[t] for t in terms] for r in rows])
+            b = np.array([r[quantity] for r in rows], dtype=float)
+            coef = np.linalg.lstsq(a, b, rcond=None)[0]
+            # Costs never go down as runs get bigger, the constant is refitted once the slopes are clipped
+            coef[1:] = np.clip(coef[1:], 0, None)
+            coef[0] = max(0, (b - a[:, 1:].dot(coef[1:])).mean())
+            coefficients[quantity] = [float(c) for c in coef]
+        return cls(coefficients)
+
+    def predict(self, quantity, feats):
+        coef = self.coefficients.get(quantity)
+        if coef is None:
+            return None
+        return coef[0] + sum(c * feats[t] for c, t in zip(coef[1:], TERMS[quantity]))
+
+    def estimate(self, params, grid=None):
+        """
+        :param grid: GridSpec of the run, if it has already been worked out
+        :return: Estimate for one day of the run, or None unless memory and CPU time have both been calibrated
+        """
+        if 'memory_mb' not in self.coefficients or 'cpu_seconds' not in self.coefficients:
+            return None
+        feats = features(params, grid)
+        return Estimate(self.predict('memory_mb', feats), self.predict('cpu_seconds', feats),
+                        self.predict('output_mb', feats))
+
+
+class RunStats(object):
+    """
+    Measured cost of every day run, one JSON record per line, appended to as runs finish and shared by
+    all the workers
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache = None
+
+    def record(self, params, memory_mb=None, cpu_seconds=None, output_mb=None, grid=None):
+        """
+        Adds the measured cost of one day
+        :param grid: GridSpec of the run, if it has already been worked out
+        """
+        entry = features(params, grid)
+        entry.update(memory_mb=memory_mb, cpu_seconds=cpu_seconds, output_mb=output_mb)
+        with self._lock:
+            with open(self.path, 'a') as fout:
+                fout.write(json.dumps(entry, sort_keys=True) + "\n")
+
+    def records(self):
+        """
+        :return: the most recent records, only read again when the file has changed
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        key = (st.st_mtime, st.st_size)
+        with self._lock:
+            if self._cache is None or self._cache[0] != key:
+                records = []
+                with open(self.path, 'r') as fin:
+                    for line in fin:
+                        try:
+                            records.append(json.loads(line))
+                        except ValueError:
+                            # Partly written by a worker that died
+                            continue
+                self._cache = (key, records[-MAX_RECORDS:])
+            return self._cache[1]
+
+    def record_job(self, params, dates, jobid, failed=(), grid=None):
+        """
+        Records every day of a finished job array, from its output files and the resource usage summaries
+        of its tasks
+        :param params: input parameters of the run, including outputdir
+        :param dates: run date of each array index, from 1
+        :param jobid: scheduler job id
+        :param failed: array indices that failed
+        :param grid: GridSpec of the run, if it has already been worked out
+        """
+        grid = grid or GridSpec(params)
+        outputsdir = os.path.join(params['outputdir'], 'outputs')
+        for i, rundate in enumerate(dates, 1):
+            if i in failed:
+                continue
+            report = read_report(params['outputdir'], jobid, i) or {}
+            size = sum(os.path.getsize(f) for f in day_outputs(outputsdir, rundate))
+            try:
+                self.record(params, report.get('max_rss_mb'), report.get('cpu_seconds'), size / 1e6, grid)
+            except (IOError, OSError) as e:
+                LOGGER.warning("Unable to record the cost of run %s: %s" % (params['runid'], e))
+                return
+
+
+_runstats = {}
+
+
+def get_runstats():
+    """
+    The run statistics kept in the JASMIN output directory
+    """
+    path = os.path.join(getjasminconfigs().outputdir, STATS_FILE)
+    if path not in _runstats:
+        _runstats[path] = RunStats(path)
+    return _runstats[path]
+
+
+def estimate(params, grid=None):
+    """
+    Estimated cost of one day of a run, '[costmodel]' in jasmin.cfg switches the model on and sets how many
+    recorded days it needs
+    :param grid: GridSpec of the run, if it has already been worked out
+    :return: Estimate, or None if the model is switched off or hasn't enough statistics yet
+    """
+    config = getjasminconfigs()
+    if config.get_option('costmodel', 'enabled', 'true').lower() != 'true':
+        return None
+    min_samples = int(config.get_option('costmodel', 'min_samples', '5'))
+    return CostModel.calibrate(get_runstats().records(), min_samples).estimate(params, grid)
+
+
+def requirements(params, grid=None):
+    """
+    Queue, walltime (HH:MM) and memory (MB) needed by one day of a run, from the cost model when it has
+    been calibrated and from the run length alone until then
+    :param grid: GridSpec of the run, if it has already been worked out
+    """
+    est = estimate(params, grid)
+    if est is not None:
+        margin = float(getjasminconfigs().get_option('costmodel', 'margin', '1.5'))
+        return est.requirements(margin)
+    if params['timeFmt'] == 'hours':
+        return estimatereq(params['time']/float(24))
+    return estimatereq(params['time'])
@@ -0,0 +1,96 @@
+import os
+import json
+import hashlib
+import threading
+
+from pywps import configuration
+
+from .utils import link_file, write_json
+from .archive import output_path, CHUNK_SIZE
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def checksum(filename):
+    """
+    :return: hex sha256 digest of a file's contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest(object):
+    """
+    Publishes files one by one under the WPS output path, alongside a manifest.json listing the URL, size and
+    checksum of each. The manifest is rewritten as every file is added, so clients can start downloading the
+    first files while the rest are still being made, and is marked complete once they all have been.
+    """
+    def __init__(self, name):
+        """
+        :param name: directory under the WPS output path the files are published in
+        """
+        self.name = name
+        self.directory = output_path(name)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.baseurl = "{}/{}".format(configuration.get_config_value('server', 'outputurl').rstrip('/'), name)
+        self.filename = os.path.join(self.directory, 'manifest.json')
+        self.url = self.baseurl + '/manifest.json'
+        self.files = []
+        self._lock = threading.Lock()
+        self.write()
+
+    def add(self, path, relname=None):
+        """
+        Publishes a file and lists it in the manifest
+        :param path: file to publish
+        :param relname: path relative to the manifest directory, by default the file name
+        """
+        relname = (relname or os.path.basename(path)).replace(os.sep, '/')
+        dst = os.path.join(self.directory, *relname.split('/'))
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if os.path.lexists(dst):
+            os.remove(dst)
+        # The published copy goes when the run does, so across file systems it can be a symbolic link
+        link_file(path, dst, copy=False)
+        entry = {'name': relname,
+                 'url': "{}/{}".format(self.baseurl, relname),
+                 'size': os.path.getsize(path),
+                 'sha256': checksum(path)}
+        with self._lock:
+            self.files.append(entry)
+            self.write()
+
+    def add_tree(self, root, exclude_hidden=True):
+        """
+        Publishes every file under root, named relative to it
+        :param exclude_hidden: leave out files and directories starting with '.', such as the .npcache sidecars
+        """
+        for dirpath, dirnames, filenames in os.walk(root):
+            if exclude_hidden:
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                filenames = [f for f in filenames if not f.startswith('.')]
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(dirpath, name)
+                self.add(path, os.path.relpath(path, root))
+
+    def write(self, complete=False):
+        """
+        Rewrites manifest.json, atomically so clients never read half of it
+        """
+        write_json(self.filename, {'complete': complete, 'files': self.files}, mode=0o644, indent=1)
+
+    def close(self):
+        """
+        Marks the manifest complete
+        :return: path of manifest.json
+        """
+        with self._lock:
+            self.write(complete=True)
+        return self.filename
@@ -0,0 +1,366 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .utils import atomic_dir
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+class NameField(object):
+    """
+    The contents of a NAME field output file (e.g. 20171101_group1.txt) held as NumPy arrays.
+
+    Only the grid cells listed in the file are kept: ``cells`` holds their flat index into the
+    (ny, nx) grid and ``values`` their concentrations with shape (number of timestamps, number of cells).
+    """
+    def __init__(self, filename, header_lines, header, fieldinfo, heading, timestamps, cells, lons, lats, values):
+        self.filename = filename
+        self.header_lines = header_lines
+        self.header = header
+        self.fieldinfo = fieldinfo
+        self.heading = heading
+        self.timestamps = timestamps
+        self.cells = cells
+        self.lons = lons
+        self.lats = lats
+        self.values = values
+
+        self.nprelim = int(header.get('Number of preliminary cols', 4))
+        self.nx = int(header['X grid size'])
+        self.ny = int(header['Y grid size'])
+
+    @property
+    def runname(self):
+        return self.header.get('Run name', '')
+
+    @property
+    def averaging(self):
+        return self.info('T Av or Int')
+
+    @property
+    def altitude(self):
+        return self.info('Z')
+
+    @property
+    def nbytes(self):
+        return self.cells.nbytes + self.lons.nbytes + self.lats.nbytes + self.values.nbytes
+
+    def info(self, label, column=0):
+        """
+        Value of one of the field description rows (e.g. 'Time', 'Z') for a column
+        """
+        for rowlabel, values in self.fieldinfo:
+            if rowlabel == label and len(values) > column:
+                return values[column]
+        return ''
+
+    def header_only(self):
+        """
+        Copy of this field without any of the data, small enough to hand to other processes as a template
+        """
+        empty = np.zeros(0)
+        return NameField(self.filename, self.header_lines, self.header, self.fieldinfo, self.heading,
+                         self.timestamps, empty.astype(np.int64), empty, empty,
+                         np.zeros((len(self.timestamps), 0), dtype=np.float32))
+
+    def select(self, column):
+        """
+        Copy of this field with only one of its columns
+        """
+        return NameField(self.filename, self.header_lines, self.header,
+                         [(label, values[column:column + 1]) for label, values in self.fieldinfo], self.heading,
+                         self.timestamps[column:column + 1], self.cells, self.lons, self.lats,
+                         self.values[column:column + 1])
+
+    def grid(self, values):
+        """
+        Expand per-cell values into a dense (ny, nx) grid
+        """
+        grid = np.zeros(self.ny * self.nx, dtype=values.dtype)
+        grid[self.cells] = values
+        return grid.reshape(self.ny, self.nx)
+
+
+def _read_header(f, filename):
+    """
+    Reads a NAME output file up to and including the column heading row, leaving f at the first row of data
+    :return: header lines, header dictionary, field description rows, heading row and the timestamp of each column
+    """
+    header_lines = []
+    header = OrderedDict()
+    fieldinfo = []
+
+    # Key: value header lines, up to the 'Fields:' line
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("No 'Fields:' section found in NAME output file %s" % filename)
+        header_lines.append(line)
+        if line.strip().startswith('Fields:'):
+            break
+        if ':' in line:
+            key, value = line.split(':', 1)
+            header[key.strip()] = value.strip()
+
+    nprelim = int(header.get('Number of preliminary cols', 4))
+    nfields = int(header['Number of field cols'])
+
+    # Field description rows (Species, Quantity, Time, Z...), up to the column heading row
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("No column headings found in NAME output file %s" % filename)
+        cells = [c.strip() for c in line.rstrip('\r\n').split(',')]
+        if cells[0] == 'X Index':
+            heading = line
+            break
+        label = ''
+        for c in cells[:nprelim]:
+            if c:
+                label = c.rstrip(':').strip()
+        fieldinfo.append((label, cells[nprelim:nprelim + nfields]))
+
+    timestamps = []
+    for label, values in fieldinfo:
+        if label == 'Time':
+            timestamps = values
+    if len(timestamps) != nfields:
+        raise ValueError("Expected %s timestamps in NAME output file %s, found %s"
+                         % (nfields, filename, len(timestamps)))
+    return header_lines, header, fieldinfo, heading, timestamps
+
+
+def read_timestamps(filename):
+    """
+    Timestamps of the columns of a NAME output file, reading only its header
+    """
+    with open(filename, 'r') as f:
+        return _read_header(f, filename)[4]
+
+
+def read_field(filename, column=None):
+    """
+    Parses a NAME output file
+    :param filename: path to the NAME output file
+    :param column: index of a single column to read, all columns by default
+    :return: NameField
+    """
+    with open(filename, 'r') as f:
+        header_lines, header, fieldinfo, heading, timestamps = _read_header(f, filename)
+        nprelim = int(header.get('Number of preliminary cols', 4))
+        columns = range(len(timestamps)) if column is None else [column]
+        data = np.loadtxt(f, delimiter=',', usecols=list(range(nprelim)) + [nprelim + c for c in columns],
+                          ndmin=2)
+
+    if data.size == 0:
+        data = np.zeros((0, nprelim + len(columns)))
+    if column is not None:
+        fieldinfo = [(label, values[column:column + 1]) for label, values in fieldinfo]
+        timestamps = timestamps[column:column + 1]
+
+    nx = int(header['X grid size'])
+    cells = (data[:, 1].astype(np.int64) - 1) * nx + (data[:, 0].astype(np.int64) - 1)
+    values = np.ascontiguousarray(data[:, nprelim:].T, dtype=np.float32)
+
+    return NameField(filename, header_lines, header, fieldinfo, heading, timestamps,
+                     cells, data[:, 2].copy(), data[:, 3].copy(), values)
+
+
+def write_field(filename, template, timestamp, cells, lons, lats, values):
+    """
+    Writes a single column NAME field output file, e.g. summed concentrations, so it can be read back in with
+    pynameplot. The header and field description rows are copied from the template.
+    :param filename: file to write
+    :param template: NameField the header is taken from
+    :param timestamp: label given to the single column
+    :param cells: flat grid index of each cell
+    :param lons: longitude of each cell
+    :param lats: latitude of each cell
+    :param values: concentration of each cell
+    """
+    nprelim = template.nprelim
+    with open(filename, 'w') as fout:
+        for line in template.header_lines:
+            if line.split(':', 1)[0].strip() == 'Number of field cols':
+                line = "Number of field cols:       1\n"
+            fout.write(line)
+        for label, fieldvalues in template.fieldinfo:
+            prelim = [''] * nprelim
+            prelim[-1] = "{}:".format(label) if label else ''
+            value = timestamp if label == 'Time' else (fieldvalues[0] if fieldvalues else '')
+            fout.write("{}, {},\n".format(', '.join(prelim), value))
+        fout.write(template.heading)
+        for cell, lon, lat, value in zip(cells, lons, lats, values):
+            if value == 0:
+                continue
+            fout.write("{}, {}, {}, {}, {:e},\n".format(cell % template.nx + 1, cell // template.nx + 1,
+                                                        lon, lat, value))
+
+
+GROUP_FILE = re.compile(r'^(?P<name>.+)_group(?P<group>\d+)\.txt$')
+
+
+def group_index(outputdir):
+    """
+    Partitions the NAME output files of a run by their output group, without moving or copying them
+    :param outputdir: directory of NAME output files, named *_group<N>.txt
+    :return: dictionary of group number to the sorted list of that group's file paths
+    """
+    groups = {}
+    for filename in os.listdir(outputdir):
+        match = GROUP_FILE.match(filename)
+        if match is None:
+            continue
+        groups.setdefault(int(match.group('group')), []).append(os.path.join(outputdir, filename))
+    for files in groups.values():
+        files.sort()
+    return groups
+
+
+SIDECAR_DIR = '.npcache'
+SIDECAR_ARRAYS = ['cells', 'lons', 'lats', 'values']
+
+
+def sidecar_path(filename):
+    """
+    Directory holding the binary copy of a NAME output file, e.g. outputs/.npcache/20171101_group1.txt/
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(filename)), SIDECAR_DIR, os.path.basename(filename))
+
+
+def write_sidecar(filename, field):
+    """
+    Writes a parsed NAME output file next to the original as .npy arrays plus a JSON file of the header,
+    so it can later be memory-mapped instead of parsed.
+    :param filename: path to the NAME output file
+    :param field: NameField parsed from it
+    """
+    st = os.stat(filename)
+    # Written to a temporary directory then renamed so readers never see a half written sidecar
+    with atomic_dir(sidecar_path(filename), replace=True) as tmpdir:
+        for name in SIDECAR_ARRAYS:
+            np.save(os.path.join(tmpdir, name + '.npy'), getattr(field, name))
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as fout:
+            json.dump({'mtime': st.st_mtime,
+                       'size': st.st_size,
+                       'header_lines': field.header_lines,
+                       'header': list(field.header.items()),
+                       'fieldinfo': field.fieldinfo,
+                       'heading': field.heading,
+                       'timestamps': field.timestamps}, fout)
+
+
+def read_sidecar(filename):
+    """
+    Memory-maps the binary copy of a NAME output file
+    :param filename: path to the NAME output file
+    :return: NameField, or None if there is no sidecar or it is older than the file
+    """
+    path = sidecar_path(filename)
+    try:
+        with open(os.path.join(path, 'meta.json'), 'r') as ins:
+            meta = json.load(ins)
+    except (IOError, OSError, ValueError):
+        return None
+
+    st = os.stat(filename)
+    if meta['mtime'] != st.st_mtime or meta['size'] != st.st_size:
+        return None
+
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in SIDECAR_ARRAYS]
+    return NameField(filename, meta['header_lines'], OrderedDict(meta['header']),
+                     [(label, values) for label, values in meta['fieldinfo']],
+                     meta['heading'], meta['timestamps'], *arrays)
+
+
+def convert_field(filename):
+    """
+    Binary copy of a NAME output file, parsing the text and writing the sidecar on first access
+    :param filename: path to the NAME output file
+    :return: NameField
+    """
+    field = read_sidecar(filename)
+    if field is not None:
+        return field
+
+    LOGGER.debug("Parsing NAME output file %s" % filename)
+    field = read_field(filename)
+    try:
+        write_sidecar(filename, field)
+    except (IOError, OSError) as e:
+        LOGGER.warning("Unable to write binary copy of %s: %s" % (filename, e))
+    return field
+
+
+class FieldCache(object):
+    """
+    Process wide least-recently-used cache of parsed NAME output files.
+
+    Entries are keyed by file path, modification time and size so a file rewritten by NAME is parsed again.
+    """
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._fields = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """
+        :param filename: path to a NAME output file
+        :return: NameField
+        """
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+        with self._lock:
+            field = self._fields.pop(key, None)
+            if field is not None:
+                self._fields[key] = field
+                return field
+
+        field = convert_field(filename)
+
+        with self._lock:
+            if key not in self._fields:
+                self._fields[key] = field
+                self._nbytes += field.nbytes
+            while self._nbytes > self.max_bytes and len(self._fields) > 1:
+                _, old = self._fields.popitem(last=False)
+                self._nbytes -= old.nbytes
+        return field
+
+    def clear(self):
+        with self._lock:
+            self._fields.clear()
+            self._nbytes = 0
+
+
+FIELD_CACHE = FieldCache()
+
+
+def read_column(filename, column):
+    """
+    A single column of a NAME output file, sliced straight out of its binary copy if it has one, otherwise
+    parsing only that column of the text
+    :param filename: path to the NAME output file
+    :param column: index of the column
+    :return: NameField with the one column
+    """
+    field = read_sidecar(filename)
+    if field is not None:
+        return field.select(column)
+    return read_field(filename, column)
+
+
+def load_field(filename):
+    """
+    Parsed contents of a NAME output file, read from its binary copy or parsed only if it isn't already cached
+    :param filename: path to a NAME output file
+    :return: NameField
+    """
+    return FIELD_CACHE.get(filename)
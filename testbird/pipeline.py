@@ -0,0 +1,130 @@
+import os
+import time
+import multiprocessing
+
+from .utils import getjasminconfigs
+from .units import day_outputs
+from .plotting import name_plots_job, run_job, plot_cache, plot_processes
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# The defaults of PlotAll, so a PlotAll request that doesn't change them finds the images in the plot cache
+PLOT_OPTIONS = {'colormap': 'coolwarm'}
+
+
+def finished_days(job, dates, outputsdir):
+    """
+    Days of a running job array that NAME has finished, those whose array index has completed without failing
+    and whose output files are there
+    :param job: scheduler Job
+    :param dates: run date of each array index, from 1
+    :param outputsdir: directory NAME writes the output files to
+    """
+    failed = set(job.failed)
+    return [dates[i - 1] for i in job.completed
+            if i not in failed and i <= len(dates) and day_outputs(outputsdir, dates[i - 1])]
+
+
+def follow(job, dates, outputsdir, on_days, interval=10, timeout=None):
+    """
+    Waits for a job array to finish, handing on each day as soon as NAME has finished it
+    :param job: scheduler Job
+    :param dates: run date of each array index, from 1
+    :param outputsdir: directory NAME writes the output files to
+    :param on_days: called with a list of the days finished since it was last called
+    :param interval: seconds between checks for finished days
+    :param timeout: seconds to wait at most, None to wait for as long as the job takes
+    :return: True if the job finished, False on timeout
+    """
+    handed = set()
+
+    def hand_on():
+        days = [d for d in finished_days(job, dates, outputsdir) if d not in handed]
+        if days:
+            handed.update(days)
+            on_days(days)
+
+    deadline = None if timeout is None else time.time() + timeout
+    while not job.wait(interval if deadline is None else min(interval, deadline - time.time())):
+        hand_on()
+        if deadline is not None and time.time() >= deadline:
+            return False
+    hand_on()
+    return True
+
+
+class DayPlotter(object):
+    """
+    Plots the output of each day of a run as soon as NAME has finished it, on a pool of worker processes,
+    so the plots of the early days of a long run are ready by the time the last day finishes. Days are handed
+    over with add_days, as follow finds them finished.
+
+    Plots go to <rundir>/plots and into the run's plot cache.
+    """
+    def __init__(self, rundir, plotoptions=None, processes=None):
+        """
+        :param rundir: output directory of the run
+        :param plotoptions: drawMap options, PlotAll's defaults if not given
+        :param processes: number of worker processes, taken from the [plotting] configuration if not given
+        """
+        self.outputsdir = os.path.join(rundir, 'outputs')
+        self.outdir = os.path.join(rundir, 'plots')
+        if not os.path.exists(self.outdir):
+            os.makedirs(self.outdir)
+        self.plotoptions = dict(plotoptions or PLOT_OPTIONS, outdir=self.outdir)
+        self.cache = plot_cache(rundir)
+        self.pool = multiprocessing.Pool(processes or plot_processes())
+        self.pending = []
+        self.days = set()
+        self.plots_made = 0
+
+    def add_days(self, dates):
+        """
+        Starts plotting the output files of days that haven't been handed over yet
+        """
+        for rundate in dates:
+            if rundate in self.days:
+                continue
+            self.days.add(rundate)
+            LOGGER.debug("Plotting %s while the rest of the run carries on" % rundate)
+            for filename in day_outputs(self.outputsdir, rundate):
+                job = name_plots_job(filename, self.plotoptions)
+                if self.cache is not None and self.cache.lookup(job.key) is not None:
+                    self.plots_made += len(self.cache.link(job.key, self.outdir))
+                    continue
+                self.pending.append((job, self.pool.apply_async(run_job, (job,))))
+
+    def close(self):
+        """
+        Waits for the plots still being drawn
+        :return: number of plots attempted and a list of (label, error message) for every failed plot
+        """
+        failures = []
+        try:
+            for job, result in self.pending:
+                made, failed, outfiles = result.get()
+                self.plots_made += made
+                failures.extend(failed)
+                if self.cache is not None and outfiles and not failed:
+                    self.cache.store(job.key, outfiles)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            if self.cache is not None:
+                self.cache.evict()
+        for label, error in failures:
+            LOGGER.error("Plot %s failed: %s" % (label, error))
+        return self.plots_made, failures
+
+
+def get_plotter(rundir):
+    """
+    The plotter of a new run when pipelining is switched on by '[pipeline] enabled' in jasmin.cfg
+    :return: DayPlotter, or None
+    """
+    config = getjasminconfigs()
+    if config.get_option('pipeline', 'enabled', 'false').lower() != 'true':
+        return None
+    return DayPlotter(rundir)
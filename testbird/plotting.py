@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from collections import namedtuple
+
+from pywps import configuration
+from pynameplot import Name, drawMap
+
+from .utils import get_config_int, get_config_cpus
+from .units import ContentStore
+from .profiling import worker_dir, profile_call
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# A unit of plotting work. ``func(*args)`` must be a module level (picklable) function that yields
+# (label, data, column, plotoptions) tuples, one per image to be drawn with drawMap. ``key`` identifies
+# the images the job draws, see plot_key, and is None for jobs that shouldn't be cached.
+PlotJob = namedtuple('PlotJob', ['func', 'args', 'key'])
+PlotJob.__new__.__defaults__ = (None,)
+
+PLOT_CACHE_DIR = '.plotcache'
+
+
+def file_fingerprint(filename):
+    """
+    Identifies the contents of a source data file by its path, modification time and size
+    """
+    st = os.stat(filename)
+    return "{}:{}:{}".format(os.path.abspath(filename), st.st_mtime, st.st_size)
+
+
+def plot_key(source, plotoptions):
+    """
+    Render cache key of a plot job
+    :param source: string fingerprinting the data plotted and how it was selected, e.g. the job function,
+                   file_fingerprint of its files and the column
+    :param plotoptions: drawMap options, everything but the output directory counts
+    :return: hex digest
+    """
+    options = dict((k, v) for k, v in plotoptions.items() if k != 'outdir')
+    digest = hashlib.sha1(source.encode('utf-8'))
+    digest.update(json.dumps(options, sort_keys=True, default=repr).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class PlotCache(ContentStore):
+    """
+    Images already drawn for a run, kept in <rundir>/.plotcache under the plot_key of the job that drew them
+    """
+    def __init__(self, rundir, max_entries=0, max_age_days=0):
+        super(PlotCache, self).__init__(os.path.join(rundir, PLOT_CACHE_DIR), max_entries, max_age_days)
+
+
+def plot_cache(rundir):
+    """
+    Store of the images already drawn for a run, configured in the [plotting] section of the pywps config
+    :return: PlotCache, or None if it is switched off
+    """
+    if str(configuration.get_config_value('plotting', 'cache')).lower() == 'false':
+        return None
+    return PlotCache(rundir, max_entries=get_config_int('plotting', 'cache_max_entries'),
+                     max_age_days=get_config_int('plotting', 'cache_max_age_days'))
+
+
+def plot_processes():
+    """
+    Number of worker processes to render plots with, set in the [plotting] section of the pywps config
+    :return: integer, defaults to the number of cpus
+    """
+    return get_config_cpus('plotting', 'processes')
+
+
+def name_plots(filename, plotoptions):
+    """
+    Plot job yielding every timestamp of a single NAME output file
+    """
+    # drawMap only draws a pynameplot Name, which can only be built by parsing a file. Every column of the
+    # file is plotted here, so the one parse is all the reading the job does.
+    n = Name(filename)
+    for column in n.timestamps:
+        yield column, n, column, plotoptions
+
+
+def name_plots_job(filename, plotoptions):
+    """
+    PlotJob drawing every timestamp of a NAME output file, keyed so any request plotting the same file with
+    the same options finds the images in the plot cache
+    """
+    return PlotJob(name_plots, (filename, plotoptions),
+                   plot_key("name_plots:{}".format(file_fingerprint(filename)), plotoptions))
+
+
+def run_job(job):
+    """
+    Draws every plot of a single job, this is what runs in the worker processes.
+
+    The plots are drawn into a staging directory and only moved into the output directory once the whole
+    job is done, so whoever collects the results knows exactly which files it made and that they are complete.
+    :param job: PlotJob
+    :return: number of plots attempted, a list of (label, error message) for those that failed and the paths
+             of the files created
+    """
+    plots_made = 0
+    failures = []
+    stagedir = None
+    try:
+        for label, data, column, plotoptions in job.func(*job.args):
+            if stagedir is None:
+                outdir = plotoptions['outdir']
+                stagedir = tempfile.mkdtemp(prefix='.job', dir=outdir)
+            try:
+                drawMap(data, column, **dict(plotoptions, outdir=stagedir))
+                LOGGER.debug("Plotted %s" % label)
+            except Exception as e:
+                failures.append((label, str(e)))
+            plots_made += 1
+    except Exception as e:
+        failures.append(("{}{}".format(job.func.__name__, job.args[:1]), str(e)))
+
+    outfiles = []
+    if stagedir is not None:
+        for filename in sorted(os.listdir(stagedir)):
+            outfile = os.path.join(outdir, filename)
+            os.rename(os.path.join(stagedir, filename), outfile)
+            outfiles.append(outfile)
+        shutil.rmtree(stagedir, ignore_errors=True)
+    return plots_made, failures, outfiles
+
+
+def _run_indexed(item):
+    index, job, profiledir = item
+    if profiledir is not None:
+        return index, profile_call(profiledir, "plot-{}".format(index), run_job, job)
+    return index, run_job(job)
+
+
+def render(jobs, response, tot_plots, processes=None, start=10, end=95, on_files=None, cache=None, outdir=None):
+    """
+    Fans the plot jobs out over a pool of processes, reporting progress through the WPS response.
+    :param jobs: list of PlotJob
+    :param response: the WPS response object
+    :param tot_plots: expected number of plots, used for the progress percentage
+    :param processes: number of worker processes, taken from the configuration if not given
+    :param start: percentage complete before plotting began
+    :param end: percentage complete once all plots are done
+    :param on_files: called with the list of files each job created as soon as it finishes
+    :param cache: PlotCache of images already drawn, jobs with a key found there are linked into outdir
+                  instead of being drawn again, and the images of those that aren't are added to it
+    :param outdir: output directory the cached images are linked into
+    :return: number of plots attempted and a list of (label, error message) for every failed plot
+    """
+    plots_made = 0
+    failures = []
+    oldper = start
+
+    todo = []
+    for job in jobs:
+        cached = cache.lookup(job.key) if cache is not None and job.key is not None else None
+        if cached is None:
+            todo.append(job)
+            continue
+        outfiles = cache.link(job.key, outdir)
+        plots_made += len(outfiles)
+        if on_files is not None and outfiles:
+            on_files(outfiles)
+    if len(todo) < len(jobs):
+        LOGGER.debug("Reused the images of %s of %s plot jobs" % (len(jobs) - len(todo), len(jobs)))
+
+    if processes is None:
+        processes = plot_processes()
+    processes = min(processes, len(todo))
+
+    # When the request is being profiled each job is profiled too, wherever it runs
+    profiledir = worker_dir()
+    items = [(index, job, profiledir) for index, job in enumerate(todo)]
+
+    pool = None
+    if processes > 1:
+        LOGGER.debug("Rendering %s plot jobs over %s processes" % (len(todo), processes))
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_run_indexed, items)
+    else:
+        results = (_run_indexed(item) for item in items)
+
+    try:
+        for index, (made, failed, outfiles) in results:
+            plots_made += made
+            failures.extend(failed)
+            if cache is not None and todo[index].key is not None and outfiles and not failed:
+                cache.store(todo[index].key, outfiles)
+            if on_files is not None and outfiles:
+                on_files(outfiles)
+            newper = start + int((plots_made / float(max(tot_plots, plots_made, 1))) * (end - start))
+            if oldper != newper:
+                response.update_status("Plotting", newper)
+                oldper = newper
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.evict()
+
+    if failures:
+        LOGGER.warning("%s of %s plots failed" % (len(failures), plots_made))
+
+    return plots_made, failures
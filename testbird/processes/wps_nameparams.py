@@ -5,6 +5,7 @@ from pywps.exceptions import InvalidParameterValue
 from pywps.app.Common import Metadata
 
 from testbird.run_name import run_name
+from testbird.profiling import profiled
 from datetime import timedelta
 
 import logging
@@ -79,6 +80,11 @@ class RunNAME(Process):
                           abstract="Output files (zipped)",
                           supported_formats=[Format('application/x-zipped-shp')],
                           as_reference=True),
+            ComplexOutput('Manifest', 'Output file listing',
+                          abstract="URL, size and sha256 checksum of each output file, so they can be downloaded "
+                                   "individually",
+                          supported_formats=[Format('application/json')],
+                          as_reference=True),
             ComplexOutput('ExamplePlot', 'Example Plot of initial time point',
                           abstract='Example plot of initial time point',
                           supported_formats=[Format('image/tiff')],
@@ -99,6 +105,7 @@ class RunNAME(Process):
             store_supported=True,
             status_supported=True)
 
+    @profiled
     def _handler(self, request, response):
 
         # Need to process the elevationOut inputs from a list of strings, into an array of tuples.
@@ -148,9 +155,10 @@ class RunNAME(Process):
 
         response.update_status("Processed parameters", 5)
 
-        outdir, zippedfile, mapfile = run_name(params, response)
+        outdir, zippedfile, mapfile, manifestfile = run_name(params, response)
 
-        response.outputs['FileContents'].file = zippedfile + '.zip'
+        response.outputs['FileContents'].file = zippedfile
+        response.outputs['Manifest'].file = manifestfile
         response.outputs['runid'].data = outdir
         response.outputs['ExamplePlot'].file = mapfile
 
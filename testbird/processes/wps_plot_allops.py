@@ -4,21 +4,81 @@ from pywps import LiteralInput
 from pywps.app.Common import Metadata
 from pywps.exceptions import InvalidParameterValue
 
-from pynameplot import Name, drawMap, Sum
-from pynameplot.namereader import util
+from pynameplot import Name
 
 from datetime import datetime
 import shutil
 import os
 import calendar
-import glob
 import tempfile
 from testbird.utils import getjasminconfigs, get_num_dates
+from testbird.plotting import PlotJob, render, plot_key, plot_cache, file_fingerprint, name_plots_job
+from testbird.nameoutput import group_index, write_field, read_column
+from testbird.runindex import build_index
+from testbird.summation import Summation
+from testbird.archive import ZipArchive, output_path
+from testbird.manifest import Manifest
+from testbird.telemetry import RunTelemetry
+from testbird.profiling import profiled, phase, profile_to
 
 import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
+def timestamp_plots(filename, column, colfile, plotoptions):
+    """
+    Plot job yielding a single timestamp of a NAME output file. Only that column is read, and it is written
+    out as a single column NAME file so pynameplot doesn't have to parse the whole of the original.
+
+    drawMap needs a pynameplot Name, which builds its cell polygons while parsing a file and can't be made
+    from an array already in memory, so the column goes through a file rather than straight from the cache.
+    """
+    field = read_column(filename, column)
+    timestamp = field.timestamps[0]
+    write_field(colfile, field, timestamp, field.cells, field.lons, field.lats, field.values[0])
+    yield timestamp, Name(colfile), timestamp, plotoptions
+
+
+def summary_plots(template, summed, sumfile, caption, outfile, plotoptions):
+    """
+    Plot job yielding a plot of summed concentrations. The sums are written out as a single column NAME file
+    so they can be drawn in the same way as any other NAME output.
+    """
+    cells, lons, lats, values = summed
+    timestamp = template.timestamps[-1]
+    write_field(sumfile, template, timestamp, cells, lons, lats, values)
+    n = Name(sumfile)
+    options = dict(plotoptions)
+    options['caption'] = caption
+    options['outfile'] = outfile
+    yield outfile, n, timestamp, options
+
+
+def summary_names(field, direction, summarise, period):
+    """
+    Caption and file name of a summary plot
+    :param field: NameField of one of the summed files
+    :param direction: Forwards or Backwards
+    :param summarise: one of 'day', 'week', 'month' or 'all'
+    :param period: as returned by Summation.periods
+    :return: caption, outfile
+    """
+    prefix = "{} {} {} {}".format(field.runname, field.averaging, field.altitude, direction)
+    altitude = field.altitude.strip('()')
+    if summarise == 'day':
+        return ("{}: {} day sum (UTC)".format(prefix, period.strftime("%Y%m%d")),
+                "{}_{}_{}_daily.png".format(field.runname, altitude, period.strftime("%Y%m%d")))
+    elif summarise == 'week':
+        return ("{}: {} week {} sum (UTC)".format(prefix, period[0], period[1]),
+                "{}_{}_{}_{}_weekly.png".format(field.runname, altitude, period[0], period[1]))
+    elif summarise == 'month':
+        return ("{}: {} {} sum (UTC)".format(prefix, period[0], calendar.month_name[period[1]]),
+                "{}_{}_{}_{}_monthly.png".format(field.runname, altitude, period[0], period[1]))
+    else:
+        return ("{}: Summed (UTC)".format(prefix),
+                "{}_{}_summed_all.png".format(field.runname, altitude))
+
+
 class PlotAll(Process):
     """
     Notes
@@ -62,6 +122,10 @@ class PlotAll(Process):
                                              Format('image/png'),
                                              FORMATS.GEOTIFF],
                           as_reference=True),
+            ComplexOutput('Manifest', 'Plot file listing',
+                          abstract="URL, size and sha256 checksum of each plot, listed as soon as it is drawn",
+                          supported_formats=[Format('application/json')],
+                          as_reference=True),
             ]
 
         super(PlotAll, self).__init__(
@@ -79,11 +143,13 @@ class PlotAll(Process):
             store_supported=True,
             status_supported=True)
 
+    @profiled
     def _handler(self, request, response):
 
         jasconfigs = getjasminconfigs()
-        rundir = os.path.join(jasconfigs.get('jasmin', 'outputdir'), request.inputs['filelocation'][0].data)
+        rundir = os.path.join(jasconfigs.outputdir, request.inputs['filelocation'][0].data)
         LOGGER.debug("Working Directory for plots: %s" % rundir)
+        profile_to(rundir)
 
         # Parse NAME run input params
         inputs = {}
@@ -109,8 +175,9 @@ class PlotAll(Process):
             else:
                 plotoptions[p] = request.inputs[p][0].data
 
-        files = glob.glob(os.path.join(rundir, 'outputs', '*_group*.txt'))
-        if len(files) == 0:
+        # Output files are grouped in place by the group number in their name
+        groups = group_index(os.path.join(rundir, 'outputs'))
+        if len(groups) == 0:
             raise InvalidParameterValue("Unable to find any output files. File names must be named '*_group*.txt'")
 
         if 'timestamp' in request.inputs:
@@ -125,165 +192,104 @@ class PlotAll(Process):
                                   sum=request.inputs['summarise'][0].data,
                                   type=inputs['timestamp'])
 
-        # We need to find all the groups and loop through them one at a time!
-        groups = {}
-        for filename in os.listdir(os.path.join(rundir, 'outputs')):
-            groupnum = filename[14]
-            try:
-                groupnum = int(groupnum)
-            except:
-                raise Exception("Cannot identify groupnumber %s" % groupnum)
-
-            if groupnum in groups:
-                shutil.copy(os.path.join(rundir, 'outputs', filename), groups[groupnum])
-            else:
-                groups[groupnum] = tempfile.mkdtemp()
-                shutil.copy(os.path.join(rundir, 'outputs', filename), groups[groupnum])
-
         ngroups = len(groups)
         tot_plots = tot_plots * ngroups
-        plots_made = 0
 
         response.update_status("Plotting", 10)
 
-        oldper = 10
-
-        for groupnum, tmpdir in sorted(groups.items()):
-            if request.inputs['summarise'][0].data != 'NA':
-                s = Sum(tmpdir)
-
-            if request.inputs['summarise'][0].data == 'week':
-                for week in range(1, 53):
-                    s.sumWeek(week)
-                    if len(s.files) == 0:
-                        LOGGER.debug("No files found for week %s" % week)
-                        continue
-                    plotoptions['caption'] = "{} {} {} {}: {} week {} sum (UTC)".format(s.runname, s.averaging,
-                                                                                        s.altitude, s.direction,
-                                                                                        s.year, week)
-                    plotoptions['outfile'] = "{}_{}_{}_{}_weekly.png".format(s.runname, s.altitude.strip('()'),
-                                                                             s.year, week)
-                    try:
-                        drawMap(s, 'total', **plotoptions)
-                        LOGGER.debug("Plotted %s" % plotoptions['outfile'])
-                    except:
-                        LOGGER.error("Failed to plot %s" % plotoptions['outfile'])
-                    plots_made += 1
-                    newper = 10+int((plots_made/float(tot_plots))*85)
-                    if oldper != newper:
-                        response.update_status("Plotting", newper)
-                        oldper = newper
-
-            elif request.inputs['summarise'][0].data == 'month':
-                for month in range(1, 13):
-                    s.sumMonth(str(month))
-                    if len(s.files) == 0:
-                        LOGGER.debug("No files found for month %s" % month)
-                        continue
-                    plotoptions['caption'] = "{} {} {} {}: {} {} sum (UTC)".format(s.runname, s.averaging, s.altitude,
-                                                                             s.direction, s.year,
-                                                                             calendar.month_name[month])
-                    plotoptions['outfile'] = "{}_{}_{}_{}_monthly.png".format(s.runname, s.altitude.strip('()'),
-                                                                              s.year, month)
-                    try:
-                        drawMap(s, 'total', **plotoptions)
-                        LOGGER.debug("Plotted %s" % plotoptions['outfile'])
-                    except:
-                        LOGGER.error("Failed to plot %s" % plotoptions['outfile'])
-                    plots_made += 1
-                    newper = 10 + int((plots_made / float(tot_plots)) * 85)
-                    if oldper != newper:
-                        response.update_status("Plotting", newper)
-                        oldper = newper
-
-            elif request.inputs['summarise'][0].data == 'all':
-                s.sumAll()
-                plotoptions['caption'] = "{} {} {} {}: Summed (UTC)".format(s.runname, s.averaging, s.altitude,
-                                                                            s.direction)
-                plotoptions['outfile'] = "{}_{}_summed_all.png".format(s.runname, s.altitude.strip('()'))
-                try:
-                    drawMap(s, 'total', **plotoptions)
-                    LOGGER.debug("Plotted %s" % plotoptions['outfile'])
-                except:
-                    LOGGER.error("Failed to plot %s" % plotoptions['outfile'])
-                plots_made += 1
-                newper = 10 + int((plots_made / float(tot_plots)) * 85)
-                if oldper != newper:
-                    response.update_status("Plotting", newper)
-                    oldper = newper
+        timestamp = None
+        if 'timestamp' in request.inputs:
+            timestamp = datetime.strftime(request.inputs['timestamp'][0].data, "%d/%m/%Y %H:%M UTC")
+            LOGGER.debug("Reformatted time: %s" % timestamp)
+
+        summarise = request.inputs['summarise'][0].data
+        direction = 'Backwards' if inputs.get('runBackwards') == 'True' else 'Forwards'
+        sumdir = tempfile.mkdtemp()
+
+        # Reading and summing the NAME output files
+        with phase('parse'):
+            jobs = []
+            if timestamp is not None:
+                # Only the files holding the requested time are read, found from the run's timestamp index
+                for groupnum, filename, column in build_index(os.path.join(rundir, 'outputs')).lookup(timestamp):
+                    colfile = os.path.join(sumdir, "{}_{}.txt".format(os.path.basename(filename)[:-len('.txt')],
+                                                                      column))
+                    source = "timestamp_plots:{}:{}".format(file_fingerprint(filename), column)
+                    jobs.append(PlotJob(timestamp_plots, (filename, column, colfile, plotoptions),
+                                        plot_key(source, plotoptions)))
+                tot_plots = len(jobs)
             else:
-                for filename in os.listdir(tmpdir):
-                    if '_group' in filename and filename.endswith('.txt'):
-                        if request.inputs['summarise'][0].data == 'day':
-                            #s = Sum(tmpdir)
-                            date = util.shortname(filename)
-                            s.sumDay(date)
-                            plotoptions['caption'] = "{} {} {} {}: {}{}{} day sum (UTC)".format(s.runname, s.averaging,
-                                                                                          s.altitude, s.direction,
-                                                                                          s.year, s.month, s.day)
-                            plotoptions['outfile'] = "{}_{}_{}{}{}_daily.png".format(s.runname, s.altitude.strip('()'),
-                                                                                     s.year, s.month, s.day)
-                            try:
-                                drawMap(s, 'total', **plotoptions)
-                                LOGGER.debug("Plotted %s" % plotoptions['outfile'])
-                            except:
-                                LOGGER.error("Failed to plot %s" % plotoptions['outfile'])
-                            plots_made += 1
-                            newper = 10 + int((plots_made / float(tot_plots)) * 85)
-                            if oldper != newper:
-                                response.update_status("Plotting", newper)
-                                oldper = newper
-                        elif request.inputs['summarise'][0].data == 'NA':
-                            n = Name(os.path.join(tmpdir, filename))
-                            if 'timestamp' in request.inputs:
-                                timestamp = datetime.strftime(request.inputs['timestamp'][0].data, "%d/%m/%Y %H:%M UTC")
-                                LOGGER.debug("Reformatted time: %s" % timestamp)
-                                if timestamp in n.timestamps:
-                                    try:
-                                        drawMap(n, timestamp, **plotoptions)
-                                        LOGGER.debug("Plotted %s" % timestamp)
-                                    except:
-                                        LOGGER.error("Failed to plot %s" % timestamp)
-                                    plots_made += 1
-                                    newper = 10 + int((plots_made / float(tot_plots)) * 85)
-                                    if oldper != newper:
-                                        response.update_status("Plotting", newper)
-                                        oldper = newper
-                                    break
-                            else:
-                                for column in n.timestamps:
-                                    try:
-                                        drawMap(n, column, **plotoptions)
-                                        LOGGER.debug("Plotted %s" % column)
-                                    except:
-                                        LOGGER.error("Failed to plot %s" % column)
-                                    plots_made += 1
-                                    newper = 10 + int((plots_made / float(tot_plots)) * 85)
-                                    if oldper != newper:
-                                        response.update_status("Plotting", newper)
-                                        oldper = newper
-
-            # Finished plotting so will now delete temp directory
-            shutil.rmtree(tmpdir)
+                for groupnum, files in sorted(groups.items()):
+                    if summarise == 'NA':
+                        for filename in files:
+                            jobs.append(name_plots_job(filename, plotoptions))
+                    else:
+                        # All the files of the group are loaded once and summed over every period in one pass
+                        for period, fields, summed in Summation(files).periods(summarise):
+                            caption, outfile = summary_names(fields[0], direction, summarise, period)
+                            sumfile = os.path.join(sumdir, outfile.replace('.png', '.txt'))
+                            source = "summary_plots:{}:{}:{}".format(
+                                caption, outfile, ','.join(file_fingerprint(f.filename) for f in fields))
+                            jobs.append(PlotJob(summary_plots, (fields[0].header_only(), summed, sumfile,
+                                                                caption, outfile, plotoptions),
+                                                plot_key(source, plotoptions)))
+
+        # Create the output directory up front so the worker processes don't race to make it
+        if not os.path.exists(plotoptions['outdir']):
+            os.makedirs(plotoptions['outdir'])
+
+        # Named after the request's plot directory, so requests on the same run don't overwrite each other's
+        plotsname = "{}_{}".format(request.inputs['filelocation'][0].data, os.path.basename(plotoptions['outdir']))
+        # Plots are compressed into the zip file as each job finishes rather than all at the end
+        archive = ZipArchive(output_path("{}.zip".format(plotsname)))
+        # and published individually, so they can be downloaded while the rest are still being drawn
+        manifest = Manifest(plotsname)
+        response.update_status("Plots listed at {} as they are drawn".format(manifest.url), 10)
+
+        def archive_plots(files):
+            for filename in files:
+                archive.add(filename, os.path.relpath(filename, plotoptions['outdir']))
+                manifest.add(filename, os.path.relpath(filename, plotoptions['outdir']))
+
+        telemetry = RunTelemetry(rundir)
+        try:
+            # Images an earlier request already drew with the same data and options are reused
+            with telemetry.stage('plotting'):
+                plots_made, failures = render(jobs, response, tot_plots, on_files=archive_plots,
+                                              cache=plot_cache(rundir), outdir=plotoptions['outdir'])
+        except Exception:
+            archive.abort()
+            telemetry.save()
+            raise
+        for label, error in failures:
+            LOGGER.error("Plot %s failed: %s" % (label, error))
+
+        # Finished plotting so will now delete the summed files
+        shutil.rmtree(sumdir)
 
         # Outputting different response based on the number of plots generated
         response.update_status("Formatting output", 95)
-        if not os.path.exists(plotoptions['outdir']):
+        if len(os.listdir(plotoptions['outdir'])) == 0:
             LOGGER.debug("Did not create any plots")
+            archive.abort()
             response.outputs['FileContents'].data_format = FORMATS.TEXT
             response.outputs['FileContents'].data = "No plots created, check input options"
         else:
             if len(os.listdir(plotoptions['outdir'])) == 1:
                 LOGGER.debug("Only one output plot")
+                archive.abort()
                 response.outputs['FileContents'].data_format = Format('image/png')
                 response.outputs['FileContents'].file = os.path.join(plotoptions['outdir'],
                                                                      os.listdir(plotoptions['outdir'])[0])
             else:
-                zippedfile = "{}_plots".format(request.inputs['filelocation'][0].data)
-                shutil.make_archive(zippedfile, 'zip', plotoptions['outdir'])
-                LOGGER.debug("Zipped file: %s (%s bytes)" % (zippedfile+'.zip', os.path.getsize(zippedfile+'.zip')))
+                with telemetry.stage('plot_zip'):
+                    zippedfile = archive.close()
+                LOGGER.debug("Zipped file: %s (%s bytes)" % (zippedfile, os.path.getsize(zippedfile)))
                 response.outputs['FileContents'].data_format = FORMATS.SHP
-                response.outputs['FileContents'].file = zippedfile + '.zip'
+                response.outputs['FileContents'].file = zippedfile
+
+        response.outputs['Manifest'].file = manifest.close()
+        telemetry.save()
 
         response.update_status("done", 100)
         return response
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import glob
+import pstats
+import shutil
+import cProfile
+import functools
+import tempfile
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+PROFILE_DIR = '.profile'
+
+# Number of functions listed in the text summaries
+TOP_FUNCTIONS = 50
+TOP_ALLOCATIONS = 20
+
+_active = threading.local()
+
+
+def _option(option, default):
+    value = configuration.get_config_value('profiling', option)
+    if value is None or value == '':
+        return default
+    return value
+
+
+class Sampler(object):
+    """
+    Samples the stack of one thread at a fixed interval, counting how often each call stack is seen.
+    Cheaper than cProfile on long requests, and the counts are in the folded format flame graph tools read.
+    """
+    def __init__(self, ident, interval=0.01):
+        self.ident = ident
+        self.interval = interval
+        self.stacks = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='Sampler')
+        self._thread.daemon = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, filename):
+        with open(filename, 'w') as fout:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                fout.write("{} {}\n".format(stack, count))
+
+
+class RequestProfiler(object):
+    """
+    Profiles a single WPS request: the time taken by each phase, cProfile statistics or stack samples of the
+    handler, cProfile statistics of the plotting workers and, on Python 3, tracemalloc snapshots at the end
+    of each phase.
+
+    Everything is written to <directory>/.profile/<process>-<time>/ once the request is done.
+    """
+    def __init__(self, name, mode='cprofile', interval=0.01, tracemalloc_frames=0):
+        """
+        :param name: process identifier
+        :param mode: cprofile, or sample to take stack samples every interval seconds
+        :param tracemalloc_frames: frames kept of each allocation traceback, 0 not to trace allocations
+        """
+        self.name = name
+        self.mode = mode
+        self.interval = interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.directory = None
+        self.phases = []
+        self.allocations = []
+        self.workdir = tempfile.mkdtemp(prefix='profile')
+        self._profile = None
+        self._sampler = None
+        self._tracemalloc = None
+        self._snapshot = None
+
+    def start(self):
+        self.started = time.time()
+        if self.tracemalloc_frames:
+            try:
+                import tracemalloc
+            except ImportError:
+                LOGGER.warning("tracemalloc is not available, allocations won't be profiled")
+            else:
+                # Left alone if something else is already tracing
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(self.tracemalloc_frames)
+                    self._tracemalloc = tracemalloc
+                    self._snapshot = tracemalloc.take_snapshot()
+        if self.mode == 'sample':
+            self._sampler = Sampler(threading.current_thread().ident, self.interval)
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        _active.profiler = self
+
+    def stop(self):
+        _active.profiler = None
+        if self._profile is not None:
+            self._profile.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.seconds = time.time() - self.started
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the body of a with statement as a phase of the request
+        """
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append({'phase': name, 'start': started - self.started, 'seconds': time.time() - started})
+            if self._tracemalloc is not None:
+                snapshot = self._tracemalloc.take_snapshot()
+                top = snapshot.compare_to(self._snapshot, 'lineno')[:TOP_ALLOCATIONS]
+                self.allocations.append((name, [str(stat) for stat in top]))
+                self._snapshot = snapshot
+
+    def save(self, directory=None):
+        """
+        Writes the results and stops tracing allocations
+        :param directory: run directory the results go in, the one set with profile_to or the temporary
+                          directory if not given
+        :return: path of the results
+        """
+        if self._tracemalloc is not None:
+            self._tracemalloc.stop()
+            self._tracemalloc = None
+
+        directory = directory or self.directory or tempfile.gettempdir()
+        path = os.path.join(directory, PROFILE_DIR, "{}-{}".format(
+            self.name, datetime.strftime(datetime.now(), "%Y%m%d%H%M%S%f")))
+        try:
+            os.makedirs(path)
+            with open(os.path.join(path, 'phases.json'), 'w') as fout:
+                json.dump({'process': self.name, 'seconds': self.seconds, 'phases': self.phases}, fout, indent=1)
+            if self._profile is not None:
+                self._write_stats(pstats.Stats(self._profile), path, 'handler')
+            if self._sampler is not None:
+                self._sampler.write(os.path.join(path, 'samples.txt'))
+            workers = glob.glob(os.path.join(self.workdir, '*.prof'))
+            if workers:
+                self._write_stats(pstats.Stats(*workers), path, 'plots')
+            if self.allocations:
+                with open(os.path.join(path, 'tracemalloc.txt'), 'w') as fout:
+                    for name, top in self.allocations:
+                        fout.write("{}\n{}\n\n".format(name, "\n".join(top)))
+            LOGGER.info("Profile of %s written to %s" % (self.name, path))
+        except (IOError, OSError) as e:
+            LOGGER.warning("Unable to write the profile of %s: %s" % (self.name, e))
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return path
+
+    def _write_stats(self, stats, path, name):
+        stats.dump_stats(os.path.join(path, name + '.prof'))
+        with open(os.path.join(path, name + '.txt'), 'w') as fout:
+            stats.stream = fout
+            stats.sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+
+
+def get_profiler(name):
+    """
+    A profiler for a request when switched on by '[profiling] enabled' in the pywps config
+    :param name: process identifier
+    :return: RequestProfiler, or None
+    """
+    if str(_option('enabled', 'false')).lower() != 'true':
+        return None
+    return RequestProfiler(name, mode=str(_option('mode', 'cprofile')).lower(),
+                           interval=float(_option('interval', 0.01)),
+                           tracemalloc_frames=int(_option('tracemalloc', 0)))
+
+
+def profiled(handler):
+    """
+    Decorator profiling a process handler when profiling is switched on
+    """
+    @functools.wraps(handler)
+    def wrapper(process, request, response):
+        profiler = get_profiler(process.identifier)
+        if profiler is None:
+            return handler(process, request, response)
+        profiler.start()
+        try:
+            return handler(process, request, response)
+        finally:
+            profiler.stop()
+            profiler.save()
+    return wrapper
+
+
+def current():
+    """
+    :return: RequestProfiler of the request running in this thread, or None
+    """
+    return getattr(_active, 'profiler', None)
+
+
+@contextmanager
+def phase(name):
+    """
+    Times a phase of the request running in this thread, if it is being profiled
+    """
+    profiler = current()
+    if profiler is None:
+        yield
+    else:
+        with profiler.phase(name):
+            yield
+
+
+def profile_to(directory):
+    """
+    Sets the run directory the profile of the request running in this thread is written to
+    """
+    profiler = current()
+    if profiler is not None:
+        profiler.directory = directory
+
+
+def worker_dir():
+    """
+    :return: directory plotting workers write their cProfile statistics to, None unless the request running
+             in this thread is being profiled
+    """
+    profiler = current()
+    if profiler is None:
+        return None
+    return profiler.workdir
+
+
+def profile_call(directory, name, func, *args):
+    """
+    Runs func(*args) under cProfile, writing the statistics to <directory>/<name>.prof
+    """
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(func, *args)
+    finally:
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
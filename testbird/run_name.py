@@ -1,13 +1,26 @@
 import os
-import shutil
-import subprocess
-import time
 from datetime import timedelta, datetime
 from pynameplot import Name, drawMap
 
-from .utils import daterange, getjasminconfigs
-from .write_inputfile import generate_inputfile
+from .utils import daterange, getjasminconfigs, makedirs
+from .write_inputfile import InputFileGenerator, GridSpec, get_max_cells
 from .write_scriptfile import write_file
+from .scheduler import submit, get_scheduler, SchedulerError
+from .runcache import get_runcache, run_key
+from .units import get_unitstore, unit_key, day_outputs
+from .archive import ZipArchive, output_path
+from .manifest import Manifest
+from .costmodel import get_runstats
+from .telemetry import RunTelemetry
+from .profiling import profile_to
+from .pipeline import get_plotter, follow
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Result files a cached run returns
+RESULTS = ('zip', 'map', 'manifest')
 
 
 def run_name(params, response):
@@ -15,7 +28,7 @@ def run_name(params, response):
     This is the function to actually run NAME
     :param params: input parameters
     :param response: the WPS response object
-    :return: names of the output dir and zipped file
+    :return: name of the output dir, path of the zipped file, path of the example plot and path of the manifest
     """
 
     # replace any white space in title with underscores
@@ -30,15 +43,126 @@ def run_name(params, response):
 
     jasconfigs = getjasminconfigs()
 
-    runtime = datetime.strftime(datetime.now(), "%s")
-    params['runid'] = "{}{}_{}_{}_{}".format(runtype, params['time'], params['timestamp'], params['title'], runtime)
+    # The run has one input file for each date in range, including the final day
+    dates = list(daterange(params['startdate'], params['enddate'] + timedelta(days=1)))
+
+    # The grids are worked out once for the whole run, and runs too large to handle are turned away before
+    # anything is written
+    grid = GridSpec(params)
+    grid.check(get_max_cells())
+
+    # An identical run that has already completed returns the same files, nothing is run or made again
+    runcache = get_runcache()
+    runkey = None
+    if runcache is not None:
+        runkey = run_key(params, dates, grid)
+        cached = runcache.lookup(runkey)
+        # Entries recorded without the result files are run again, which stores them with the files
+        if cached is not None and all(name in cached[1] for name in RESULTS):
+            params['runid'], results = cached
+            params['outputdir'] = os.path.join(jasconfigs.outputdir, params['runid'])
+            profile_to(params['outputdir'])
+            response.update_status("Reusing results of run {}".format(params['runid']), 95)
+            return params['runid'], results['zip'], results['map'], results['manifest']
 
-    params['outputdir'] = os.path.join(jasconfigs.get('jasmin', 'outputdir'), params['runid'])
+    runtime = datetime.strftime(datetime.now(), "%s")
+    params['runid'] = "{}{}_{}_{}_{}".format(runtype, params['time'], params['timestamp'], params['title'],
+                                             runtime)
+    params['outputdir'] = os.path.join(jasconfigs.outputdir, params['runid'])
+    # The request's profile goes with the run even if it fails part way through
+    profile_to(params['outputdir'])
+    outputsdir = os.path.join(params['outputdir'], 'outputs')
+    telemetry = RunTelemetry(params['outputdir'], runid=params['runid'], site=params['title'],
+                             runtype="{} {}".format(runtype, params['timestamp']), days=len(dates))
+
+    # Each day's output is compressed as soon as it is there, the rest of the run directory is added at the end
+    archive = ZipArchive(output_path(params['runid'] + '.zip'))
+    try:
+        # Days already run by an overlapping request are linked in from the unit store before anything is
+        # submitted, so they can't be evicted while NAME runs the rest. Any that can't be linked are run again.
+        units = get_unitstore()
+        reused = []
+        if units is not None:
+            makedirs(outputsdir)
+            reused = [d for d in dates if units.link(unit_key(params, d), outputsdir)]
+        todo = [d for d in dates if d not in reused]
+        if reused:
+            LOGGER.info("Reusing %s of the %s days of run %s" % (len(reused), len(dates), params['runid']))
+
+        # In pipeline mode each day is also plotted as soon as NAME has finished it
+        plotter = get_plotter(params['outputdir'])
+
+        def days_finished(days):
+            for rundate in days:
+                for filename in day_outputs(outputsdir, rundate):
+                    archive.add(filename, os.path.join('outputs', os.path.basename(filename)))
+            if plotter is not None:
+                plotter.add_days(days)
+
+        try:
+            days_finished(reused)
+            completed = submit_run(params, response, todo, telemetry, days_finished, grid)
+
+            if units is not None:
+                for rundate in completed:
+                    units.store(unit_key(params, rundate), day_outputs(outputsdir, rundate), params['runid'])
+                units.evict()
+        finally:
+            if plotter is not None:
+                with telemetry.stage('pipeline_plots'):
+                    plotter.close()
+
+        response.update_status("NAME simulation finished", 95)
+
+        # TODO: Need to replace this with an actual result file
+        fakefile = os.path.join(jasconfigs.outputdir, '20171101_output.txt')
+
+        with telemetry.stage('example_plot'):
+            n = Name(fakefile)
+            # Next to the zip rather than in the request's working directory, which goes when the request ends,
+            # so the run cache can return it to later requests
+            mapfile = output_path(params['runid'] + '_ExamplePlot.png')
+            drawMap(n, n.timestamps[0], outdir=os.path.dirname(mapfile), outfile=os.path.basename(mapfile))
+
+        # The files are published one by one first, so they can be fetched without waiting for the zip
+        manifest = Manifest(params['runid'])
+        response.update_status("Output files listed at {}".format(manifest.url), 95)
+        with telemetry.stage('manifest'):
+            manifest.add_tree(params['outputdir'])
+            manifestfile = manifest.close()
+
+        # Zip all the output files into one directory to be served back to the user.
+        with telemetry.stage('zip'):
+            archive.add_tree(params['outputdir'])
+            zippedfile = archive.close()
+    except BaseException:
+        archive.abort()
+        raise
+    telemetry.save()
+
+    # Only a run with the output of every day is worth reusing, NAME can succeed without writing any
+    if runcache is not None and len(completed) == len(todo) and all(day_outputs(outputsdir, d) for d in dates):
+        runcache.store(runkey, params['runid'], {'zip': zippedfile, 'map': mapfile, 'manifest': manifestfile})
+
+    return params['runid'], zippedfile, mapfile, manifestfile
+
+
+def submit_run(params, response, dates, telemetry, on_days=None, grid=None):
+    """
+    Writes the input files and job script of a new run, and runs NAME if submitting jobs is switched on
+    :param params: input parameters, including the runid and outputdir of the run
+    :param response: the WPS response object
+    :param dates: run dates, one input file each
+    :param telemetry: RunTelemetry the stages and tasks of the run are recorded in
+    :param on_days: called with the days NAME has finished, as they finish
+    :param grid: GridSpec of the run, if it has already been worked out
+    :return: the dates NAME ran successfully for, which is all of them when there is nothing to run
+    """
+    jasconfigs = getjasminconfigs()
 
-    if not os.path.exists(params['outputdir']):
-        os.makedirs(params['outputdir'])
-        os.makedirs(os.path.join(params['outputdir'], 'inputs'))
-        os.makedirs(os.path.join(params['outputdir'], 'outputs'))
+    for dirname in ['inputs', 'outputs']:
+        if not os.path.exists(os.path.join(params['outputdir'], dirname)):
+            os.makedirs(os.path.join(params['outputdir'], dirname))
 
     # Will write a file that lists all the input parameters
     with open(os.path.join(params['outputdir'], 'user_input_parameters.txt'), 'w') as ins:
@@ -47,48 +171,45 @@ def run_name(params, response):
                 continue
             ins.write("%s: %s\n" % (p, params[p]))
 
-    # Will loop through all the dates in range, including the final day
-    for i, cur_date in enumerate(daterange(params['startdate'], params['enddate'] + timedelta(days=1))):
-        os.makedirs(os.path.join(params['outputdir'], 'met_data', "input{}".format(i+1)))
-        with open(os.path.join(params['outputdir'], "inputs", "input{}.txt".format(i+1)), 'w') as fout:
-            fout.write(generate_inputfile(params, cur_date, i+1))
+    if not dates:
+        response.update_status("All days already run", 10)
+        return []
+
+    # Will generate the input files for all the dates
+    with telemetry.stage('inputs'):
+        for i in range(len(dates)):
+            os.makedirs(os.path.join(params['outputdir'], 'met_data', "input{}".format(i+1)))
+        nruns = InputFileGenerator(params, grid).write_all(dates, os.path.join(params['outputdir'], "inputs"))
 
-    with open(os.path.join(params['outputdir'], 'script.bsub'), 'w') as fout:
-        fout.write(write_file(params, i+1))
+    scheduler = get_scheduler()
+    scriptfile = os.path.join(params['outputdir'], scheduler.scriptname)
+    with open(scriptfile, 'w') as fout:
+        fout.write(write_file(params, nruns, scheduler, grid))
 
     response.update_status("Input files created", 10)
 
-    # TODO: We'll insert the commands to run NAME here.
-    # cat = subprocess.Popen(['cat', os.path.join(params['outputdir'], 'script.bsub')], stdout=subprocess.PIPE)
-    # runbsub = subprocess.Popen('bsub', stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=cat.stdout)
-    # sout, serr = runbsub.communicate()
-    # jobid = sout.split(' ')[1].replace('>', '').replace('<', '')
-    # jobrunning = True
-    # while jobrunning:
-    #     time.sleep(30)
-    #     checkjob = subprocess.check_output('bjobs')
-    #     if jobid in checkjob:
-    #         print("Job %s is still running" % jobid)
-    #           processesrunning = 0
-    #           for l in checkjob.split('\n'):
-    #               if jobid in l:
-    #                   processesrunning += 1
-    #           percentcomplete = (((i+1)-processesrunning)/float(i+1))*85
-    #           response.update_status("Running NAME", 10+percentcomplete)
-    #     else:
-    #         jobrunning = False
-
-    response.update_status("NAME simulation finished", 95)
-
-    # TODO: Need to replace this with an actual result file
-    fakefile = os.path.join(jasconfigs.get('jasmin', 'outputdir'), '20171101_output.txt')
-
-    n = Name(fakefile)
-    mapfile = "ExamplePlot.png"
-    drawMap(n, n.timestamps[0], outfile=mapfile)
-
-    # Zip all the output files into one directory to be served back to the user.
-    zippedfile = params['runid']
-    shutil.make_archive(zippedfile, 'zip', params['outputdir'])
-
-    return params['runid'], zippedfile, mapfile
+    if jasconfigs.get_option('scheduler', 'submit', 'false').lower() == 'true':
+        def progress(completed, total):
+            response.update_status("Running NAME", 10 + int((completed / float(total)) * 85))
+
+        # The job is polled from the process's monitor thread, this just waits to be told it has finished. The
+        # request, and under pywps the process it runs in, is held until then.
+        timeout = float(jasconfigs.get_option('scheduler', 'timeout', '48')) * 3600 or None
+        with telemetry.stage('name'):
+            job = submit(scriptfile, nruns, cwd=params['outputdir'], on_progress=progress)
+            if on_days is not None:
+                finished = follow(job, dates, os.path.join(params['outputdir'], 'outputs'), on_days,
+                                  float(jasconfigs.get_option('pipeline', 'interval', '10')), timeout)
+            else:
+                finished = job.wait(timeout)
+        if not finished:
+            get_scheduler().cancel(job.jobid)
+            raise SchedulerError("NAME job {} of run {} didn't finish within {:g} hours and has been cancelled"
+                                 .format(job.jobid, params['runid'], timeout / 3600))
+        if job.failed:
+            LOGGER.warning("NAME failed on inputs %s of run %s" % (job.failed, params['runid']))
+        telemetry.add_tasks(job.jobid, dates, job.failed)
+        # What the days actually cost calibrates the estimates for later runs
+        get_runstats().record_job(params, dates, job.jobid, job.failed, grid)
+        return [rundate for i, rundate in enumerate(dates, 1) if i not in job.failed]
+    return []
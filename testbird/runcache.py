@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+from .utils import getjasminconfigs, makedirs, write_json
+from .write_inputfile import InputFileGenerator
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Parameters that change from one run to the next without changing what NAME computes
+VOLATILE_PARAMS = ('runid', 'outputdir', 'runDuration', 'npart', 'ntimesperhour')
+
+# Stands in for the run id, which is written into the input files, when hashing them
+PLACEHOLDER_RUNID = 'RUNCACHE'
+
+CACHE_DIR = '.runcache'
+
+
+def _json_default(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError("Can't serialise {!r}".format(value))
+
+
+def canonical_params(params):
+    """
+    The run parameters as a canonical JSON string, the same for any two requests that would run NAME the same way
+    """
+    params = dict((k, v) for k, v in params.items() if k not in VOLATILE_PARAMS)
+    return json.dumps(params, sort_keys=True, default=_json_default)
+
+
+def run_key(params, dates, grid=None):
+    """
+    Content hash of a NAME run, over its parameters and the input files it would generate for each date.
+    The input files bring in anything else the run depends on, such as the Met data versions and declarations.
+    :param params: the input parameters from the WPS process
+    :param dates: run dates, one input file each
+    :param grid: GridSpec of the run, if it has already been worked out
+    :return: hex digest
+    """
+    digest = hashlib.sha1(canonical_params(params).encode('utf-8'))
+    generator = InputFileGenerator(dict(params, runid=PLACEHOLDER_RUNID), grid)
+    generator.grid.prepare([generator.run_datetime(rundate) for rundate in dates])
+    for i, rundate in enumerate(dates, 1):
+        for section in generator.sections(rundate, i):
+            digest.update(section.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RunCache(object):
+    """
+    Remembers which run directory under outputdir holds the completed results of each run key, and the files
+    returned to the request that made them, so an identical request can return the same files instead of
+    running NAME again.
+
+    Each entry is a small JSON file in outputdir/.runcache named after the key. Its modification time is
+    bumped on every hit and is what the least recently used entries are evicted by.
+    """
+    def __init__(self, outputdir, max_entries=100, max_age_days=30):
+        """
+        :param outputdir: directory the run directories are in
+        :param max_entries: number of runs remembered, 0 for no limit
+        :param max_age_days: age after which a run is no longer reused, 0 for no limit
+        """
+        self.outputdir = outputdir
+        self.cachedir = os.path.join(outputdir, CACHE_DIR)
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        return os.path.join(self.cachedir, key + '.json')
+
+    def _read(self, path):
+        try:
+            with open(path) as fin:
+                return json.load(fin)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _expired(self, entry, now):
+        return self.max_age and now - entry['created'] > self.max_age
+
+    def lookup(self, key):
+        """
+        :param key: run key
+        :return: runid and dictionary of the result files stored with the run, or None if the run isn't cached
+        """
+        path = self._entry(key)
+        entry = self._read(path)
+        if entry is None:
+            return None
+        results = entry.get('results', {})
+        rundir = os.path.join(self.outputdir, entry['runid'])
+        gone = not os.path.isdir(rundir) or not all(os.path.exists(f) for f in results.values())
+        if self._expired(entry, time.time()) or gone:
+            self.discard(key)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        LOGGER.info("Reusing run %s for key %s" % (entry['runid'], key))
+        return entry['runid'], results
+
+    def store(self, key, runid, results=None):
+        """
+        Records a completed run, then evicts old entries
+        :param key: run key
+        :param runid: name of the run directory under outputdir
+        :param results: dictionary of name to path of the files returned for the run, the entry is dropped once
+                        any of them has gone
+        """
+        makedirs(self.cachedir)
+        write_json(self._entry(key), {'runid': runid, 'results': results or {}, 'created': time.time()})
+        self.evict()
+
+    def discard(self, key):
+        try:
+            os.remove(self._entry(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Drops expired entries and, beyond max_entries, the least recently used ones. The run directories
+        themselves are left alone.
+        """
+        if not os.path.isdir(self.cachedir):
+            return
+        now = time.time()
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cachedir):
+                if not name.endswith('.json'):
+                    continue
+                key = name[:-len('.json')]
+                entry = self._read(self._entry(key))
+                if entry is None or self._expired(entry, now):
+                    self.discard(key)
+                    continue
+                try:
+                    entries.append((os.path.getmtime(self._entry(key)), key))
+                except OSError:
+                    pass
+            if self.max_entries and len(entries) > self.max_entries:
+                entries.sort()
+                for _, key in entries[:len(entries) - self.max_entries]:
+                    self.discard(key)
+
+
+def get_runcache():
+    """
+    The run cache configured by the [runcache] section of jasmin.cfg
+    :return: RunCache, or None if it is switched off
+    """
+    config = getjasminconfigs()
+    if config.get_option('runcache', 'enabled', 'true').lower() != 'true':
+        return None
+    return RunCache(config.outputdir,
+                    max_entries=int(config.get_option('runcache', 'max_entries', 100)),
+                    max_age_days=float(config.get_option('runcache', 'max_age_days', 30)))
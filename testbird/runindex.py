@@ -0,0 +1,88 @@
+import os
+import json
+
+from .utils import write_json
+from .nameoutput import GROUP_FILE, read_timestamps
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+INDEX_FILE = '.index.json'
+
+
+class RunIndex(object):
+    """
+    Which output file, group and column holds each timestamp of a NAME run.
+
+    The index is kept in outputs/.index.json. Each file's entry records the modification time and size it
+    was read at, so only files that are new or have been rewritten have their headers read again. The index
+    file is touched whenever it is brought up to date, so it is newer than the directory unless files have been
+    added or removed since.
+    """
+    def __init__(self, outputdir, files):
+        """
+        :param outputdir: directory of NAME output files
+        :param files: dictionary of file name to {'mtime', 'size', 'group', 'timestamps'}
+        """
+        self.outputdir = outputdir
+        self.files = files
+        self._timestamps = {}
+        for filename, entry in sorted(files.items()):
+            for column, timestamp in enumerate(entry['timestamps']):
+                self._timestamps.setdefault(timestamp, []).append((entry['group'], filename, column))
+
+    @property
+    def timestamps(self):
+        return sorted(self._timestamps)
+
+    def lookup(self, timestamp):
+        """
+        :param timestamp: column label, e.g. '01/11/2017 03:00 UTC'
+        :return: list of (group, file path, column index) holding the timestamp, in group order
+        """
+        return [(group, os.path.join(self.outputdir, filename), column)
+                for group, filename, column in sorted(self._timestamps.get(timestamp.strip(), []))]
+
+
+def _load(path):
+    try:
+        with open(path, 'r') as fin:
+            return json.load(fin)['files']
+    except (IOError, OSError, ValueError, KeyError):
+        return {}
+
+
+def build_index(outputdir):
+    """
+    Brings the timestamp index of a run's output directory up to date
+    :param outputdir: directory of NAME output files, named *_group<N>.txt
+    :return: RunIndex
+    """
+    path = os.path.join(outputdir, INDEX_FILE)
+    old = _load(path)
+    files = {}
+    for filename in os.listdir(outputdir):
+        match = GROUP_FILE.match(filename)
+        if match is None:
+            continue
+        st = os.stat(os.path.join(outputdir, filename))
+        entry = old.get(filename)
+        if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+            entry = {'mtime': st.st_mtime,
+                     'size': st.st_size,
+                     'group': int(match.group('group')),
+                     'timestamps': read_timestamps(os.path.join(outputdir, filename))}
+        files[filename] = entry
+
+    if files != old:
+        LOGGER.debug("Updating the timestamp index of %s" % outputdir)
+        try:
+            write_json(path, {'files': files})
+        except (IOError, OSError) as e:
+            LOGGER.warning("Unable to write the timestamp index of %s: %s" % (outputdir, e))
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return RunIndex(outputdir, files)
@@ -0,0 +1,546 @@
+import os
+import re
+import itertools
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import getjasminconfigs
+from . import costmodel
+from .telemetry import format_report
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+# Array index states, as reported by Scheduler.status. Any other state (PEND, RUN, ...) means an index
+# is still to finish.
+FINISHED_STATES = ('DONE', 'EXIT')
+FAILED_STATES = ('EXIT',)
+
+# Number of polls in a row a job can be missing from the scheduler before it is taken to have been cleaned up
+MISSING_POLLS = 3
+
+
+class SchedulerError(Exception):
+    pass
+
+
+class Job(object):
+    """
+    A job array submitted to the batch scheduler, one index per day of the NAME run.
+    """
+    def __init__(self, jobid, nindices, on_progress=None):
+        """
+        :param jobid: scheduler job id
+        :param nindices: number of array indices
+        :param on_progress: called with (number of finished indices, nindices) whenever that number changes
+        """
+        self.jobid = jobid
+        self.nindices = nindices
+        self.on_progress = on_progress
+        self.states = {}
+        self.missing = 0
+        self._finished = threading.Event()
+
+    @property
+    def completed(self):
+        return sorted(i for i, state in self.states.items() if state in FINISHED_STATES)
+
+    @property
+    def failed(self):
+        return sorted(i for i, state in self.states.items() if state in FAILED_STATES)
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def update(self, states):
+        """
+        Records the latest state of each index, as reported by the scheduler
+        :param states: dictionary of array index to state, None if the scheduler was queried successfully but
+                       no longer knows about the job
+        """
+        before = len(self.completed)
+        if states is None:
+            # Finished jobs are eventually cleaned out of the scheduler's records. Indices last seen running
+            # may have finished since, and whether they made their output is for the caller to check.
+            self.missing += 1
+            if self.missing < MISSING_POLLS:
+                return
+            states = dict((i, 'DONE') for i in range(1, self.nindices + 1)
+                          if self.states.get(i) not in FINISHED_STATES)
+        else:
+            self.missing = 0
+        self.states.update(states)
+        after = len(self.completed)
+        if after != before and self.on_progress is not None:
+            try:
+                self.on_progress(after, self.nindices)
+            except Exception:
+                LOGGER.exception("Progress callback failed for job %s" % self.jobid)
+        if after >= self.nindices:
+            self._finished.set()
+
+    def wait(self, timeout=None):
+        """
+        Blocks until every index of the job has finished
+        :return: True if the job finished, False on timeout
+        """
+        self._finished.wait(timeout)
+        return self.finished
+
+
+def _run(args, cwd=None, stdin=None):
+    proc = subprocess.Popen(args, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
+                            universal_newlines=True)
+    sout, serr = proc.communicate()
+    return proc.returncode, sout, serr
+
+
+class Scheduler(object):
+    """
+    A batch system that NAME job arrays can be run on. Backends write the job script for a run, submit it,
+    report the state of each array index as DONE, EXIT or something still in progress, and cancel jobs.
+    """
+    #: file name of the job script in the run directory
+    scriptname = 'script.sh'
+    #: environment variable holding the array index of the running task
+    index_var = 'NAME_INDEX'
+    #: commands setting up the environment before NAME is run
+    setup = ["# Set system variables",
+             ". /etc/profile",
+             "# Load Intel compiler module",
+             "module load intel/13.1"]
+
+    def directives(self, params, maxruns, grid=None):
+        """
+        :param grid: GridSpec of the run, if it has already been worked out
+        :return: list of script lines requesting resources from the scheduler
+        """
+        return []
+
+    def workdir(self, params):
+        """
+        :return: directory the job runs NAME in
+        """
+        return os.path.join(getjasminconfigs().userdir, 'WPStest', params['runid'])
+
+    def script(self, params, maxruns, grid=None):
+        """
+        The job script that runs NAME on one input file per array index
+        :param params: the input parameters from the WPS process
+        :param maxruns: the last run index
+        :param grid: GridSpec of the run, if it has already been worked out
+        :return: a string of file contents
+        """
+        jasminconfigs = getjasminconfigs()
+        workdir = self.workdir(params)
+        index = "${%s}" % self.index_var
+
+        lines = ["#!/bin/bash"]
+        lines.extend(self.directives(params, maxruns, grid))
+        lines.extend(self.setup)
+
+        # Then we set the directories
+
+        lines.append("NAMEIIIDIR='{}'".format(jasminconfigs.namedir))
+        lines.append("TOPOGDIR='{}'".format(jasminconfigs.topodir))
+        lines.append("WORKDIR='{}'".format(workdir))
+
+        # Move to correct directory
+
+        lines.append("# Switch to working directory")
+        lines.append("cd ${WORKDIR}")
+
+        # Run NAME
+
+        lines.append("echo '=============================='")
+        lines.append('echo "Running NAME on input {}"'.format(index))
+        lines.append("echo '=============================='")
+        lines.append("${{NAMEIIIDIR}}/Executables_Linux/nameiii_64bit_par.exe  inputs/input{}.txt".format(index))
+
+        # Remove Met files
+
+        lines.append("echo 'Removing met files'")
+        lines.append("rm ${{WORKDIR}}/met_data/input{}/*.*".format(index))
+
+        # Finish
+
+        lines.append("echo 'Script completed'")
+        lines.append("# -------------------------------- END -------------------------------")
+        lines.append("exit 0")
+
+        return "\n\n".join(lines)
+
+    def submit(self, scriptfile, nindices, cwd=None):
+        """
+        Submits a job script as an array of nindices tasks
+        :param scriptfile: path to the script
+        :param nindices: number of array indices
+        :param cwd: directory to submit from
+        :return: job id
+        """
+        raise NotImplementedError
+
+    def status(self, jobids):
+        """
+        Queries the state of several job arrays at once
+        :param jobids: list of job ids
+        :return: dictionary of job id to a dictionary of array index to state, for every job the scheduler
+                 knows about
+        :raises SchedulerError: if the scheduler couldn't be queried, the jobs' states are then unknown rather
+                                than missing
+        """
+        raise NotImplementedError
+
+    def cancel(self, jobid):
+        """
+        Kills every index of a job array that hasn't finished
+        """
+        raise NotImplementedError
+
+
+def requirements(params, grid=None):
+    """
+    Queue, walltime (HH:MM) and memory (MB) needed by one day of a run
+    """
+    return costmodel.requirements(params, grid)
+
+
+# bjobs error for a job it no longer has a record of
+LSF_NOT_FOUND = re.compile(r'^Job <\d+(\[\d+\])?> is not found')
+
+
+class LSF(Scheduler):
+    """
+    Submits job arrays with bsub, queries them with bjobs and kills them with bkill
+    """
+    scriptname = 'script.bsub'
+    index_var = 'LSB_JOBINDEX'
+
+    def __init__(self, bsub='bsub', bjobs='bjobs', bkill='bkill'):
+        self.bsub = bsub
+        self.bjobs = bjobs
+        self.bkill = bkill
+
+    def directives(self, params, maxruns, grid=None):
+        queue, walltime, mem = requirements(params, grid)
+        return ["#BSUB -q {}".format(queue),
+                "#BSUB -oo r-%J-%I.out",
+                "#BSUB -eo r-%J-%I.err",
+                "#BSUB -W {}".format(walltime),
+                '#BSUB -R "rusage[mem={}]"'.format(mem),
+                "#BSUB -M {}".format(mem),
+                "#BSUB -J {}[1-{}]".format(params['runid'], maxruns)]
+
+    def submit(self, scriptfile, nindices=None, cwd=None):
+        # The array size is set by the -J directive of the script, the equivalent of 'bsub < script.bsub'
+        with open(scriptfile, 'r') as script:
+            returncode, sout, serr = _run([self.bsub], cwd=cwd, stdin=script)
+        match = re.search(r'Job <(\d+)>', sout)
+        if returncode != 0 or match is None:
+            raise SchedulerError("Failed to submit {}: {}".format(scriptfile, (serr or sout).strip()))
+        LOGGER.info("Submitted %s as job %s" % (scriptfile, match.group(1)))
+        return match.group(1)
+
+    def status(self, jobids):
+        returncode, sout, serr = _run([self.bjobs, '-a', '-noheader', '-o', 'jobid jobindex stat'] + list(jobids))
+        # bjobs also exits non-zero when some of the jobs are no longer known, which only means they're missing
+        errors = [line for line in serr.splitlines() if line.strip() and not LSF_NOT_FOUND.match(line)]
+        if returncode != 0 and (errors or not serr.strip()):
+            raise SchedulerError("bjobs failed with exit code {}: {}".format(returncode, "\n".join(errors)))
+        states = {}
+        for line in sout.splitlines():
+            parts = line.split()
+            if len(parts) != 3 or not parts[0].isdigit():
+                continue
+            jobid, index, state = parts
+            states.setdefault(jobid, {})[int(index)] = state
+        return states
+
+    def cancel(self, jobid):
+        _run([self.bkill, jobid])
+
+
+# sacct states of a task that ended without completing
+SLURM_FAILED = ('FAILED', 'CANCELLED', 'TIMEOUT', 'NODE_FAIL', 'OUT_OF_MEMORY', 'BOOT_FAIL', 'DEADLINE',
+                'PREEMPTED')
+
+
+def _slurm_indices(indices):
+    """
+    Expands the index list sacct gives for tasks still pending, e.g. '[2-4,7%2]'
+    """
+    result = []
+    for part in indices.strip('[]').split('%')[0].split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            result.extend(range(int(first), int(last) + 1))
+        elif part:
+            result.append(int(part))
+    return result
+
+
+class Slurm(Scheduler):
+    """
+    Submits job arrays with sbatch, queries them with sacct and kills them with scancel
+    """
+    scriptname = 'script.sbatch'
+    index_var = 'SLURM_ARRAY_TASK_ID'
+
+    def __init__(self, sbatch='sbatch', sacct='sacct', scancel='scancel', partition=None):
+        """
+        :param partition: partition to run on, by default the one named after the queue the cost model picks
+        """
+        self.sbatch = sbatch
+        self.sacct = sacct
+        self.scancel = scancel
+        self.partition = partition
+
+    def directives(self, params, maxruns, grid=None):
+        queue, walltime, mem = requirements(params, grid)
+        return ["#SBATCH --partition={}".format(self.partition or queue),
+                "#SBATCH --output=r-%A-%a.out",
+                "#SBATCH --error=r-%A-%a.err",
+                "#SBATCH --time={}:00".format(walltime),
+                "#SBATCH --mem={}".format(mem),
+                "#SBATCH --job-name={}".format(params['runid']),
+                "#SBATCH --array=1-{}".format(maxruns)]
+
+    def submit(self, scriptfile, nindices=None, cwd=None):
+        returncode, sout, serr = _run([self.sbatch, '--parsable', os.path.abspath(scriptfile)], cwd=cwd)
+        # --parsable prints "jobid" or "jobid;cluster"
+        jobid = sout.strip().split(';')[0]
+        if returncode != 0 or not jobid.isdigit():
+            raise SchedulerError("Failed to submit {}: {}".format(scriptfile, (serr or sout).strip()))
+        LOGGER.info("Submitted %s as job %s" % (scriptfile, jobid))
+        return jobid
+
+    def status(self, jobids):
+        returncode, sout, serr = _run([self.sacct, '--noheader', '--parsable2', '--allocations',
+                                       '--format=JobID,State', '--jobs', ','.join(jobids)])
+        if returncode != 0:
+            raise SchedulerError("sacct failed with exit code {}: {}".format(returncode, serr.strip()))
+        states = {}
+        for line in sout.splitlines():
+            parts = line.split('|')
+            if len(parts) != 2 or '_' not in parts[0]:
+                continue
+            jobid, indices = parts[0].split('_', 1)
+            # e.g. "CANCELLED by 1234"
+            state = parts[1].split()[0] if parts[1].strip() else 'PENDING'
+            if state == 'COMPLETED':
+                state = 'DONE'
+            elif state in SLURM_FAILED:
+                state = 'EXIT'
+            for index in _slurm_indices(indices):
+                states.setdefault(jobid, {})[index] = state
+        return states
+
+    def cancel(self, jobid):
+        _run([self.scancel, jobid])
+
+
+class Local(Scheduler):
+    """
+    Runs the array indices as processes on this machine, a few at a time, for development and small runs
+    where there's no batch system to hand
+    """
+    setup = []
+
+    def __init__(self, workers=None):
+        """
+        :param workers: number of indices run at once, by default the number of CPUs
+        """
+        if not workers:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        self.executor = ThreadPoolExecutor(max_workers=int(workers))
+        self._jobs = {}
+        self._procs = {}
+        self._cancelled = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _task(self, jobid, scriptfile, index, cwd):
+        env = dict(os.environ)
+        env[self.index_var] = str(index)
+        logname = os.path.join(cwd or os.path.dirname(os.path.abspath(scriptfile)), 'r-{}-{}'.format(jobid, index))
+        with open(logname + '.out', 'w') as out, open(logname + '.err', 'w') as err:
+            with self._lock:
+                if jobid in self._cancelled:
+                    return -1
+                started = time.time()
+                proc = subprocess.Popen(['/bin/bash', os.path.abspath(scriptfile)], cwd=cwd, env=env,
+                                        stdout=out, stderr=err)
+                self._procs[(jobid, index)] = proc
+            try:
+                # Reaped here rather than by proc.wait() to get the task's own resource usage
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            finally:
+                with self._lock:
+                    self._procs.pop((jobid, index), None)
+            # Summarised the way LSF does it, so the task is recorded the same on either
+            out.seek(0, os.SEEK_END)
+            out.write(format_report(usage.ru_utime + usage.ru_stime, time.time() - started, usage.ru_maxrss / 1024.0))
+            return proc.returncode
+
+    def submit(self, scriptfile, nindices, cwd=None):
+        jobid = 'local-{}'.format(next(self._ids))
+        self._jobs[jobid] = dict((i, self.executor.submit(self._task, jobid, scriptfile, i, cwd))
+                                 for i in range(1, nindices + 1))
+        LOGGER.info("Running %s locally as job %s" % (scriptfile, jobid))
+        return jobid
+
+    def status(self, jobids):
+        states = {}
+        for jobid in jobids:
+            if jobid not in self._jobs:
+                continue
+            states[jobid] = {}
+            for index, future in self._jobs[jobid].items():
+                if future.cancelled():
+                    state = 'EXIT'
+                elif future.running():
+                    state = 'RUN'
+                elif not future.done():
+                    state = 'PEND'
+                elif future.exception() is None and future.result() == 0:
+                    state = 'DONE'
+                else:
+                    state = 'EXIT'
+                states[jobid][index] = state
+        return states
+
+    def cancel(self, jobid):
+        with self._lock:
+            self._cancelled.add(jobid)
+            for future in self._jobs.get(jobid, {}).values():
+                future.cancel()
+            for (procjob, index), proc in self._procs.items():
+                if procjob == jobid:
+                    proc.terminate()
+
+    def workdir(self, params):
+        # Run straight from the directory the input files were written to
+        return params['outputdir']
+
+
+def create_scheduler(config=None):
+    """
+    The scheduler backend chosen by '[scheduler] backend' in jasmin.cfg, one of lsf (the default), slurm or local
+    """
+    config = config or getjasminconfigs()
+    backend = config.get_option('scheduler', 'backend', 'lsf').lower()
+    if backend == 'lsf':
+        return LSF(bsub=config.get_option('scheduler', 'bsub', 'bsub'),
+                   bjobs=config.get_option('scheduler', 'bjobs', 'bjobs'),
+                   bkill=config.get_option('scheduler', 'bkill', 'bkill'))
+    elif backend == 'slurm':
+        return Slurm(sbatch=config.get_option('scheduler', 'sbatch', 'sbatch'),
+                     sacct=config.get_option('scheduler', 'sacct', 'sacct'),
+                     scancel=config.get_option('scheduler', 'scancel', 'scancel'),
+                     partition=config.get_option('scheduler', 'partition'))
+    elif backend == 'local':
+        return Local(workers=config.get_option('scheduler', 'workers'))
+    raise SchedulerError("Unknown scheduler backend '{}'".format(backend))
+
+
+class JobMonitor(object):
+    """
+    Polls the scheduler from a single background thread for every job submitted by this process, so a WPS
+    request waiting on NAME doesn't need its own polling loop. Runs share one status query per interval only
+    when they are submitted from the same process. pywps runs each asynchronous request in a process of its
+    own, so there the monitor watches that request's job alone, and the request still waits for the whole run.
+    """
+    def __init__(self, scheduler, interval=30):
+        self.scheduler = scheduler
+        self.interval = interval
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, job):
+        """
+        Starts tracking a submitted job, starting the polling thread if needed
+        """
+        with self._lock:
+            self._jobs[job.jobid] = job
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='JobMonitor')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+
+    def poll(self):
+        """
+        Queries the state of all the tracked jobs once, dropping those that have finished
+        """
+        with self._lock:
+            jobs = dict(self._jobs)
+        if not jobs:
+            return
+        try:
+            states = self.scheduler.status(sorted(jobs))
+        except Exception:
+            # Nothing is known about the jobs this time round, they aren't counted as missing
+            LOGGER.exception("Unable to query the state of jobs %s" % ', '.join(sorted(jobs)))
+            return
+        for jobid, job in jobs.items():
+            job.update(states.get(jobid))
+            if job.finished:
+                with self._lock:
+                    self._jobs.pop(jobid, None)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.poll()
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_monitor():
+    """
+    The job monitor shared by the whole process, configured from the [scheduler] section of jasmin.cfg
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            config = getjasminconfigs()
+            _monitor = JobMonitor(create_scheduler(config),
+                                  interval=float(config.get_option('scheduler', 'poll_interval', 30)))
+        return _monitor
+
+
+def get_scheduler():
+    """
+    The scheduler backend shared by the whole process
+    """
+    return get_monitor().scheduler
+
+
+def submit(scriptfile, nindices, cwd=None, on_progress=None):
+    """
+    Submits a job array and starts tracking it in the background
+    :param scriptfile: path to the job script
+    :param nindices: number of array indices
+    :param cwd: directory to submit from
+    :param on_progress: called with (number of finished indices, nindices) as indices finish
+    :return: Job, use job.wait() to block until it has finished
+    """
+    monitor = get_monitor()
+    job = Job(monitor.scheduler.submit(scriptfile, nindices, cwd=cwd), nindices, on_progress=on_progress)
+    monitor.watch(job)
+    return job
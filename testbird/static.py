@@ -0,0 +1,99 @@
+import os
+import re
+import mimetypes
+from email.utils import formatdate
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CHUNK_SIZE = 64*1024
+
+
+def parse_range(header, size):
+    """
+    Parses a single byte range from a Range header
+    :param header: value of the Range header, e.g. 'bytes=0-499', 'bytes=500-' or 'bytes=-500'
+    :param size: size of the file
+    :return: (start, end) inclusive, None to serve the whole file, or False if the range can't be satisfied
+    """
+    match = BYTE_RANGE.match(header.strip()) if header else None
+    if match is None:
+        # Missing, malformed and multiple ranges are all answered with the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read(filename, start, length):
+    with open(filename, 'rb') as fin:
+        fin.seek(start)
+        while length > 0:
+            chunk = fin.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class OutputFiles(object):
+    """
+    WSGI middleware serving the files under the WPS output path, with support for HTTP range requests so large
+    outputs can be downloaded in parts or resumed. Everything outside the prefix goes to the wrapped application.
+    """
+    def __init__(self, application, directory, prefix='/outputs'):
+        self.application = application
+        self.directory = os.path.abspath(directory)
+        self.prefix = prefix.rstrip('/') + '/'
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.application(environ, start_response)
+
+        filename = os.path.abspath(os.path.join(self.directory, *path[len(self.prefix):].split('/')))
+        if not filename.startswith(self.directory + os.sep) or not os.path.isfile(filename):
+            start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
+            return [b'Not found']
+        if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+            start_response('405 METHOD NOT ALLOWED', [('Allow', 'GET, HEAD'), ('Content-Type', 'text/plain')])
+            return [b'Method not allowed']
+
+        st = os.stat(filename)
+        size = st.st_size
+        headers = [('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream'),
+                   ('Accept-Ranges', 'bytes'),
+                   ('Last-Modified', formatdate(st.st_mtime, usegmt=True)),
+                   ('ETag', '"{}-{}"'.format(int(st.st_mtime), size))]
+
+        byterange = parse_range(environ.get('HTTP_RANGE'), size)
+        if byterange and environ.get('HTTP_IF_RANGE') not in (None, dict(headers)['ETag']):
+            # The file has changed since the client fetched the first part of it
+            byterange = None
+        if byterange is False:
+            start_response('416 REQUESTED RANGE NOT SATISFIABLE',
+                           [('Content-Range', 'bytes */{}'.format(size)), ('Content-Type', 'text/plain')])
+            return [b'Requested range not satisfiable']
+        if byterange is None:
+            status, start, length = '200 OK', 0, size
+        else:
+            start, end = byterange
+            status, length = '206 PARTIAL CONTENT', end - start + 1
+            headers.append(('Content-Range', 'bytes {}-{}/{}'.format(start, end, size)))
+        headers.append(('Content-Length', str(length)))
+
+        start_response(status, headers)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return [b'']
+        return _read(filename, start, length)
@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+
+import numpy as np
+
+from .nameoutput import load_field
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def file_date(filename):
+    """
+    Release date of a NAME output file, named <YYYYMMDD>_group<N>.txt
+    """
+    return datetime.strptime(os.path.basename(filename)[:8], "%Y%m%d")
+
+
+def period_of(date, summarise):
+    """
+    The period a date is summed into
+    :param date: datetime
+    :param summarise: one of 'day', 'week', 'month' or 'all'
+    :return: the date, (year, week), (year, month) or None
+    """
+    if summarise == 'day':
+        return date
+    elif summarise == 'week':
+        return date.isocalendar()[:2]
+    elif summarise == 'month':
+        return (date.year, date.month)
+    else:
+        return None
+
+
+class Summation(object):
+    """
+    Sums the NAME output files of one group over days, weeks, months or the whole run.
+
+    Every timestep of every file is stacked into a single (timesteps, cells) array, over the union of
+    the cells found in any file, which is reduced to daily totals in one np.add.reduceat pass. The
+    weekly, monthly and overall totals are then reduced from the daily ones.
+    """
+    def __init__(self, files):
+        self.files = sorted(files, key=lambda f: (file_date(f), f))
+        self.fields = [load_field(f) for f in self.files]
+        self.dates = [file_date(f) for f in self.files]
+
+        cells = np.concatenate([f.cells for f in self.fields])
+        lons = np.concatenate([f.lons for f in self.fields])
+        lats = np.concatenate([f.lats for f in self.fields])
+        self.cells, first, inverse = np.unique(cells, return_index=True, return_inverse=True)
+        self.lons = lons[first]
+        self.lats = lats[first]
+
+        ntimes = [len(f.timestamps) for f in self.fields]
+        stacked = np.zeros((sum(ntimes), len(self.cells)), dtype=np.float32)
+        row = 0
+        offset = 0
+        for field, nt in zip(self.fields, ntimes):
+            stacked[row:row + nt, inverse[offset:offset + len(field.cells)]] = field.values
+            row += nt
+            offset += len(field.cells)
+        LOGGER.debug("Stacked %s files into a %s array" % (len(self.files), stacked.shape))
+
+        # The files are sorted by date so each day is a contiguous block of rows
+        self.days = sorted(set(self.dates))
+        starts = np.cumsum([0] + ntimes)[:-1]
+        daystarts = [starts[self.dates.index(day)] for day in self.days]
+        if len(stacked):
+            self.daily = np.add.reduceat(stacked, daystarts, axis=0, dtype=np.float64)
+        else:
+            self.daily = np.zeros((0, len(self.cells)))
+
+    def periods(self, summarise):
+        """
+        Summed concentrations of every period covered by the files
+        :param summarise: one of 'day', 'week', 'month' or 'all'
+        :return: list of (period, fields, (cells, lons, lats, values)) in date order,
+                 where fields are the NameField objects of the files summed
+        """
+        keys = [period_of(day, summarise) for day in self.days]
+        bounds = [i for i in range(len(keys)) if i == 0 or keys[i] != keys[i - 1]]
+        if not bounds:
+            return []
+        totals = np.add.reduceat(self.daily, bounds, axis=0)
+
+        results = []
+        for key, values in zip([keys[i] for i in bounds], totals):
+            fields = [f for f, date in zip(self.fields, self.dates) if period_of(date, summarise) == key]
+            results.append((key, fields, (self.cells, self.lons, self.lats, values)))
+        return results
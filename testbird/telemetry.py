@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from .utils import getjasminconfigs, write_json
+from .profiling import phase
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+TELEMETRY_FILE = '.telemetry.json'
+LOCK_FILE = '.telemetry.lock'
+
+PERCENTILES = (50, 90, 99)
+
+# Resource usage summary appended to each task's output file, by LSF and by the local backend
+REPORT_PATTERNS = {
+    'cpu_seconds': re.compile(r'CPU time\s*:\s*([\d.]+)\s*sec'),
+    'wall_seconds': re.compile(r'Run time\s*:\s*([\d.]+)\s*sec'),
+    'max_rss_mb': re.compile(r'Max Memory\s*:\s*([\d.]+)\s*([KMG]B)'),
+}
+MEMORY_UNITS = {'KB': 1 / 1024.0, 'MB': 1, 'GB': 1024}
+
+
+def parse_report(text):
+    """
+    Reads the resource usage summary at the end of an array task's output file
+    :return: dictionary of cpu_seconds, wall_seconds and max_rss_mb (MB), each None if it isn't there
+    """
+    report = {}
+    for name, pattern in REPORT_PATTERNS.items():
+        match = pattern.search(text)
+        value = None
+        if match is not None:
+            value = float(match.group(1))
+            if name == 'max_rss_mb':
+                value *= MEMORY_UNITS[match.group(2)]
+        report[name] = value
+    return report
+
+
+def read_report(rundir, jobid, index):
+    """
+    :return: parse_report of the output file r-<jobid>-<index>.out of an array task, None if there isn't one
+    """
+    path = os.path.join(rundir, "r-{}-{}.out".format(jobid, index))
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fin:
+        return parse_report(fin.read())
+
+
+def format_report(cpu_seconds, wall_seconds, max_rss_mb):
+    """
+    A resource usage summary in the form LSF writes, for backends that don't write their own
+    """
+    return ("\nResource usage summary:\n\n"
+            "    CPU time :   {:.2f} sec.\n"
+            "    Max Memory :   {:.0f} MB\n"
+            "    Run time :   {:.0f} sec.\n").format(cpu_seconds, max_rss_mb, wall_seconds)
+
+
+class RunTelemetry(object):
+    """
+    How long each stage of a run took and what each NAME array task used, kept in <rundir>/.telemetry.json.
+
+    Later requests on the same run, such as PlotAll, add their own stages to the record, possibly at the
+    same time. Each keeps only what it adds and merges it into the file under a lock when it saves, so no
+    request's stages overwrite another's. Each stage is kept as a separate entry, so repeated stages can be
+    told apart.
+    """
+    def __init__(self, rundir, **info):
+        """
+        :param rundir: output directory of the run
+        :param info: fields describing the run, e.g. runid, site, runtype and days
+        """
+        self.path = os.path.join(rundir, TELEMETRY_FILE)
+        self.info = info
+        self.stages = []
+        self.tasks = []
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the body of a with statement as a stage, whether or not it succeeds. The stage is also a
+        phase of the request's profile, when it is being profiled.
+        """
+        started = time.time()
+        try:
+            with phase(name):
+                yield
+        finally:
+            self.stages.append({'stage': name,
+                                'started': datetime.utcfromtimestamp(started).isoformat(),
+                                'seconds': time.time() - started})
+
+    def add_tasks(self, jobid, dates, failed=()):
+        """
+        Records the resource usage of every array task of a finished job, from its output files
+        :param jobid: scheduler job id
+        :param dates: run date of each array index, from 1
+        :param failed: array indices that failed
+        """
+        rundir = os.path.dirname(self.path)
+        for i, rundate in enumerate(dates, 1):
+            task = {'jobid': jobid, 'index': i, 'date': rundate.strftime("%Y-%m-%d"), 'failed': i in failed}
+            task.update(read_report(rundir, jobid, i) or {})
+            self.tasks.append(task)
+
+    def load(self):
+        """
+        :return: the record as it is in the file, with nothing this request has added yet
+        """
+        record = {'stages': [], 'tasks': []}
+        try:
+            with open(self.path, 'r') as fin:
+                record.update(json.load(fin))
+        except (IOError, OSError, ValueError):
+            pass
+        return record
+
+    def save(self):
+        """
+        Adds the stages and tasks recorded since the last save to the file. The file is read, merged and
+        replaced while holding a lock on the run, and replaced in one go so readers never see half of it.
+        """
+        rundir = os.path.dirname(self.path)
+        try:
+            with open(os.path.join(rundir, LOCK_FILE), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    record = self.load()
+                    record.update(self.info)
+                    record['stages'].extend(self.stages)
+                    record['tasks'].extend(self.tasks)
+                    write_json(self.path, record, indent=1, sort_keys=True)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        except (IOError, OSError) as e:
+            LOGGER.warning("Unable to write the telemetry of %s: %s" % (rundir, e))
+            return
+        self.stages = []
+        self.tasks = []
+
+
+def load_records(outputdir):
+    """
+    :param outputdir: directory holding the run directories
+    :return: list of the telemetry records of every run
+    """
+    records = []
+    for name in sorted(os.listdir(outputdir)):
+        path = os.path.join(outputdir, name, TELEMETRY_FILE)
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, 'r') as fin:
+                records.append(json.load(fin))
+        except (IOError, ValueError) as e:
+            LOGGER.warning("Unable to read %s: %s" % (path, e))
+    return records
+
+
+def aggregate(records, percentiles=PERCENTILES):
+    """
+    Percentiles of the time taken by each stage and of the resources used by the NAME tasks, per site and
+    run type
+    :param records: telemetry records
+    :return: dictionary of (site, runtype) to dictionary of measure to dictionary of count and p<N>
+    """
+    samples = {}
+    for record in records:
+        measures = samples.setdefault((record.get('site'), record.get('runtype')), {})
+        for stage in record.get('stages', []):
+            measures.setdefault(stage['stage'], []).append(stage['seconds'])
+        for task in record.get('tasks', []):
+            if task.get('failed'):
+                continue
+            for name in REPORT_PATTERNS:
+                if task.get(name) is not None:
+                    measures.setdefault('task_' + name, []).append(task[name])
+
+    result = {}
+    for group, measures in samples.items():
+        result[group] = {}
+        for measure, values in measures.items():
+            stats = {'count': len(values)}
+            for p, value in zip(percentiles, np.percentile(values, percentiles)):
+                stats['p{}'.format(p)] = float(value)
+            result[group][measure] = stats
+    return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="""Percentiles of the time taken by each stage of the NAME runs, and of the time and memory
+                       used by each NAME task, per site and run type"""
+    )
+    parser.add_argument('outputdir', nargs='?',
+                        help="directory holding the run directories, by default the outputdir in jasmin.cfg")
+    parser.add_argument('--json', action='store_true', help="print the result as JSON")
+    args = parser.parse_args()
+
+    outputdir = args.outputdir or getjasminconfigs().outputdir
+    result = aggregate(load_records(outputdir))
+
+    if args.json:
+        print(json.dumps([{'site': site, 'runtype': runtype, 'measures': measures}
+                          for (site, runtype), measures in sorted(result.items())], indent=1, sort_keys=True))
+        return
+
+    columns = ['p{}'.format(p) for p in PERCENTILES]
+    for (site, runtype), measures in sorted(result.items()):
+        print("{} {}".format(site, runtype))
+        print("    {:<24}{:>8}".format('', 'count') + "".join("{:>12}".format(c) for c in columns))
+        for measure, stats in sorted(measures.items()):
+            print("    {:<24}{:>8}".format(measure, stats['count']) +
+                  "".join("{:>12.1f}".format(stats[c]) for c in columns))
+
+
+if __name__ == '__main__':
+    main()
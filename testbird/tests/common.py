@@ -12,3 +12,42 @@ class WpsTestClient(WpsClient):
 
 def client_for(service):
     return WpsTestClient(service, WpsTestResponse)
+
+
+# Tail of an LSF array task's output file
+LSF_REPORT = """Script completed
+
+Resource usage summary:
+
+    CPU time :                                   5400.25 sec.
+    Max Memory :                                 2.5 GB
+    Average Memory :                             1200.00 MB
+    Run time :                                   5600 sec.
+"""
+
+
+class Response(object):
+    """
+    Stands in for the WPS response, keeping the percentages reported
+    """
+    def __init__(self):
+        self.statuses = []
+
+    def update_status(self, message, percent):
+        self.statuses.append(percent)
+
+
+def columns(names, plotoptions):
+    """
+    Plot job yielding one image per name, named after it
+    """
+    for name in names:
+        yield name, None, name, dict(plotoptions, outfile=name + '.png')
+
+
+def drawMap(data, column, outdir=None, outfile=None, **options):
+    """
+    Stands in for pynameplot's drawMap, writing the column name to the image file
+    """
+    with open(outdir + '/' + outfile, 'w') as fout:
+        fout.write(column)
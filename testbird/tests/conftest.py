@@ -0,0 +1,23 @@
+import pytest
+
+from testbird import utils
+
+
+@pytest.fixture
+def jasmin_config(tmpdir, monkeypatch):
+    """
+    Points the JASMIN configuration at a jasmin.cfg in tmpdir. The outputdir is tmpdir itself, the other
+    directories are under it, and the utilities hold the Met declarations of Mk10.
+    :return: function rewriting jasmin.cfg with further sections appended
+    """
+    tmpdir.join('utils', 'MetDeclarations', 'Use_UMG_Mk10_L59PTpp.txt').write(
+        "Met Declarations:\nGlob, NWP Met, UMG, %MetDir%, %TopogDir%, %MetRestoreScript%,\n", ensure=True)
+    cfile = tmpdir.join('jasmin.cfg')
+
+    def configure(sections=''):
+        cfile.write("[jasmin]\n" + "".join("{}dir = {}\n".format(d, tmpdir.join(d))
+                                           for d in ['user', 'name', 'topo', 'utils']) +
+                    "outputdir = {}\n".format(tmpdir) + sections)
+    configure()
+    monkeypatch.setattr(utils.JASMIN_CONFIG, 'cfile', str(cfile))
+    return configure
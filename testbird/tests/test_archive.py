@@ -0,0 +1,64 @@
+import zipfile
+
+from testbird import archive
+from testbird.archive import ZipArchive, archive_tree
+
+
+def test_archive_tree(tmpdir):
+    run = tmpdir.mkdir('run')
+    run.mkdir('inputs').join('input1.txt').write("NAME input\n" * 1000)
+    run.mkdir('outputs').join('20171101_group1.txt').write("1, 1, -29.875, 10.125, 1.0e-01,\n" * 1000)
+    run.join('outputs').mkdir('.npcache').join('values.npy').write('cache')
+    run.join('plot.png').write_binary(b'\x89PNG\r\n\x1a\n' + b'\x00' * 100)
+    run.mkdir('met_data')
+
+    zippedfile = archive_tree(str(tmpdir.join('run.zip')), str(run))
+    with zipfile.ZipFile(zippedfile) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == ['inputs/', 'inputs/input1.txt', 'met_data/', 'outputs/',
+                                         'outputs/20171101_group1.txt', 'plot.png']
+        assert zf.getinfo('plot.png').compress_type == zipfile.ZIP_STORED
+        info = zf.getinfo('inputs/input1.txt')
+        assert info.compress_type == zipfile.ZIP_DEFLATED
+        assert info.compress_size < info.file_size
+        assert zf.read('inputs/input1.txt') == run.join('inputs', 'input1.txt').read_binary()
+
+
+def test_archive_abort(tmpdir):
+    tmpdir.join('a.txt').write('a')
+    archive = ZipArchive(str(tmpdir.join('plots.zip')))
+    archive.add(str(tmpdir.join('a.txt')))
+    archive.abort()
+    assert not tmpdir.join('plots.zip').exists()
+
+
+def test_archive_threads(tmpdir):
+    files = tmpdir.mkdir('outputs')
+    for i in range(20):
+        files.join('2017110{}_group{}.txt'.format(i % 3, i)).write("{}, 1.0e-01,\n".format(i) * (1000 * i))
+
+    with ZipArchive(str(tmpdir.join('outputs.zip')), threads=4) as zf:
+        zf.add_tree(str(files))
+        zf.add(str(files.join('20171100_group0.txt')), u'r\xe9sum\xe9.txt')
+    with zipfile.ZipFile(str(tmpdir.join('outputs.zip'))) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == sorted([p.basename for p in files.listdir()] + [u'r\xe9sum\xe9.txt'])
+        for p in files.listdir():
+            assert zf.read(p.basename) == p.read_binary()
+
+
+def test_archive_zip64(tmpdir, monkeypatch):
+    # Written as if every size, offset and the number of entries were too large for the classic records
+    monkeypatch.setattr(archive, 'ZIP64_LIMIT', 0)
+    monkeypatch.setattr(archive, 'ZIP64_COUNT', 0)
+    tmpdir.join('a.txt').write('a' * 1000)
+    tmpdir.join('b.png').write('b')
+
+    with ZipArchive(str(tmpdir.join('large.zip'))) as zf:
+        zf.add(str(tmpdir.join('a.txt')))
+        zf.add(str(tmpdir.join('b.png')))
+    with zipfile.ZipFile(str(tmpdir.join('large.zip'))) as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == ['a.txt', 'b.png']
+        assert zf.read('a.txt') == b'a' * 1000
+        assert zf.getinfo('a.txt').compress_size < 1000
@@ -0,0 +1,62 @@
+import datetime as dt
+
+import pytest
+
+from testbird.costmodel import CostModel, Estimate, RunStats, features, requirements, get_runstats
+from testbird.tests.common import LSF_REPORT
+
+
+@pytest.fixture
+def params(tmpdir, jasmin_config):
+    return dict(runid='RUNID', time=1, timeFmt='days', timestamp='3-hourly', runBackwards=True,
+                domain=[-30.0, -120.0, 90.0, 80.0], elevationOut=[(0, 100)], resolution=0.25,
+                outputdir=str(tmpdir))
+
+
+def test_features(params):
+    feats = features(params)
+    assert feats['particles'] == pytest.approx(0.24)
+    assert feats['particle_hours'] == pytest.approx(0.24 * 27)
+    assert feats['cells'] == pytest.approx(0.384)
+    assert feats['values'] == pytest.approx(0.384 * 8)
+
+
+def test_calibrate(params):
+    records = []
+    for resolution in [0.1, 0.25, 0.5, 1.0, 2.0, 0.25]:
+        feats = features(dict(params, resolution=resolution))
+        feats.update(memory_mb=500 + 1000 * feats['cells'], cpu_seconds=60 + 100 * feats['particle_hours'])
+        records.append(feats)
+    model = CostModel.calibrate(records)
+    est = model.estimate(params)
+    assert est.memory_mb == pytest.approx(884, rel=1e-3)
+    assert est.cpu_seconds == pytest.approx(708, rel=1e-3)
+    assert est.output_mb is None
+    assert CostModel.calibrate(records[:3]).estimate(params) is None
+
+
+def test_estimate_requirements():
+    assert Estimate(884, 708).requirements() == ('short-serial', '00:30', 2000)
+    assert Estimate(20000, 4 * 3600).requirements() == ('short-serial', '06:00', 30000)
+    assert Estimate(50000, 3600).requirements()[0] == 'high-mem'
+    assert Estimate(1000, 20 * 3600).requirements()[0] == 'long-serial'
+
+
+def test_requirements(params, tmpdir):
+    # The run length table until enough days have been recorded
+    assert requirements(params) == ('short-serial', '01:00', 8000)
+
+    stats = get_runstats()
+    for resolution in [0.1, 0.25, 0.5, 1.0, 2.0]:
+        stats.record(dict(params, resolution=resolution), memory_mb=1000, cpu_seconds=600, output_mb=10)
+    assert stats.records()[0]['memory_mb'] == 1000
+    assert requirements(params) == ('short-serial', '00:30', 2000)
+
+
+def test_record_job(params, tmpdir):
+    tmpdir.join('outputs', '20171101_group1.txt').write('x' * 1000, ensure=True)
+    tmpdir.join('r-42-1.out').write(LSF_REPORT)
+    stats = RunStats(str(tmpdir.join('stats.jsonl')))
+    stats.record_job(params, [dt.date(2017, 11, 1), dt.date(2017, 11, 2)], '42', failed=[2])
+    [record] = stats.records()
+    assert (record['memory_mb'], record['cpu_seconds'], record['output_mb']) == (2560.0, 5400.25, 0.001)
@@ -0,0 +1,27 @@
+import json
+import hashlib
+
+from pywps import configuration
+
+from testbird.manifest import Manifest
+
+
+def test_manifest(tmpdir, monkeypatch):
+    outputpath = tmpdir.mkdir('wpsoutputs')
+    config = {('server', 'outputpath'): str(outputpath), ('server', 'outputurl'): 'http://localhost:5000/outputs'}
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option: config.get((section, option), ''))
+
+    run = tmpdir.mkdir('run')
+    run.mkdir('outputs').join('20171101_group1.txt').write('concentrations')
+    run.join('outputs').mkdir('.npcache').join('values.npy').write('cache')
+
+    manifest = Manifest('RUNID')
+    assert json.loads(outputpath.join('RUNID', 'manifest.json').read()) == {'complete': False, 'files': []}
+    manifest.add_tree(str(run))
+    listing = json.loads(open(manifest.close()).read())
+    assert listing['complete']
+    assert listing['files'] == [{'name': 'outputs/20171101_group1.txt',
+                                 'url': 'http://localhost:5000/outputs/RUNID/outputs/20171101_group1.txt',
+                                 'size': 14,
+                                 'sha256': hashlib.sha256(b'concentrations').hexdigest()}]
+    assert outputpath.join('RUNID', 'outputs', '20171101_group1.txt').read() == 'concentrations'
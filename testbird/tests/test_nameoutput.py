@@ -0,0 +1,91 @@
+import numpy as np
+
+from testbird.nameoutput import read_field, write_field, FieldCache, convert_field, read_sidecar, group_index
+
+NAME_OUTPUT = """NAME III (version 6.5)
+Run name:                 CAPEVERDE
+Run time:                 10/11/2017 15:21:59.000 UTC
+Met data:                 NWP Flow.Global_PT1_flow
+Start of release:         01/11/2017 00:00 UTC
+End of release:           02/11/2017 00:00 UTC
+X grid origin:            -30.000
+Y grid origin:            10.000
+X grid size:              4
+Y grid size:              3
+X grid resolution:        0.250
+Y grid resolution:        0.250
+Number of preliminary cols: 4
+Number of field cols:       2
+Fields:
+,,,      Name:, TRACER1, TRACER1,
+,,,  Quantity:, Air Concentration, Air Concentration,
+,,, T Av or Int:, 3hr 0min integral, 3hr 0min integral,
+,,,      Time:, 01/11/2017 03:00 UTC, 01/11/2017 06:00 UTC,
+,,,         Z:, (0.0 - 100.0m agl), (0.0 - 100.0m agl),
+X Index, Y Index, Longitude, Latitude,,,
+1, 1, -29.875, 10.125, 1.0e-01, 0.0e+00,
+3, 2, -29.375, 10.375, 2.0e-01, 3.0e-01,
+4, 3, -29.125, 10.625, 0.0e+00, 5.0e-01,
+"""
+
+
+def write_output(tmpdir, name=NAME_OUTPUT, filename='20171101_group1.txt'):
+    path = tmpdir.join(filename)
+    path.write(name)
+    return str(path)
+
+
+def test_read_field(tmpdir):
+    field = read_field(write_output(tmpdir))
+    assert field.runname == 'CAPEVERDE'
+    assert field.altitude == '(0.0 - 100.0m agl)'
+    assert field.timestamps == ['01/11/2017 03:00 UTC', '01/11/2017 06:00 UTC']
+    assert list(field.cells) == [0, 6, 11]
+    assert field.values.shape == (2, 3)
+    grid = field.grid(field.values[1])
+    assert grid.shape == (3, 4)
+    assert np.isclose(grid[1, 2], 0.3)
+    assert np.isclose(grid[2, 3], 0.5)
+
+
+def test_write_field(tmpdir):
+    field = read_field(write_output(tmpdir))
+    values = field.values.sum(axis=0)
+
+    sumfile = str(tmpdir.join('summed.txt'))
+    write_field(sumfile, field.header_only(), field.timestamps[-1], field.cells, field.lons, field.lats, values)
+    summed = read_field(sumfile)
+    assert summed.timestamps == ['01/11/2017 06:00 UTC']
+    assert summed.altitude == field.altitude
+    assert list(summed.cells) == list(field.cells)
+    assert np.allclose(summed.values[0], values)
+
+
+def test_field_cache(tmpdir):
+    cache = FieldCache()
+    path = write_output(tmpdir)
+    assert cache.get(path) is cache.get(path)
+
+
+def test_sidecar(tmpdir):
+    path = write_output(tmpdir)
+    assert read_sidecar(path) is None
+    field = convert_field(path)
+    binary = read_sidecar(path)
+    assert isinstance(binary.values, np.memmap)
+    assert binary.timestamps == field.timestamps
+    assert np.array_equal(binary.values, field.values)
+    assert list(binary.header.items()) == list(field.header.items())
+
+    # A rewritten output file makes the sidecar stale
+    tmpdir.join('20171101_group1.txt').write(NAME_OUTPUT + "1, 2, -29.875, 10.375, 1.0e-01, 0.0e+00,\n")
+    assert read_sidecar(path) is None
+
+
+def test_group_index(tmpdir):
+    for filename in ['20171101_group1.txt', '20171102_group1.txt', '20171101_group10.txt', 'notes.txt']:
+        tmpdir.join(filename).write('')
+    groups = group_index(str(tmpdir))
+    assert sorted(groups) == [1, 10]
+    assert [f.rsplit('/', 1)[1] for f in groups[1]] == ['20171101_group1.txt', '20171102_group1.txt']
+    assert [f.rsplit('/', 1)[1] for f in groups[10]] == ['20171101_group10.txt']
@@ -0,0 +1,64 @@
+import datetime as dt
+
+from testbird import pipeline, plotting
+from testbird.pipeline import DayPlotter, finished_days, follow
+from testbird.scheduler import Job
+from testbird.tests.common import columns, drawMap
+
+
+def name_plots(filename, plotoptions):
+    return columns([filename.split('/')[-1][:-len('.txt')]], plotoptions)
+
+
+def test_finished_days(tmpdir):
+    dates = [dt.date(2017, 11, 1), dt.date(2017, 11, 2), dt.date(2017, 11, 3)]
+    tmpdir.join('20171101_group1.txt').write('')
+    tmpdir.join('20171102_group1.txt').write('')
+    job = Job('1', 3)
+    job.update({1: 'DONE', 2: 'EXIT', 3: 'RUN'})
+    assert finished_days(job, dates, str(tmpdir)) == [dt.date(2017, 11, 1)]
+    # Done, but without any output files yet
+    job.update({3: 'DONE'})
+    assert finished_days(job, dates, str(tmpdir)) == [dt.date(2017, 11, 1)]
+
+
+def test_day_plotter(tmpdir, monkeypatch):
+    monkeypatch.setattr(plotting, 'name_plots', name_plots)
+    monkeypatch.setattr(plotting, 'drawMap', drawMap)
+    outputs = tmpdir.mkdir('outputs')
+    outputs.join('20171101_group1.txt').write('')
+    outputs.join('20171101_group2.txt').write('')
+    outputs.join('20171102_group1.txt').write('')
+    dates = [dt.date(2017, 11, 1), dt.date(2017, 11, 2)]
+
+    job = Job('1', 2)
+    job.update({1: 'DONE', 2: 'RUN'})
+    plotter = DayPlotter(str(tmpdir), processes=1)
+    handed = []
+
+    def on_days(days):
+        handed.append(days)
+        plotter.add_days(days)
+    assert not follow(job, dates, str(outputs), on_days, interval=0.01, timeout=0.05)
+    assert handed == [[dt.date(2017, 11, 1)]]
+    assert len(plotter.pending) == 2
+    job.update({2: 'DONE'})
+    assert follow(job, dates, str(outputs), on_days, interval=0.01)
+    assert handed[-1] == dates
+    assert plotter.close() == (3, [])
+    assert sorted(p.basename for p in tmpdir.join('plots').listdir()) == [
+        '20171101_group1.png', '20171101_group2.png', '20171102_group1.png']
+
+    # A second run over the same files takes the images from the plot cache
+    monkeypatch.setattr(plotting, 'drawMap', None)
+    plotter = DayPlotter(str(tmpdir), processes=1)
+    plotter.add_days(dates)
+    assert plotter.pending == []
+    assert plotter.close() == (3, [])
+
+
+def test_get_plotter(tmpdir, jasmin_config):
+    assert pipeline.get_plotter(str(tmpdir)) is None
+    jasmin_config("[pipeline]\nenabled = true\n")
+    plotter = pipeline.get_plotter(str(tmpdir))
+    assert plotter.close() == (0, [])
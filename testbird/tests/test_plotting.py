@@ -0,0 +1,69 @@
+import os
+
+from testbird import plotting
+from testbird.plotting import PlotJob, PlotCache, render, plot_key
+from testbird.tests.common import Response, columns, drawMap
+
+
+def test_render_cache(tmpdir, monkeypatch):
+    drawn = []
+
+    def drawing(data, column, **options):
+        drawn.append(column)
+        drawMap(data, column, **options)
+    monkeypatch.setattr(plotting, 'drawMap', drawing)
+
+    cache = PlotCache(str(tmpdir))
+    options = {'outdir': str(tmpdir.mkdir('plots_1')), 'colormap': 'coolwarm'}
+    jobs = [PlotJob(columns, (['a', 'b'], options), plot_key('a,b', options)),
+            PlotJob(columns, (['c'], options), plot_key('c', options))]
+    assert render(jobs, Response(), 3, processes=1, cache=cache, outdir=options['outdir']) == (3, [])
+    assert drawn == ['a', 'b', 'c']
+
+    # Only the job whose options changed is drawn again
+    options2 = {'outdir': str(tmpdir.mkdir('plots_2')), 'colormap': 'coolwarm'}
+    options3 = dict(options2, colormap='viridis')
+    jobs = [PlotJob(columns, (['a', 'b'], options2), plot_key('a,b', options2)),
+            PlotJob(columns, (['c'], options3), plot_key('c', options3))]
+    files = []
+    assert render(jobs, Response(), 3, processes=1, on_files=files.extend, cache=cache,
+                  outdir=options2['outdir']) == (3, [])
+    assert drawn == ['a', 'b', 'c', 'c']
+    assert sorted(os.path.basename(f) for f in files) == ['a.png', 'b.png', 'c.png']
+    assert tmpdir.join('plots_2', 'a.png').read() == 'a'
+
+
+def failing(names, plotoptions):
+    yield names[0], None, names[0], dict(plotoptions, outfile=names[0] + '.png')
+    raise ValueError("unreadable")
+
+
+def test_run_job(tmpdir, monkeypatch):
+    def drawing(data, column, **options):
+        if column == 'boom':
+            raise ValueError('boom')
+        drawMap(data, column, **options)
+    monkeypatch.setattr(plotting, 'drawMap', drawing)
+
+    outdir = tmpdir.mkdir('plots')
+    made, failures, outfiles = plotting.run_job(PlotJob(columns, (['a', 'boom', 'b'], {'outdir': str(outdir)})))
+    assert made == 3
+    assert failures == [('boom', 'boom')]
+    # Finished images are moved out of the staging directory, which is removed
+    assert outfiles == [str(outdir.join('a.png')), str(outdir.join('b.png'))]
+    assert sorted(p.basename for p in outdir.listdir()) == ['a.png', 'b.png']
+
+
+def test_render_progress(tmpdir, monkeypatch):
+    monkeypatch.setattr(plotting, 'drawMap', drawMap)
+
+    options = {'outdir': str(tmpdir.mkdir('plots'))}
+    jobs = [PlotJob(columns, ([name], options)) for name in 'abcd']
+    jobs.append(PlotJob(failing, (['e'], options)))
+    response = Response()
+    made, failures = render(jobs, response, 5, processes=2, start=10, end=90)
+    assert made == 5
+    assert failures == [("failing(['e'],)", 'unreadable')]
+    assert response.statuses == sorted(response.statuses)
+    assert response.statuses[-1] == 90
+    assert sorted(p.basename for p in tmpdir.join('plots').listdir()) == ['a.png', 'b.png', 'c.png', 'd.png', 'e.png']
@@ -0,0 +1,71 @@
+import os
+import json
+import time
+
+from pywps import configuration
+
+from testbird import plotting
+from testbird.plotting import PlotJob, render
+from testbird.profiling import RequestProfiler, profiled, phase, profile_to, PROFILE_DIR
+from testbird.tests.common import Response, columns, drawMap
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_cprofile(tmpdir, monkeypatch):
+    monkeypatch.setattr(plotting, 'drawMap', drawMap)
+
+    profiler = RequestProfiler('plotall')
+    profiler.start()
+    with phase('parse'):
+        busy(0.05)
+    options = {'outdir': str(tmpdir.mkdir('plots'))}
+    render([PlotJob(columns, (['a'], options))], Response(), 1, processes=1)
+    profiler.stop()
+    path = profiler.save(str(tmpdir))
+
+    assert os.path.dirname(path) == str(tmpdir.join(PROFILE_DIR))
+    phases = json.load(open(os.path.join(path, 'phases.json')))
+    assert [p['phase'] for p in phases['phases']] == ['parse']
+    assert phases['phases'][0]['seconds'] >= 0.05
+    assert 'busy' in open(os.path.join(path, 'handler.txt')).read()
+    # The plot jobs are profiled on their own
+    assert 'run_job' in open(os.path.join(path, 'plots.txt')).read()
+    assert not os.path.exists(profiler.workdir)
+
+
+def test_sample(tmpdir):
+    profiler = RequestProfiler('runname', mode='sample', interval=0.001)
+    profiler.start()
+    busy(0.1)
+    profiler.stop()
+    path = profiler.save(str(tmpdir))
+    samples = open(os.path.join(path, 'samples.txt')).read()
+    assert 'test_profiling.py:busy' in samples
+    assert not os.path.exists(os.path.join(path, 'handler.prof'))
+
+
+def test_profiled(tmpdir, monkeypatch):
+    class Process(object):
+        identifier = 'runname'
+
+        @profiled
+        def _handler(self, request, response):
+            with phase('generate'):
+                profile_to(str(tmpdir))
+            return response
+
+    config = {}
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option: config.get((section, option), ''))
+    assert Process()._handler(None, 'response') == 'response'
+    assert not tmpdir.join(PROFILE_DIR).exists()
+
+    config[('profiling', 'enabled')] = 'true'
+    assert Process()._handler(None, 'response') == 'response'
+    [path] = tmpdir.join(PROFILE_DIR).listdir()
+    assert path.basename.startswith('runname-')
+    assert json.loads(path.join('phases.json').read())['phases'][0]['phase'] == 'generate'
@@ -0,0 +1,136 @@
+import os
+import stat
+import itertools
+import zipfile
+import datetime as dt
+
+import pytest
+from pywps import configuration
+
+from testbird import run_name as run_name_module, scheduler
+from testbird.run_name import run_name
+from testbird.archive import ZipArchive
+from testbird.tests.common import Response, drawMap
+
+
+class Name(object):
+    def __init__(self, filename):
+        self.timestamps = ['01/11/2017 03:00 UTC']
+
+
+class Clock(dt.datetime):
+    """
+    Moves on a second every time it is read, so runs started in the same second still get their own runid
+    """
+    ticks = itertools.count()
+
+    @classmethod
+    def now(cls):
+        return cls(2017, 12, 1) + dt.timedelta(seconds=next(cls.ticks))
+
+
+@pytest.fixture
+def outputdir(tmpdir, jasmin_config, monkeypatch):
+    # Stands in for NAME, writing one output file for the day of its input file unless it is listed in missing.txt
+    exe = tmpdir.join('name', 'Executables_Linux', 'nameiii_64bit_par.exe')
+    exe.write('#!/bin/bash\nd=$(grep -o "[0-9]\\{{8\\}}_group1" $1 | head -1)\n'
+              'grep -qs ${{d%_group1}} {} || echo "$d" > outputs/$d.txt\n'.format(tmpdir.join('missing.txt')),
+              ensure=True)
+    os.chmod(str(exe), os.stat(str(exe)).st_mode | stat.S_IEXEC)
+    jasmin_config("[scheduler]\nbackend = local\nsubmit = true\npoll_interval = 0.01\n")
+    monkeypatch.setattr(scheduler, '_monitor', None)
+
+    config = {('server', 'outputpath'): str(tmpdir.mkdir('wpsoutputs'))}
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option: config.get((section, option), ''))
+    monkeypatch.setattr(run_name_module, 'Name', Name)
+    monkeypatch.setattr(run_name_module, 'drawMap', drawMap)
+    monkeypatch.setattr(run_name_module, 'datetime', Clock)
+    # pywps runs each request in a directory of its own, removed once the request has finished
+    monkeypatch.chdir(tmpdir.mkdir('request'))
+    return tmpdir
+
+
+def request(first, last):
+    return dict(title='CAPEVERDE', longitude=-24.867222, latitude=16.863611, elevation=10, runBackwards=True,
+                time=1, timeFmt='days', domain=[-30.0, -120.0, 90.0, 80.0], elevationOut=[(0, 100)],
+                resolution=0.25, timestamp='3-hourly', startdate=dt.date(2017, 11, first),
+                enddate=dt.date(2017, 11, last))
+
+
+def runs(outputdir):
+    return sorted(p.basename for p in outputdir.listdir() if p.basename.startswith('BCK'))
+
+
+def next_request(outputdir, monkeypatch):
+    outputdir.join('request').remove()
+    monkeypatch.chdir(outputdir.mkdir('request'))
+
+
+def test_identical_request(outputdir, monkeypatch):
+    results = run_name(request(1, 2), Response())
+    runid, zippedfile, mapfile, manifestfile = results
+    for path in results[1:]:
+        assert os.path.isabs(path) and os.path.exists(path)
+
+    # The same request is answered with the same files, without running NAME or making a new run directory
+    next_request(outputdir, monkeypatch)
+    response = Response()
+    assert run_name(request(1, 2), response) == results
+    assert response.statuses == [95]
+    assert runs(outputdir) == [runid]
+
+
+def test_missing_outputs(outputdir, monkeypatch):
+    # NAME can finish a day without writing any output, such a run is made again next time
+    outputdir.join('missing.txt').write('20171102')
+    runid = run_name(request(1, 2), Response())[0]
+    outputdir.join('missing.txt').remove()
+    next_request(outputdir, monkeypatch)
+    response = Response()
+    rerun = run_name(request(1, 2), response)[0]
+    assert rerun != runid
+    assert response.statuses[-1] == 95 and len(response.statuses) > 1
+    assert sorted(p.basename for p in outputdir.join(rerun, 'outputs').listdir()) == [
+        '20171101_group1.txt', '20171102_group1.txt']
+
+
+def test_overlapping_request(outputdir, monkeypatch):
+    first = run_name(request(1, 3), Response())[0]
+    next_request(outputdir, monkeypatch)
+    second = run_name(request(2, 4), Response())[0]
+    assert runs(outputdir) == sorted([first, second])
+
+    # Only the day the first run didn't have is run, the others are linked in from it
+    assert [p.basename for p in outputdir.join(second, 'inputs').listdir()] == ['input1.txt']
+    assert 'for release on 04/11/2017' in outputdir.join(second, 'inputs', 'input1.txt').read()
+    outputs = outputdir.join(second, 'outputs')
+    assert sorted(p.basename for p in outputs.listdir()) == [
+        '20171102_group1.txt', '20171103_group1.txt', '20171104_group1.txt']
+    assert outputs.join('20171102_group1.txt').read().strip() == '20171102_group1'
+
+    # Linked days count as complete, so the second run is cached too
+    next_request(outputdir, monkeypatch)
+    assert run_name(request(2, 4), Response())[0] == second
+
+
+def test_days_archived_as_they_finish(outputdir, monkeypatch):
+    added = []
+    add, add_tree = ZipArchive.add, ZipArchive.add_tree
+
+    def record_add(self, path, arcname=None):
+        added.append(arcname)
+        add(self, path, arcname)
+
+    def record_add_tree(self, root):
+        added.append('the rest')
+        add_tree(self, root)
+    monkeypatch.setattr(ZipArchive, 'add', record_add)
+    monkeypatch.setattr(ZipArchive, 'add_tree', record_add_tree)
+
+    zippedfile = run_name(request(1, 2), Response())[1]
+    assert sorted(added[:2]) == ['outputs/20171101_group1.txt', 'outputs/20171102_group1.txt']
+    assert added[2] == 'the rest'
+    with zipfile.ZipFile(zippedfile) as zf:
+        assert zf.testzip() is None
+        assert zf.read('outputs/20171101_group1.txt').strip() == b'20171101_group1'
+        assert 'inputs/input1.txt' in zf.namelist()
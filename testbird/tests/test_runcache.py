@@ -0,0 +1,57 @@
+import os
+import datetime as dt
+
+import pytest
+
+from testbird.runcache import RunCache, run_key
+
+
+@pytest.fixture
+def params(jasmin_config):
+    return dict(title='CAPEVERDE', longitude=-24.867222, latitude=16.863611, elevation=10, runBackwards=True,
+                time=1, timeFmt='days', domain=[-30.0, -120.0, 90.0, 80.0], elevationOut=[(0, 100)],
+                resolution=0.25, timestamp='3-hourly', startdate=dt.date(2017, 11, 1), enddate=dt.date(2017, 11, 1))
+
+
+def test_run_key(params):
+    dates = [dt.date(2017, 11, 1)]
+    key = run_key(params, dates)
+    assert run_key(dict(params, runid='BCK1_3-hourly_CAPEVERDE_1', outputdir='/elsewhere'), dates) == key
+    assert run_key(dict(params, elevation=20), dates) != key
+    assert run_key(params, [dt.date(2017, 11, 2)]) != key
+
+
+def test_run_cache(tmpdir):
+    cache = RunCache(str(tmpdir), max_entries=2)
+    assert cache.lookup('a') is None
+    for key in ['a', 'b', 'c']:
+        tmpdir.mkdir('run_' + key)
+
+    result = tmpdir.join('run_a.zip')
+    result.write('')
+    cache.store('a', 'run_a', {'zip': str(result)})
+    assert cache.lookup('a') == ('run_a', {'zip': str(result)})
+
+    # 'a' was used more recently than 'b', so 'b' is evicted when 'c' is added
+    cache.store('b', 'run_b')
+    entry = str(tmpdir.join('.runcache', 'b.json'))
+    os.utime(entry, (0, 0))
+    cache.store('c', 'run_c')
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') is not None
+    assert cache.lookup('c') is not None
+
+    # Entries whose run directory or result files have gone are dropped
+    tmpdir.join('run_c').remove()
+    assert cache.lookup('c') is None
+    result.remove()
+    assert cache.lookup('a') is None
+
+
+def test_run_cache_expiry(tmpdir):
+    tmpdir.mkdir('run_a')
+    cache = RunCache(str(tmpdir), max_age_days=1)
+    cache.store('a', 'run_a')
+    assert cache.lookup('a') is not None
+    tmpdir.join('.runcache', 'a.json').write('{"runid": "run_a", "created": 0}')
+    assert cache.lookup('a') is None
@@ -0,0 +1,39 @@
+import numpy as np
+
+from testbird.nameoutput import read_field, read_column, convert_field
+from testbird import runindex
+from testbird.runindex import build_index, INDEX_FILE
+from testbird.tests.test_nameoutput import NAME_OUTPUT, write_output
+
+
+def test_build_index(tmpdir, monkeypatch):
+    write_output(tmpdir, filename='20171101_group1.txt')
+    write_output(tmpdir, NAME_OUTPUT.replace('TRACER1', 'TRACER2'), filename='20171101_group2.txt')
+    index = build_index(str(tmpdir))
+    assert index.timestamps == ['01/11/2017 03:00 UTC', '01/11/2017 06:00 UTC']
+    assert index.lookup('01/11/2017 06:00 UTC') == [(1, str(tmpdir.join('20171101_group1.txt')), 1),
+                                                   (2, str(tmpdir.join('20171101_group2.txt')), 1)]
+    assert index.lookup('02/11/2017 06:00 UTC') == []
+    assert tmpdir.join(INDEX_FILE).exists()
+
+    # Unchanged files are taken from the saved index without being read again
+    tmpdir.join('20171101_group2.txt').remove()
+
+    def unexpected(filename):
+        raise AssertionError("%s was read again" % filename)
+    monkeypatch.setattr(runindex, 'read_timestamps', unexpected)
+    index = build_index(str(tmpdir))
+    assert [g for g, _, _ in index.lookup('01/11/2017 03:00 UTC')] == [1]
+
+def test_read_column(tmpdir):
+    path = write_output(tmpdir)
+    field = read_field(path)
+    column = read_column(path, 1)
+    assert column.timestamps == ['01/11/2017 06:00 UTC']
+    assert column.info('Time') == '01/11/2017 06:00 UTC'
+    assert np.allclose(column.values[0], field.values[1])
+
+    convert_field(path)
+    binary = read_column(path, 1)
+    assert isinstance(binary.values, np.memmap)
+    assert np.allclose(binary.values[0], field.values[1])
@@ -0,0 +1,144 @@
+import os
+import stat
+
+import pytest
+
+from testbird.scheduler import LSF, Slurm, Local, Job, JobMonitor, SchedulerError, MISSING_POLLS
+
+
+def fake_command(tmpdir, name, script):
+    path = tmpdir.join(name)
+    path.write("#!/bin/sh\n" + script)
+    os.chmod(str(path), os.stat(str(path)).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def fake_lsf(tmpdir):
+    bsub = fake_command(tmpdir, 'bsub', 'cat > {}\necho "Job <101> is submitted to queue <short-serial>."\n'.format(
+        tmpdir.join('submitted.bsub')))
+    bjobs = fake_command(tmpdir, 'bjobs', 'cat {}\n'.format(tmpdir.join('bjobs.txt')))
+    return LSF(bsub=bsub, bjobs=bjobs)
+
+
+def test_lsf_submit_and_status(tmpdir):
+    lsf = fake_lsf(tmpdir)
+    script = tmpdir.join('script.bsub')
+    script.write("#!/bin/bash\n#BSUB -J run[1-2]\n")
+    assert lsf.submit(str(script)) == '101'
+    assert tmpdir.join('submitted.bsub').read() == script.read()
+
+    tmpdir.join('bjobs.txt').write("101 1 DONE\n101 2 RUN\n102 1 EXIT\n")
+    assert lsf.status(['101', '102']) == {'101': {1: 'DONE', 2: 'RUN'}, '102': {1: 'EXIT'}}
+
+
+def test_job_monitor(tmpdir):
+    lsf = fake_lsf(tmpdir)
+    tmpdir.join('bjobs.txt').write("101 1 DONE\n101 2 RUN\n101 3 PEND\n")
+    progress = []
+    job = Job('101', 3, on_progress=lambda done, total: progress.append((done, total)))
+    monitor = JobMonitor(lsf, interval=0.01)
+    monitor.watch(job)
+
+    monitor.poll()
+    assert job.completed == [1]
+    assert not job.finished
+
+    tmpdir.join('bjobs.txt').write("101 1 DONE\n101 2 EXIT\n101 3 DONE\n")
+    assert job.wait(timeout=5)
+    assert job.failed == [2]
+    assert progress[0] == (1, 3)
+    assert progress[-1] == (3, 3)
+
+
+def test_status_failure(tmpdir):
+    bjobs = fake_command(tmpdir, 'bjobs', 'cat {}\necho "$(cat {})" >&2\nexit $(cat {})\n'.format(
+        tmpdir.join('bjobs.txt'), tmpdir.join('bjobs.err'), tmpdir.join('bjobs.rc')))
+    lsf = LSF(bjobs=bjobs)
+    job = Job('101', 2)
+    monitor = JobMonitor(lsf)
+    monitor._jobs[job.jobid] = job
+
+    # A failed query leaves the job as it was, however often it fails
+    tmpdir.join('bjobs.txt').write("")
+    tmpdir.join('bjobs.err').write("LSF is down")
+    tmpdir.join('bjobs.rc').write("255")
+    with pytest.raises(SchedulerError):
+        lsf.status(['101'])
+    for _ in range(MISSING_POLLS):
+        monitor.poll()
+    assert job.missing == 0
+    assert not job.finished
+
+    # Only a job bjobs says it has no record of is missing
+    tmpdir.join('bjobs.err').write("Job <101> is not found")
+    assert lsf.status(['101']) == {}
+    for _ in range(MISSING_POLLS):
+        monitor.poll()
+    assert job.finished
+    assert job.completed == [1, 2]
+
+    # A job cleaned out of LSF's records after it was last seen running has finished
+    job = Job('102', 3)
+    job.update({1: 'EXIT', 2: 'RUN', 3: 'PEND'})
+    for _ in range(MISSING_POLLS):
+        job.update(None)
+    assert job.finished
+    assert job.completed == [1, 2, 3]
+    assert job.failed == [1]
+
+    sacct = fake_command(tmpdir, 'sacct', 'echo "sacct: error: slurmdbd not responding" >&2\nexit 1\n')
+    with pytest.raises(SchedulerError):
+        Slurm(sacct=sacct).status(['202'])
+
+
+@pytest.fixture
+def params(tmpdir, jasmin_config):
+    return dict(runid='RUNID', time=1, timeFmt='days', outputdir=str(tmpdir))
+
+
+def test_lsf_script(params):
+    script = LSF().script(params, 3)
+    assert "#BSUB -q short-serial" in script
+    assert "#BSUB -J RUNID[1-3]" in script
+    assert "inputs/input${LSB_JOBINDEX}.txt" in script
+
+
+def test_slurm_script(params):
+    script = Slurm(partition='par-single').script(params, 3)
+    assert "#SBATCH --partition=par-single" in script
+    assert "#SBATCH --time=01:00:00" in script
+    assert "#SBATCH --array=1-3" in script
+    assert "inputs/input${SLURM_ARRAY_TASK_ID}.txt" in script
+    assert "#BSUB" not in script
+
+
+def test_slurm_submit_and_status(tmpdir):
+    sbatch = fake_command(tmpdir, 'sbatch', 'echo "202;cluster"\n')
+    # A job cleaned out of LSF's records after it was last seen running has finished
+    job = Job('102', 3)
+    job.update({1: 'EXIT', 2: 'RUN', 3: 'PEND'})
+    for _ in range(MISSING_POLLS):
+        job.update(None)
+    assert job.finished
+    assert job.completed == [1, 2, 3]
+    assert job.failed == [1]
+
+    sacct = fake_command(tmpdir, 'sacct', 'cat {}\n'.format(tmpdir.join('sacct.txt')))
+    slurm = Slurm(sbatch=sbatch, sacct=sacct)
+    assert slurm.submit(str(tmpdir.join('script.sbatch')), 5) == '202'
+
+    tmpdir.join('sacct.txt').write("202_1|COMPLETED\n202_2|CANCELLED by 1000\n202_3|RUNNING\n202_[4-5]|PENDING\n")
+    assert slurm.status(['202']) == {'202': {1: 'DONE', 2: 'EXIT', 3: 'RUNNING', 4: 'PENDING', 5: 'PENDING'}}
+
+
+def test_local_backend(tmpdir):
+    local = Local(workers=2)
+    script = tmpdir.join('script.sh')
+    script.write('#!/bin/bash\necho ${NAME_INDEX} > out${NAME_INDEX}.txt\n[ ${NAME_INDEX} -ne 3 ]\n')
+    job = Job(local.submit(str(script), 3, cwd=str(tmpdir)), 3)
+    monitor = JobMonitor(local, interval=0.01)
+    monitor.watch(job)
+    assert job.wait(timeout=10)
+    assert job.completed == [1, 2, 3]
+    assert job.failed == [3]
+    assert tmpdir.join('out2.txt').read().strip() == '2'
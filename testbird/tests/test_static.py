@@ -0,0 +1,49 @@
+from testbird.static import OutputFiles, parse_range
+
+
+def fallback(environ, start_response):
+    start_response('200 OK', [])
+    return [b'wps']
+
+
+def get(app, path, **headers):
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+    environ.update(headers)
+    response = {}
+
+    def start_response(status, headers):
+        response['status'] = status
+        response['headers'] = dict(headers)
+    body = b''.join(app(environ, start_response))
+    return response['status'], response['headers'], body
+
+
+def test_parse_range():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=50-500', 100) == (50, 99)
+    assert parse_range('bytes=100-', 100) is False
+    assert parse_range('bytes=0-1,5-6', 100) is None
+    assert parse_range(None, 100) is None
+
+
+def test_output_files(tmpdir):
+    tmpdir.mkdir('run').join('20171101_group1.txt').write('0123456789')
+    app = OutputFiles(fallback, str(tmpdir))
+
+    status, headers, body = get(app, '/outputs/run/20171101_group1.txt')
+    assert status == '200 OK'
+    assert headers['Accept-Ranges'] == 'bytes'
+    assert body == b'0123456789'
+
+    status, headers, body = get(app, '/outputs/run/20171101_group1.txt', HTTP_RANGE='bytes=2-5')
+    assert status == '206 PARTIAL CONTENT'
+    assert headers['Content-Range'] == 'bytes 2-5/10'
+    assert body == b'2345'
+
+    status, headers, body = get(app, '/outputs/run/20171101_group1.txt', HTTP_RANGE='bytes=20-')
+    assert status.startswith('416')
+
+    assert get(app, '/outputs/../../etc/passwd')[0].startswith('404')
+    assert get(app, '/wps')[2] == b'wps'
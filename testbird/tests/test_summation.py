@@ -0,0 +1,29 @@
+import numpy as np
+
+from testbird.summation import Summation
+from testbird.tests.test_nameoutput import write_output
+
+
+def test_summation_periods(tmpdir):
+    files = [write_output(tmpdir, filename='{}_group1.txt'.format(day))
+             for day in ['20171101', '20171102', '20171106', '20171201']]
+    summation = Summation(files)
+
+    days = summation.periods('day')
+    assert len(days) == 4
+    assert np.allclose(days[0][2][3], [0.1, 0.5, 0.5])
+
+    weeks = summation.periods('week')
+    assert [period for period, fields, summed in weeks] == [(2017, 44), (2017, 45), (2017, 48)]
+    assert len(weeks[0][1]) == 2
+    assert np.allclose(weeks[0][2][3], [0.2, 1.0, 1.0])
+
+    months = summation.periods('month')
+    assert [period for period, fields, summed in months] == [(2017, 11), (2017, 12)]
+    assert np.allclose(months[0][2][3], [0.3, 1.5, 1.5])
+
+    (period, fields, (cells, lons, lats, values)), = summation.periods('all')
+    assert period is None
+    assert len(fields) == 4
+    assert list(cells) == [0, 6, 11]
+    assert np.allclose(values, [0.4, 2.0, 2.0])
@@ -0,0 +1,62 @@
+import json
+import datetime as dt
+
+import pytest
+
+from testbird.telemetry import RunTelemetry, parse_report, format_report, load_records, aggregate, TELEMETRY_FILE
+from testbird.tests.common import LSF_REPORT
+
+
+def test_parse_report():
+    assert parse_report(LSF_REPORT) == {'cpu_seconds': 5400.25, 'wall_seconds': 5600.0, 'max_rss_mb': 2560.0}
+    assert parse_report("Script completed\n" + format_report(12.5, 20, 300)) == {
+        'cpu_seconds': 12.5, 'wall_seconds': 20.0, 'max_rss_mb': 300.0}
+    assert parse_report("Script completed\n") == {'cpu_seconds': None, 'wall_seconds': None, 'max_rss_mb': None}
+
+
+def test_run_telemetry(tmpdir):
+    rundir = tmpdir.mkdir('BCK1_3-hourly_CAPEVERDE_1')
+    rundir.join('r-42-1.out').write(LSF_REPORT)
+    telemetry = RunTelemetry(str(rundir), runid='BCK1_3-hourly_CAPEVERDE_1', site='CAPEVERDE',
+                             runtype='BCK 3-hourly', days=2)
+    with telemetry.stage('inputs'):
+        pass
+    with pytest.raises(ValueError):
+        with telemetry.stage('name'):
+            raise ValueError
+    telemetry.add_tasks('42', [dt.date(2017, 11, 1), dt.date(2017, 11, 2)], failed=[2])
+    telemetry.save()
+
+    record = json.loads(rundir.join(TELEMETRY_FILE).read())
+    assert [s['stage'] for s in record['stages']] == ['inputs', 'name']
+    assert record['tasks'][0]['max_rss_mb'] == 2560.0
+    assert record['tasks'][1] == {'jobid': '42', 'index': 2, 'date': '2017-11-02', 'failed': True}
+
+    # Later requests on the run add to the same record, even when they overlap
+    first = RunTelemetry(str(rundir))
+    second = RunTelemetry(str(rundir))
+    with first.stage('plotting'):
+        pass
+    with second.stage('plot_zip'):
+        pass
+    second.save()
+    first.save()
+    first.save()
+    [record] = load_records(str(tmpdir))
+    assert record['site'] == 'CAPEVERDE'
+    assert [s['stage'] for s in record['stages']] == ['inputs', 'name', 'plot_zip', 'plotting']
+
+
+def test_aggregate():
+    records = [{'site': 'CAPEVERDE', 'runtype': 'BCK 3-hourly',
+                'stages': [{'stage': 'zip', 'seconds': float(i)}],
+                'tasks': [{'wall_seconds': 100.0 * i, 'failed': False}, {'wall_seconds': 1e6, 'failed': True}]}
+               for i in range(1, 101)]
+    records.append({'site': 'BEIJING', 'runtype': 'FWD daily', 'stages': [{'stage': 'zip', 'seconds': 5.0}]})
+    result = aggregate(records)
+    zips = result[('CAPEVERDE', 'BCK 3-hourly')]['zip']
+    assert zips['count'] == 100
+    assert zips['p50'] == pytest.approx(50.5)
+    assert zips['p99'] == pytest.approx(99.01)
+    assert result[('CAPEVERDE', 'BCK 3-hourly')]['task_wall_seconds']['p90'] == pytest.approx(9010.0)
+    assert result[('BEIJING', 'FWD daily')] == {'zip': {'count': 1, 'p50': 5.0, 'p90': 5.0, 'p99': 5.0}}
@@ -0,0 +1,84 @@
+import zlib
+import struct
+
+import numpy as np
+import pytest
+
+from testbird.nameoutput import read_field
+from testbird.tiles import TileServer, Layer, LRUCache, encode_png
+from testbird.tests.test_nameoutput import write_output
+
+
+def fallthrough(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'wps']
+
+
+def call(app, path, query=''):
+    status = []
+
+    def start_response(s, headers):
+        status.append(s)
+    body = b''.join(app({'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET'}, start_response))
+    return status[0], body
+
+
+@pytest.fixture
+def server(tmpdir, jasmin_config):
+    outputs = tmpdir.join('RUNID', 'outputs').ensure(dir=True)
+    write_output(outputs)
+    return TileServer(fallthrough, cache_size=4)
+
+
+def test_encode_png():
+    rgba = np.zeros((2, 3, 4), dtype=np.uint8)
+    rgba[1, 2] = (255, 0, 0, 255)
+    png = encode_png(rgba)
+    assert png.startswith(b'\x89PNG\r\n\x1a\n')
+    assert struct.unpack('>II', png[16:24]) == (3, 2)
+    idat = png.index(b'IDAT')
+    length = struct.unpack('>I', png[idat - 4:idat])[0]
+    rows = zlib.decompress(png[idat + 4:idat + 4 + length])
+    assert len(rows) == 2 * (3 * 4 + 1)
+    assert rows[-4:] == b'\xff\x00\x00\xff'
+
+
+def test_layer_sample(tmpdir):
+    layer = Layer(read_field(write_output(tmpdir)), 1)
+    assert np.allclose((layer.vmin, layer.vmax), (0.3, 0.5))
+    values = layer.sample(np.array([-29.3, -29.1, -31.0]), np.array([10.6, 10.4]))
+    assert np.allclose(values, [[0, 0.5, 0], [0.3, 0, 0]])
+
+
+def test_tiles(server):
+    status, body = call(server, '/tiles/RUNID/1/201711010600/0/0/0.png', 'colormap=viridis')
+    assert status == '200 OK'
+    assert body.startswith(b'\x89PNG')
+    # Served again from the cache
+    assert call(server, '/tiles/RUNID/1/201711010600/0/0/0.png', 'colormap=viridis')[1] == body
+
+    assert call(server, '/tiles/RUNID/1/201711020600/0/0/0.png')[0] == '404 NOT FOUND'
+    assert call(server, '/tiles/RUNID/2/201711010600/0/0/0.png')[0] == '404 NOT FOUND'
+    assert call(server, '/tiles/OTHER/1/201711010600/0/0/0.png')[0] == '404 NOT FOUND'
+    assert call(server, '/tiles/RUNID/1/201711010600/0/1/0.png')[0] == '400 BAD REQUEST'
+    assert call(server, '/tiles/RUNID/1/201711010600/0/0/0.png', 'colormap=jet')[0] == '400 BAD REQUEST'
+    assert call(server, '/tiles/RUNID/1/201711010600/0/0/0.png', 'scale=1,0.1')[0] == '400 BAD REQUEST'
+    assert call(server, '/wps') == ('200 OK', b'wps')
+
+
+def test_tiles_new_files(server, tmpdir):
+    assert call(server, '/tiles/RUNID/1/201711010600/0/0/0.png')[0] == '200 OK'
+    assert call(server, '/tiles/RUNID/2/201711010600/0/0/0.png')[0] == '404 NOT FOUND'
+    # The cached index is brought up to date once a file is added
+    write_output(tmpdir.join('RUNID', 'outputs'), filename='20171101_group2.txt')
+    assert call(server, '/tiles/RUNID/2/201711010600/0/0/0.png')[0] == '200 OK'
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
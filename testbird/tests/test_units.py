@@ -0,0 +1,69 @@
+import os
+import datetime as dt
+
+from testbird.units import ContentStore, UnitStore, unit_key, day_outputs
+
+PARAMS = dict(title='CAPEVERDE', longitude=-24.867222, latitude=16.863611, elevation=10, runBackwards=True,
+              time=1, timeFmt='days', domain=[-30.0, -120.0, 90.0, 80.0], elevationOut=[(0, 100)],
+              resolution=0.25, timestamp='3-hourly')
+
+
+def test_unit_key():
+    day = dt.date(2017, 11, 2)
+    key = unit_key(dict(PARAMS, startdate=dt.date(2017, 11, 1), enddate=dt.date(2017, 11, 30)), day)
+    assert unit_key(dict(PARAMS, startdate=dt.date(2017, 10, 15), enddate=dt.date(2017, 11, 5),
+                         runid='BCK1_3-hourly_CAPEVERDE_1'), day) == key
+    assert unit_key(PARAMS, dt.date(2017, 11, 3)) != key
+    assert unit_key(dict(PARAMS, runBackwards=False), day) != key
+
+
+def test_unit_store(tmpdir):
+    outputs = tmpdir.mkdir('run1').mkdir('outputs')
+    for filename in ['20171101_group1.txt', '20171101_group2.txt', '20171102_group1.txt']:
+        outputs.join(filename).write(filename)
+    day = dt.date(2017, 11, 1)
+    files = day_outputs(str(outputs), day)
+    assert [os.path.basename(f) for f in files] == ['20171101_group1.txt', '20171101_group2.txt']
+
+    store = UnitStore(str(tmpdir))
+    key = unit_key(PARAMS, day)
+    assert store.lookup(key) is None
+    store.store(key, files, 'run1')
+    assert [os.path.basename(f) for f in store.lookup(key)] == ['20171101_group1.txt', '20171101_group2.txt']
+
+    # Storing the same day again keeps the first copy
+    store.store(key, files[:1], 'run2')
+    assert len(store.lookup(key)) == 2
+
+    newoutputs = tmpdir.mkdir('run2').mkdir('outputs')
+    assert len(store.link(key, str(newoutputs))) == 2
+    assert newoutputs.join('20171101_group2.txt').read() == '20171101_group2.txt'
+
+    # A unit evicted while it is being linked isn't linked at all
+    listed = store.lookup(key)
+    os.remove(listed[1])
+    store.lookup = lambda key: listed
+    otheroutputs = tmpdir.mkdir('run3').mkdir('outputs')
+    assert store.link(key, str(otheroutputs)) == []
+    assert otheroutputs.listdir() == []
+
+
+def test_content_store_eviction(tmpdir):
+    tmpdir.join('a.txt').write('a')
+    files = [str(tmpdir.join('a.txt'))]
+    store = ContentStore(str(tmpdir.join('store')), max_entries=2)
+    for key in ['a', 'b', 'c']:
+        store.store(key, files)
+    os.utime(str(tmpdir.join('store', 'b', 'meta.json')), (0, 0))
+    assert store.lookup('a') is not None
+    store.evict()
+    assert store.lookup('b') is None
+    assert store.lookup('a') is not None
+    assert store.lookup('c') is not None
+    assert sorted(os.listdir(str(tmpdir.join('store')))) == ['a', 'c']
+
+    store = ContentStore(str(tmpdir.join('store')), max_age_days=1)
+    tmpdir.join('store', 'a', 'meta.json').write('{"created": 0}')
+    store.evict()
+    assert store.lookup('a') is None
+    assert store.lookup('c') is not None
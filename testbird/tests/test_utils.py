@@ -0,0 +1,39 @@
+import os
+from datetime import date, datetime
+
+from testbird.utils import JasminConfig, get_Mk_global, get_Mk_global_array, get_Met_vals
+
+
+def test_jasmin_config_reloads_on_change(tmpdir):
+    cfile = tmpdir.join('jasmin.cfg')
+    cfile.write("[jasmin]\noutputdir = /first\n")
+    config = JasminConfig(str(cfile))
+    assert config.outputdir == '/first'
+
+    parser = config.parser
+    assert config.parser is parser
+
+    cfile.write("[jasmin]\noutputdir = /second\n")
+    st = os.stat(str(cfile))
+    os.utime(str(cfile), (st.st_atime, st.st_mtime + 10))
+    assert config.outputdir == '/second'
+    assert config.parser is not parser
+
+
+def test_get_Mk_global():
+    assert get_Mk_global(datetime(2005, 12, 31, 23, 59)) == 0
+    assert get_Mk_global(datetime(2006, 1, 1)) == 3
+    assert get_Mk_global(date(2013, 4, 29)) == 6
+    assert get_Mk_global(datetime(2013, 4, 30)) == 7
+    assert get_Mk_global(datetime(2017, 11, 1)) == 10
+
+
+def test_get_Mk_global_array():
+    dates = [datetime(2005, 12, 31, 23, 59), date(2006, 1, 1), datetime(2013, 4, 30), date(2017, 11, 1)]
+    assert list(get_Mk_global_array(dates)) == [get_Mk_global(d) for d in dates]
+
+
+def test_get_Met_vals():
+    assert get_Met_vals(6)['MetDeclFileName'] == 'Use_UMG_Mk6_L59PTpp.txt'
+    assert get_Met_vals(10).MetDefnFileName == 'MetDefnUMG_Mk10_L59PTpp.txt'
+    assert get_Met_vals(11)['MetType'] == 'UMG_Mk11PT'
@@ -0,0 +1,67 @@
+import datetime as dt
+
+import pytest
+from pywps.exceptions import InvalidParameterValue
+
+from testbird.write_inputfile import (MetDeclTemplate, get_metdecl_template, InputFileGenerator, generate_inputfile,
+                                      GridSpec, generate_grids, generate_temporal_grids)
+
+
+def test_metdecl_template(tmpdir):
+    declfile = tmpdir.join('Use_UMG_Mk10_L59PTpp.txt')
+    declfile.write("Met Declarations:   \n"
+                   "Glob, NWP Met, UMG, %MetDir%, %TopogDir%, %MetRestoreScript%,\n"
+                   "%MetDir%/extra\n")
+    template = MetDeclTemplate(str(declfile))
+    assert template.render('/met', '/topo', '/restore.ksh') == ("Met Declarations:\n"
+                                                               "Glob, NWP Met, UMG, /met, /topo, /restore.ksh,\n"
+                                                               "/met/extra")
+    assert get_metdecl_template(str(declfile)) is get_metdecl_template(str(declfile))
+
+    # An edited file is read again
+    declfile.write("%TopogDir%\n")
+    declfile.setmtime(declfile.mtime() + 10)
+    assert get_metdecl_template(str(declfile)).render('/met', '/topo', '/restore.ksh') == "/topo"
+
+
+@pytest.fixture
+def params(tmpdir, jasmin_config):
+    return dict(title='CAPEVERDE', longitude=-24.867222, latitude=16.863611, elevation=10, runBackwards=True,
+                time=1, timeFmt='days', domain=[-30.0, -120.0, 90.0, 80.0], elevationOut=[(0, 100)],
+                resolution=0.25, timestamp='3-hourly', runid='RUNID')
+
+
+def test_input_file_generator(tmpdir, params):
+    dates = [dt.date(2017, 11, 1), dt.date(2017, 11, 2)]
+    inputsdir = tmpdir.mkdir('inputs')
+    assert InputFileGenerator(params).write_all(dates, str(inputsdir)) == 2
+    for i, rundate in enumerate(dates, 1):
+        contents = inputsdir.join('input{}.txt'.format(i)).read()
+        assert contents == generate_inputfile(dict(params), rundate, i)
+        assert "for release on {}".format(rundate.strftime("%d/%m/%Y")) in contents
+        assert "_group1" in contents
+        assert "met_data/input{},".format(i) in contents
+
+
+def test_grid_spec(params):
+    grid = GridSpec(params)
+    assert (grid.nx, grid.ny, grid.ncells) == (800, 480, 384000)
+    assert "HGrid1, Lat-Long,     800,     480," in generate_grids(params, grid)
+
+    cur_date = dt.datetime(2017, 11, 1)
+    grid.prepare([cur_date, dt.datetime(2017, 11, 2)])
+    assert grid.origins(cur_date)[0] == '31/10/2017 00:00'
+    assert grid.origins(cur_date)[-1] == '31/10/2017 21:00'
+    forwards = GridSpec(dict(params, runBackwards=False))
+    assert forwards.origins(cur_date)[0] == '02/11/2017 03:00'
+    assert forwards.origins(cur_date)[-1] == '03/11/2017 00:00'
+    daily = GridSpec(dict(params, timestamp='daily', dailyreleaselen=6))
+    assert "TGrid1,              1,  06:00,   31/10/2017 00:00," in generate_temporal_grids(
+        dict(params, timestamp='daily', dailyreleaselen=6), cur_date, daily)
+
+    grid.check(0)
+    grid.check(384000)
+    with pytest.raises(InvalidParameterValue):
+        grid.check(100000)
+    with pytest.raises(InvalidParameterValue):
+        GridSpec(dict(params, domain=[0.0, 0.0, 0.1, 0.1])).check(0)
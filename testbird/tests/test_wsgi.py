@@ -0,0 +1,14 @@
+from testbird import wsgi
+
+
+def test_service_is_reused(tmpdir, monkeypatch):
+    monkeypatch.delenv('PYWPS_CFG', raising=False)
+    app = wsgi.get_app()
+    assert wsgi.get_app() is app
+
+    cfgfile = tmpdir.join('pywps.cfg')
+    cfgfile.write("[server]\nurl = http://localhost:5000/wps\n")
+    monkeypatch.setenv('PYWPS_CFG', str(cfgfile))
+    rebuilt = wsgi.get_app()
+    assert rebuilt is not app
+    assert wsgi.get_app() is rebuilt
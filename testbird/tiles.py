@@ -0,0 +1,247 @@
+import os
+import re
+import zlib
+import struct
+import threading
+from datetime import datetime
+from collections import OrderedDict
+
+import numpy as np
+from matplotlib import cm
+
+from .utils import getjasminconfigs, get_config_int
+from .nameoutput import load_field
+from .runindex import build_index, INDEX_FILE
+from ._compat import parse_qs
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+TILE_SIZE = 256
+
+# /tiles/<runid>/<group>/<YYYYMMDDHHMM>/<z>/<x>/<y>.png
+TILE_PATH = re.compile(r'^/(?P<runid>[^/]+)/(?P<group>\d+)/(?P<time>\d{12})/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.png$')
+
+COLORMAPS = ('coolwarm', 'viridis', 'rainbow')
+
+
+class LRUCache(object):
+    """
+    Thread safe least-recently-used cache holding up to maxsize items
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+def encode_png(rgba):
+    """
+    Encodes an (height, width, 4) uint8 array as a PNG image
+    """
+    height, width = rgba.shape[:2]
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # Each row is preceded by its filter type, 0 for none
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+def tile_lonlat(z, x, y, size=TILE_SIZE):
+    """
+    Longitude of each pixel column and latitude of each pixel row of a web mercator (slippy map) tile
+    """
+    n = 2.0 ** z
+    lons = (x + (np.arange(size) + 0.5) / size) / n * 360.0 - 180.0
+    fraction = (y + (np.arange(size) + 0.5) / size) / n
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * fraction))))
+    return lons, lats
+
+
+class Layer(object):
+    """
+    One timestamp of one output group of a run as a dense concentration grid, ready to be cut into tiles
+    """
+    def __init__(self, field, column):
+        header = field.header
+        self.x0 = float(header['X grid origin'])
+        self.y0 = float(header['Y grid origin'])
+        self.dx = float(header['X grid resolution'])
+        self.dy = float(header['Y grid resolution'])
+        self.grid = field.grid(np.asarray(field.values[column]))
+        positive = self.grid[self.grid > 0]
+        if positive.size:
+            self.vmin, self.vmax = float(positive.min()), float(positive.max())
+        else:
+            self.vmin = self.vmax = 1.0
+
+    def sample(self, lons, lats):
+        """
+        :return: (len(lats), len(lons)) array of the concentration in the grid cell under each pixel, 0 outside
+        """
+        ny, nx = self.grid.shape
+        ix = np.floor((lons - self.x0) / self.dx).astype(np.int64)
+        # Domains can run past 180 degrees east
+        wrapped = np.floor((lons + 360.0 - self.x0) / self.dx).astype(np.int64)
+        ix = np.where((ix >= 0) & (ix < nx), ix, wrapped)
+        iy = np.floor((lats - self.y0) / self.dy).astype(np.int64)
+        validx = (ix >= 0) & (ix < nx)
+        validy = (iy >= 0) & (iy < ny)
+        values = self.grid[np.clip(iy, 0, ny - 1)[:, None], np.clip(ix, 0, nx - 1)[None, :]]
+        return np.where(validy[:, None] & validx[None, :], values, 0)
+
+    def render(self, z, x, y, colormap='coolwarm', scale=None):
+        """
+        Colours a tile with log scaled concentrations, leaving cells without any transparent
+        :param scale: (min, max) concentrations of the colour scale, by default those of the whole layer
+        :return: PNG image
+        """
+        vmin, vmax = scale or (self.vmin, self.vmax)
+        lons, lats = tile_lonlat(z, x, y)
+        values = self.sample(lons, lats)
+        present = values > 0
+        lmin, lmax = np.log10(vmin), np.log10(vmax)
+        with np.errstate(divide='ignore'):
+            norm = (np.log10(np.where(present, values, vmin)) - lmin) / ((lmax - lmin) or 1.0)
+        rgba = cm.get_cmap(colormap)(np.clip(norm, 0, 1), bytes=True)
+        rgba[..., 3] = np.where(present, 255, 0)
+        return encode_png(rgba)
+
+
+def _getmtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+class TileServer(object):
+    """
+    WSGI middleware serving map tiles of NAME concentration fields next to the WPS service, so web clients can
+    pan and zoom through a run without plots being drawn for them. Tiles are rendered lazily from the cached
+    concentration grids and kept in an LRU cache. Everything outside the prefix goes to the wrapped application.
+
+    GET <prefix>/<runid>/<group>/<YYYYMMDDHHMM>/<z>/<x>/<y>.png?colormap=viridis&scale=1e-9,1e-4
+    """
+    def __init__(self, application, prefix='/tiles', cache_size=None):
+        self.application = application
+        self.prefix = prefix.rstrip('/')
+        if cache_size is None:
+            cache_size = get_config_int('tiles', 'cache_size', 2000)
+        self.tiles = LRUCache(int(cache_size))
+        self.layers = LRUCache(32)
+        self.indexes = LRUCache(32)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix + '/'):
+            return self.application(environ, start_response)
+
+        match = TILE_PATH.match(path[len(self.prefix):])
+        if match is None:
+            return self._error(start_response, '404 NOT FOUND', "Tiles are at "
+                               "{}/<runid>/<group>/<YYYYMMDDHHMM>/<z>/<x>/<y>.png".format(self.prefix))
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        try:
+            colormap = query.get('colormap', ['coolwarm'])[0]
+            if colormap not in COLORMAPS:
+                raise ValueError("colormap must be one of {}".format(', '.join(COLORMAPS)))
+            scale = None
+            if 'scale' in query:
+                scale = tuple(float(v) for v in query['scale'][0].split(','))
+                if len(scale) != 2 or not 0 < scale[0] < scale[1]:
+                    raise ValueError("scale must be two positive concentrations, min,max")
+            datetime.strptime(match.group('time'), "%Y%m%d%H%M")
+            z, x, y = int(match.group('z')), int(match.group('x')), int(match.group('y'))
+            if z > 20 or x >= 2 ** z or y >= 2 ** z:
+                raise ValueError("No tile {}/{}/{}".format(z, x, y))
+        except ValueError as e:
+            return self._error(start_response, '400 BAD REQUEST', str(e))
+
+        try:
+            png = self.tile(match.group('runid'), int(match.group('group')), match.group('time'), z, x, y,
+                            colormap, scale)
+        except Exception:
+            LOGGER.exception("Unable to render tile %s" % path)
+            return self._error(start_response, '500 INTERNAL SERVER ERROR', "Unable to render tile")
+        if png is None:
+            return self._error(start_response, '404 NOT FOUND', "No such run, group or time")
+
+        start_response('200 OK', [('Content-Type', 'image/png'),
+                                  ('Content-Length', str(len(png))),
+                                  ('Cache-Control', 'max-age=3600')])
+        return [png]
+
+    def _error(self, start_response, status, message):
+        start_response(status, [('Content-Type', 'text/plain')])
+        return [message.encode('utf-8')]
+
+    def tile(self, runid, group, time, z, x, y, colormap='coolwarm', scale=None):
+        """
+        :param time: YYYYMMDDHHMM
+        :return: PNG image, or None if the run doesn't have the group or time
+        """
+        layer = self.layer(runid, group, time)
+        if layer is None:
+            return None
+        key = (layer.key, z, x, y, colormap, scale)
+        png = self.tiles.get(key)
+        if png is None:
+            png = layer.render(z, x, y, colormap, scale)
+            self.tiles.put(key, png)
+        return png
+
+    def layer(self, runid, group, time):
+        if runid.startswith('.') or os.path.basename(runid) != runid:
+            return None
+        outputdir = os.path.join(getjasminconfigs().outputdir, runid, 'outputs')
+        try:
+            dir_mtime = os.path.getmtime(outputdir)
+        except OSError:
+            return None
+
+        # Indexes are cached by the modification time of the index file, which build_index touches. Files added
+        # or removed since then leave the directory at least as new as it, and the index is brought up to date.
+        index_mtime = _getmtime(os.path.join(outputdir, INDEX_FILE))
+        index = None
+        if index_mtime is not None and index_mtime > dir_mtime:
+            index = self.indexes.get((outputdir, index_mtime))
+        if index is None:
+            index = build_index(outputdir)
+            self.indexes.put((outputdir, _getmtime(os.path.join(outputdir, INDEX_FILE))), index)
+
+        timestamp = datetime.strptime(time, "%Y%m%d%H%M").strftime("%d/%m/%Y %H:%M UTC")
+        for filegroup, filename, column in index.lookup(timestamp):
+            if filegroup != group:
+                continue
+            st = os.stat(filename)
+            key = (filename, st.st_mtime, st.st_size, column)
+            layer = self.layers.get(key)
+            if layer is None:
+                layer = Layer(load_field(filename), column)
+                layer.key = key
+                self.layers.put(key, layer)
+            return layer
+        return None
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+from .utils import getjasminconfigs, link_file, atomic_dir
+from .nameoutput import GROUP_FILE
+from .runcache import canonical_params
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+UNITS_DIR = '.units'
+META_FILE = 'meta.json'
+
+# The date range only decides which days are run, each unit is a single day
+RANGE_PARAMS = ('startdate', 'enddate')
+
+
+def unit_key(params, rundate):
+    """
+    Hash identifying the NAME output of a single day: the site, direction, duration, elevation ranges, domain,
+    resolution and the rest of the run parameters, apart from the date range, plus the day itself
+    """
+    params = dict((k, v) for k, v in params.items() if k not in RANGE_PARAMS)
+    digest = hashlib.sha1(canonical_params(params).encode('utf-8'))
+    digest.update(rundate.strftime("%Y%m%d").encode('utf-8'))
+    return digest.hexdigest()
+
+
+def day_outputs(outputsdir, rundate):
+    """
+    :return: paths of the NAME output files of the run released on rundate, named <YYYYMMDD>_group<N>.txt
+    """
+    prefix = rundate.strftime("%Y%m%d")
+    files = []
+    for filename in sorted(os.listdir(outputsdir)):
+        match = GROUP_FILE.match(filename)
+        if match is not None and match.group('name') == prefix:
+            files.append(os.path.join(outputsdir, filename))
+    return files
+
+
+class ContentStore(object):
+    """
+    Sets of files kept under a content key, so whatever would make the same files again can link them instead.
+
+    Each entry is a directory <root>/<key> holding hard links to the files, with a meta.json written last to
+    mark it complete. As in the run cache, entries expire some days after they were stored, and the
+    modification time of meta.json is bumped on every hit and is what the least recently used entries are
+    evicted by. Eviction reads every entry, so it is left to callers to run once they have stored a batch.
+    """
+    def __init__(self, root, max_entries=0, max_age_days=0):
+        """
+        :param root: directory the entries are kept in
+        :param max_entries: number of entries kept, 0 for no limit
+        :param max_age_days: age after which an entry is removed, 0 for no limit
+        """
+        self.root = root
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 24 * 3600
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self._path(key), META_FILE), 'r') as fin:
+                return json.load(fin)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _expired(self, meta, now):
+        return self.max_age and now - meta.get('created', now) > self.max_age
+
+    def lookup(self, key):
+        """
+        :return: paths of the entry's files, or None if there is no such entry
+        """
+        meta = self._read(key)
+        if meta is None:
+            return None
+        if self._expired(meta, time.time()):
+            self.discard(key)
+            return None
+        path = self._path(key)
+        try:
+            os.utime(os.path.join(path, META_FILE), None)
+            return sorted(os.path.join(path, f) for f in os.listdir(path) if f != META_FILE)
+        except OSError:
+            # Evicted by another request in the meantime
+            return None
+
+    def store(self, key, files, **meta):
+        """
+        Adds a set of files, unless there already is an entry for the key
+        :param key: content key
+        :param files: the files
+        :param meta: anything else worth recording in meta.json
+        """
+        if not files or self.lookup(key) is not None:
+            return
+        try:
+            with atomic_dir(self._path(key)) as tmpdir:
+                for filename in files:
+                    link_file(filename, os.path.join(tmpdir, os.path.basename(filename)))
+                with open(os.path.join(tmpdir, META_FILE), 'w') as fout:
+                    json.dump(dict(meta, created=time.time()), fout)
+        except OSError:
+            # Another request stored the same files first
+            if self.lookup(key) is None:
+                raise
+
+    def link(self, key, outdir):
+        """
+        Puts the entry's files into a directory
+        :return: paths of the files in outdir, empty if there is no such entry or it couldn't be linked whole
+        """
+        linked, made = [], []
+        try:
+            for filename in self.lookup(key) or []:
+                dst = os.path.join(outdir, os.path.basename(filename))
+                if not os.path.exists(dst):
+                    link_file(filename, dst)
+                    made.append(dst)
+                linked.append(dst)
+        except (IOError, OSError):
+            # Evicted by another request in the meantime, what was linked of it is taken away again
+            LOGGER.warning("Unable to link %s into %s" % (key, outdir))
+            for dst in made:
+                os.remove(dst)
+            return []
+        return linked
+
+    def discard(self, key):
+        # Moved out of the way first, so no one finds it half removed
+        try:
+            trash = tempfile.mkdtemp(dir=self.root, prefix='.discard')
+        except OSError:
+            return
+        try:
+            os.rename(self._path(key), os.path.join(trash, key))
+        except OSError:
+            pass
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self):
+        """
+        Removes expired entries and, beyond max_entries, the least recently used ones
+        """
+        if not (self.max_entries or self.max_age) or not os.path.isdir(self.root):
+            return
+        now = time.time()
+        entries = []
+        for key in os.listdir(self.root):
+            # Entries being stored or removed
+            if key.startswith('.'):
+                continue
+            meta = self._read(key)
+            if meta is None:
+                continue
+            if self._expired(meta, now):
+                self.discard(key)
+                continue
+            try:
+                entries.append((os.path.getmtime(os.path.join(self._path(key), META_FILE)), key))
+            except OSError:
+                pass
+        if self.max_entries and len(entries) > self.max_entries:
+            entries.sort()
+            for _, key in entries[:len(entries) - self.max_entries]:
+                self.discard(key)
+
+
+class UnitStore(ContentStore):
+    """
+    Keeps the NAME output of every completed day, so a request overlapping earlier ones only has to run the
+    days that haven't been run before. Each unit is an entry in outputdir/.units.
+    """
+    def __init__(self, outputdir, max_entries=0, max_age_days=0):
+        """
+        :param outputdir: directory the run directories are in
+        """
+        super(UnitStore, self).__init__(os.path.join(outputdir, UNITS_DIR), max_entries, max_age_days)
+
+    def store(self, key, files, runid):
+        """
+        Adds the output files of a completed day
+        :param key: unit key
+        :param files: the day's output files
+        :param runid: run the day was computed in, recorded in meta.json
+        """
+        # The files are kept when the run directory is deleted, so across file systems they are copied
+        super(UnitStore, self).store(key, files, runid=runid)
+
+
+def get_unitstore():
+    """
+    The per-day unit store, switched on and off by '[units] enabled' in jasmin.cfg
+    :return: UnitStore, or None if it is switched off
+    """
+    config = getjasminconfigs()
+    if config.get_option('units', 'enabled', 'true').lower() != 'true':
+        return None
+    return UnitStore(config.outputdir,
+                     max_entries=int(config.get_option('units', 'max_entries', 0)),
+                     max_age_days=float(config.get_option('units', 'max_age_days', 0)))
@@ -1,6 +1,18 @@
 from datetime import datetime, timedelta
+from collections import namedtuple
+from contextlib import contextmanager
 import os
+import json
+import bisect
+import shutil
+import calendar
+import tempfile
+import threading
 import ConfigParser
+import multiprocessing
+
+import numpy as np
+from pywps import configuration
 
 
 def daterange(start_date, end_date):
@@ -8,15 +20,90 @@ def daterange(start_date, end_date):
         yield start_date + timedelta(n)
 
 
+class JasminConfig(object):
+    """
+    The JASMIN specific configurations from jasmin.cfg. The file is only parsed again when its modification
+    time changes, so this can be shared and called as often as needed.
+    """
+    def __init__(self, cfile):
+        self.cfile = cfile
+        self._mtime = None
+        self._parser = None
+        self._lock = threading.Lock()
+
+    @property
+    def parser(self):
+        """
+        :return: configparser obj, re-read if the file has changed
+        """
+        try:
+            mtime = os.path.getmtime(self.cfile)
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._parser is None or mtime != self._mtime:
+                cparser = ConfigParser.SafeConfigParser()
+                cparser.read([self.cfile])
+                self._parser = cparser
+                self._mtime = mtime
+            return self._parser
+
+    def get(self, section, option):
+        return self.parser.get(section, option)
+
+    def get_option(self, section, option, default=None):
+        """
+        Value of an optional setting, or the default if it isn't in jasmin.cfg
+        """
+        parser = self.parser
+        if parser.has_option(section, option):
+            return parser.get(section, option)
+        return default
+
+    @property
+    def userdir(self):
+        return self.get('jasmin', 'userdir')
+
+    @property
+    def namedir(self):
+        return self.get('jasmin', 'namedir')
+
+    @property
+    def topodir(self):
+        return self.get('jasmin', 'topodir')
+
+    @property
+    def utilsdir(self):
+        return self.get('jasmin', 'utilsdir')
+
+    @property
+    def outputdir(self):
+        return self.get('jasmin', 'outputdir')
+
+
+JASMIN_CONFIG = JasminConfig(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jasmin.cfg'))
+
+
 def getjasminconfigs():
     """
-    This will use ConfigParser to retrieve the JASMIN specific configurations
-    :return: configparser obj
+    This will retrieve the JASMIN specific configurations
+    :return: JasminConfig obj, shared by the whole process
     """
-    cfile = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'jasmin.cfg')
-    cparser = ConfigParser.SafeConfigParser()
-    cparser.read([cfile])
-    return cparser
+    return JASMIN_CONFIG
+
+
+# Start of each global Met 'Mk' version in UTC epoch seconds, runs before the first have no global Met data (0)
+MK_BOUNDARIES = (1136073600, 1230768000, 1257811200, 1268092800, 1367280000, 1405382400, 1440460800, 1499731200)
+MK_VERSIONS = (0, 3, 4, 5, 6, 7, 8, 9, 10)
+
+
+def _utc_seconds(date):
+    """
+    Seconds since the epoch of a date or datetime, naive datetimes are taken to be UTC
+    """
+    if isinstance(date, datetime):
+        return calendar.timegm(date.utctimetuple())
+    return calendar.timegm(date.timetuple())
 
 
 def get_Mk_global(date):
@@ -25,75 +112,80 @@ def get_Mk_global(date):
     :param date: datetime object
     :return: integer representing the globalMetMk value
     """
+    return MK_VERSIONS[bisect.bisect_right(MK_BOUNDARIES, _utc_seconds(date))]
+
+
+def get_Mk_global_array(dates):
+    """
+    Vectorised get_Mk_global, for checking a whole range of run dates at once
+    :param dates: sequence of dates/datetimes or a numpy datetime64 array, naive datetimes are taken to be UTC
+    :return: numpy array of globalMetMk values
+    """
+    seconds = np.asarray(dates, dtype='datetime64[s]').astype(np.int64)
+    return np.asarray(MK_VERSIONS)[np.searchsorted(MK_BOUNDARIES, seconds, side='right')]
+
+
+class MetVals(namedtuple('MetVals', ['MetType', 'MetDefnFileName', 'MetDeclFileName', 'MetSuffix',
+                                     'ArchiveMetDir', 'MetPrefix'])):
+    """
+    Immutable file properties of a global Met 'Mk' version, which can also be looked up by name: vals['MetType']
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, slice)):
+            return super(MetVals, self).__getitem__(key)
+        return getattr(self, key)
 
-    seconds = int(datetime.strftime(date, "%s"))
-
-    if seconds < 1136073600:
-        return 0
-    elif seconds < 1230768000:
-        return 3
-    elif seconds < 1257811200:
-        return 4
-    elif seconds < 1268092800:
-        return 5
-    elif seconds < 1367280000:
-        return 6
-    elif seconds < 1405382400:
-        return 7
-    elif seconds < 1440460800:
-        return 8
-    elif seconds < 1499731200:
-        return 9
-    else:
-        return 10
+
+def _generic_Met_vals(Mk):
+    return MetVals(MetType='UMG_Mk'+str(Mk)+'PT',
+                   MetDefnFileName='MetDefnUMG_Mk'+str(Mk)+'_L59PTpp.txt',
+                   MetDeclFileName='Use_UMG_Mk'+str(Mk)+'_L59PTpp.txt',
+                   MetSuffix='UMG_Mk'+str(Mk)+'_[IM]_L59PT*.pp',
+                   ArchiveMetDir='Global/UMG_Mk'+str(Mk)+'PT',
+                   MetPrefix='MO')
+
+
+# Based on the script BackRuns_OneSite_ByDay.ksh, the file properties of each global Mk value
+MET_VALS = {
+    3: MetVals(MetType='GLOUM6',
+               MetDefnFileName='MetDefnUM6G.txt',
+               MetDeclFileName='Use_UM6G.txt',
+               MetSuffix='GLOUM6',
+               ArchiveMetDir='Global/GLOUM6',
+               MetPrefix='HP'),
+    4: MetVals(MetType='GLOUM6pp',
+               MetDefnFileName='MetDefnUM6Gpp.txt',
+               MetDeclFileName='Use_UM6Gpp.txt',
+               MetSuffix='GLOUM6.pp',
+               ArchiveMetDir='Global/GLOUM6pp',
+               MetPrefix='HP'),
+    5: MetVals(MetType='UMG_Mk5',
+               MetDefnFileName='MetDefnUMG_Mk5_L52pp.txt',
+               MetDeclFileName='Use_UMG_Mk5_L52pp.txt',
+               MetSuffix='UMG_Mk5_L52.pp',
+               ArchiveMetDir='Global/UMG_Mk5',
+               MetPrefix='MO'),
+    6: MetVals(MetType='UMG_Mk6PT',
+               MetDefnFileName='MetDefnUMG_Mk6_L59PTpp.txt',
+               MetDeclFileName='Use_UMG_Mk6_L59PTpp.txt',
+               MetSuffix='UMG_Mk6_L59PT*.pp',
+               ArchiveMetDir='Global/UMG_Mk6PT',
+               MetPrefix='MO'),
+}
+MET_VALS.update((Mk, _generic_Met_vals(Mk)) for Mk in MK_VERSIONS if Mk not in MET_VALS)
 
 
 def get_Met_vals(Mk):
     """
     Based on the script BackRuns_OneSite_ByDay.ksh, retrieves various file properties based on the global Mk value
     :param Mk: integer globalMetMk
-    :return: dictionary of variables
-    """
-
-    d = dict()
-
-    if Mk == 3:
-        d['MetType'] = 'GLOUM6'
-        d['MetDefnFileName'] = 'MetDefnUM6G.txt'
-        d['MetDeclFileName'] = 'Use_UM6G.txt'
-        d['MetSuffix'] = 'GLOUM6'
-        d['ArchiveMetDir'] = 'Global/GLOUM6'
-        d['MetPrefix'] = 'HP'
-    elif Mk == 4:
-        d['MetType'] = 'GLOUM6pp'
-        d['MetDefnFileName'] = 'MetDefnUM6Gpp.txt'
-        d['MetDeclFileName'] = 'Use_UM6Gpp.txt'
-        d['MetSuffix'] = 'GLOUM6.pp'
-        d['ArchiveMetDir'] = 'Global/GLOUM6pp'
-        d['MetPrefix'] = 'HP'
-    elif Mk == 5:
-        d['MetType'] = 'UMG_Mk5'
-        d['MetDefnFileName'] = 'MetDefnUMG_Mk5_L52pp.txt'
-        d['MetDeclFileName'] = 'Use_UMG_Mk5_L52pp.txt'
-        d['MetSuffix'] = 'UMG_Mk5_L52.pp'
-        d['ArchiveMetDir'] = 'Global/UMG_Mk5'
-        d['MetPrefix'] = 'MO'
-    elif Mk == 6:
-        d['MetType'] = 'UMG_Mk6PT'
-        d['MetDefnFileName'] = 'MetDefnUMG_Mk6_L59PTpp.txt'
-        d['MetDeclFileName'] = 'Use_UMG_Mk6_L59PTpp.txt'
-        d['MetSuffix'] = 'UMG_Mk6_L59PT*.pp'
-        d['ArchiveMetDir'] = 'Global/UMG_Mk6PT'
-        d['MetPrefix'] = 'MO'
-    else:
-        d['MetType'] = 'UMG_Mk'+str(Mk)+'PT'
-        d['MetDefnFileName'] = 'MetDefnUMG_Mk'+str(Mk)+'_L59PTpp.txt'
-        d['MetDeclFileName'] = 'Use_UMG_Mk'+str(Mk)+'_L59PTpp.txt'
-        d['MetSuffix'] = 'UMG_Mk'+str(Mk)+'_[IM]_L59PT*.pp'
-        d['ArchiveMetDir'] = 'Global/UMG_Mk'+str(Mk)+'PT'
-        d['MetPrefix'] = 'MO'
-
-    return d
+    :return: MetVals, read like a dictionary of variables
+    """
+    if Mk in MET_VALS:
+        return MET_VALS[Mk]
+    return _generic_Met_vals(Mk)
 
 
 def estimatereq(time):
@@ -124,3 +216,92 @@ def get_num_dates(start, end, sum, type='3-hourly'):
         return len(range(start.month, (end.year - start.year) * 12 + end.month + 1))
     elif sum == 'week':
         return len(range(start.isocalendar()[1], (end.year - start.year) * 52 + end.isocalendar()[1] + 1))
+
+
+def makedirs(path):
+    """
+    Creates a directory and its parents unless it already exists, whoever else is creating it at the same time
+    """
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
+def link_file(src, dst, copy=True):
+    """
+    Hard links src to dst, which costs no space. Across file systems the file is copied instead, or symbolically
+    linked if copy is False and it doesn't have to outlive src.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        if copy:
+            shutil.copy2(src, dst)
+        else:
+            os.symlink(os.path.abspath(src), dst)
+
+
+def write_json(path, data, mode=None, **kwargs):
+    """
+    Writes data to a JSON file atomically: it goes to a temporary file in the same directory which is then
+    renamed over path, so readers see either the old contents or the new, never half of them.
+    :param mode: permissions of the file, those of mkstemp (0600) if not given
+    :param kwargs: passed on to json.dump
+    """
+    fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            json.dump(data, fout, **kwargs)
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        os.rename(tmpname, path)
+    except BaseException:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def atomic_dir(path, replace=False):
+    """
+    Builds a directory under a temporary name in the body of a with statement, which is given its path, and
+    renames it to path at the end, so readers never see it half made. It is removed if the body fails.
+    :param replace: remove whatever is already at path, otherwise renaming fails with OSError if it exists
+    """
+    parent = os.path.dirname(path)
+    makedirs(parent)
+    tmpdir = tempfile.mkdtemp(dir=parent, prefix='.tmp')
+    try:
+        yield tmpdir
+        if replace and os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(tmpdir, path)
+    except BaseException:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def get_config_int(section, option, default=0):
+    """
+    An integer setting from the pywps config
+    :return: the setting, or default if it is missing or not a number
+    """
+    try:
+        return int(configuration.get_config_value(section, option))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_config_cpus(section, option):
+    """
+    A number of workers from the pywps config, where 0 or no setting means one per cpu
+    """
+    count = get_config_int(section, option)
+    if count < 1:
+        count = multiprocessing.cpu_count()
+    return count
@@ -5,11 +5,62 @@ import re
 import logging
 import datetime as dt
 
+import numpy as np
+from pywps.exceptions import InvalidParameterValue
+
 from .utils import get_Mk_global, get_Met_vals, getjasminconfigs
 
 LOGGER = logging.getLogger("PYWPS")
 
 
+class MetDeclTemplate(object):
+    """
+    A Met declaration file split once into its literal text and the %MetDir%, %TopogDir% and %MetRestoreScript%
+    placeholders, so filling it in for each input file is a single join.
+    """
+    PLACEHOLDERS = re.compile('(%MetDir%|%TopogDir%|%MetRestoreScript%)')
+
+    def __init__(self, filename):
+        with open(filename, 'r') as ins:
+            text = "\n".join(l.rstrip() for l in ins)
+        # re.split keeps the placeholders at the odd indices
+        self.segments = self.PLACEHOLDERS.split(text)
+
+    def sections(self, metdir, topodir, metrestorescript):
+        """
+        :return: generator of the declaration text, with the placeholders substituted
+        """
+        values = {'%MetDir%': metdir, '%TopogDir%': topodir, '%MetRestoreScript%': metrestorescript}
+        for i, seg in enumerate(self.segments):
+            yield values[seg] if i % 2 else seg
+
+    def render(self, metdir, topodir, metrestorescript):
+        """
+        :return: the declarations with the placeholders substituted
+        """
+        return "".join(self.sections(metdir, topodir, metrestorescript))
+
+
+_metdecl_templates = {}
+
+
+def get_metdecl_template(filename):
+    """
+    Met declaration template for a file, read from disk again only when the file has changed
+    :param filename: path to the Met declaration file
+    :return: MetDeclTemplate
+    """
+    try:
+        mtime = os.path.getmtime(filename)
+    except OSError:
+        raise Exception("Cannot find Met Declaration file {}".format(filename))
+    cached = _metdecl_templates.get(filename)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, MetDeclTemplate(filename))
+        _metdecl_templates[filename] = cached
+    return cached[1]
+
+
 def generate_hourlys(params, index, cur_date, start_hour, stop_hour):
     """
     This will add the SourceTermAndOutputRequest_Template text into the file for each hour it needs to be run.
@@ -67,13 +118,124 @@ Name,                             Quantity,      Species,                  Sourc
 
 
 
-def generate_coords(params, cur_date):
+def run_duration(params):
+    """
+    Number of hours NAME runs for, the maximum particle age plus the release length.
+    Also stored in params['runDuration'] for the output requirements.
+    """
+    if params['timeFmt'] == "days":
+        maxagehours = params['time']*24
+    else:
+        maxagehours = params['time']
 
-    # Values come in as minY,minX,maxY,maxX
-    CompDom_Xmin = params['domain'][1]
-    CompDom_Xmax = params['domain'][3]
-    CompDom_Ymin = params['domain'][0]
-    CompDom_Ymax = params['domain'][2]
+    if params['timestamp'] == '3-hourly':
+        runDuration = maxagehours + 3
+    else:
+        runDuration = maxagehours + params['dailyreleaselen']
+    params['runDuration'] = runDuration
+    return runDuration
+
+
+class GridSpec(object):
+    """
+    The horizontal, vertical and temporal grids of a run, worked out once for the whole date range.
+
+    The horizontal grid has whole numbers of cells, so NAME doesn't have to reconcile fractional nX and nY
+    with the domain. The temporal grid origins of every run date are computed together as numpy datetime64
+    arrays, then looked up as each input file is written.
+    """
+    def __init__(self, params):
+        """
+        :param params: input parameters
+        """
+        # Values come in as minY,minX,maxY,maxX
+        self.xmin = params['domain'][1]
+        self.xmax = params['domain'][3]
+        self.ymin = params['domain'][0]
+        self.ymax = params['domain'][2]
+        self.resolution = params['resolution']
+
+        self.nx = int(round(abs(self.xmax - self.xmin) / self.resolution))
+        self.ny = int(round(abs(self.ymax - self.ymin) / self.resolution))
+
+        # (Z0, dZ) of each output level
+        self.zgrids = []
+        for minele, maxele in params['elevationOut']:
+            dZ = maxele - minele
+            self.zgrids.append((minele + (dZ/2), dZ))
+
+        self.time = params['time']
+        self.timestamp = params['timestamp']
+        self.runBackwards = params['runBackwards']
+        self.dailyreleaselen = params.get('dailyreleaselen')
+        self._origins = {}
+
+    @property
+    def ncells(self):
+        """
+        Number of cells in each output field
+        """
+        return self.nx * self.ny * len(self.zgrids)
+
+    def check(self, max_cells):
+        """
+        Rejects grids that are empty or larger than the cell budget
+        :param max_cells: largest number of cells allowed in each output field, 0 for no limit
+        """
+        if self.nx < 1 or self.ny < 1:
+            raise InvalidParameterValue("The domain is smaller than a single grid cell")
+        if max_cells and self.ncells > max_cells:
+            raise InvalidParameterValue(
+                "The output grid of {} x {} cells on {} levels is larger than the limit of {} cells, "
+                "use a smaller domain or a coarser resolution".format(self.nx, self.ny, len(self.zgrids), max_cells))
+
+    def offsets(self):
+        """
+        :return: start of each temporal grid relative to the release start, as numpy timedelta64 minutes
+        """
+        days = np.timedelta64(int(self.time * 24 * 60), 'm')
+        if self.timestamp != '3-hourly':
+            return np.array([-days])
+        steps = np.arange(8) * np.timedelta64(3 * 60, 'm')
+        if self.runBackwards:
+            return steps - days
+        return steps + np.timedelta64(3 * 60, 'm') + days
+
+    def prepare(self, run_datetimes):
+        """
+        Computes the temporal grid origins of all the run dates at once
+        :param run_datetimes: datetimes the releases start
+        """
+        run_datetimes = [d for d in run_datetimes if d not in self._origins]
+        if not run_datetimes:
+            return
+        origins = np.array(run_datetimes, dtype='datetime64[m]')[:, None] + self.offsets()[None, :]
+        for cur_date, row in zip(run_datetimes, np.datetime_as_string(origins)):
+            # YYYY-MM-DDTHH:MM as DD/MM/YYYY HH:MM
+            self._origins[cur_date] = ["{}/{}/{} {}".format(s[8:10], s[5:7], s[:4], s[11:16]) for s in row]
+
+    def origins(self, cur_date):
+        """
+        :param cur_date: datetime the release starts
+        :return: list of the formatted origin of each temporal grid
+        """
+        if cur_date not in self._origins:
+            self.prepare([cur_date])
+        return self._origins[cur_date]
+
+
+def get_max_cells():
+    """
+    The cell budget of a single output field, '[grids] max_cells' in jasmin.cfg
+    """
+    return int(getjasminconfigs().get_option('grids', 'max_cells', '0'))
+
+
+def generate_grids(params, grid=None):
+    """
+    The coordinate systems, release location and horizontal and vertical grids, these are the same for every day.
+    """
+    grid = grid or GridSpec(params)
 
     coordsstrings = []
 
@@ -92,136 +254,70 @@ Name,         H-Coord,             X,             Y,
 {}, Lat-Long, {}, {},
 """.format(params['title'], params['longitude'], params['latitude']))
 
-    grid1_nX = abs((CompDom_Xmin - CompDom_Xmax) * 1/params['resolution'])
-    grid1_nY = abs((CompDom_Ymin - CompDom_Ymax) * 1/params['resolution'])
-
     coordsstrings.append("""
 Horizontal Grids:
 Name,    H-Coord,         nX,         nY,         dX,         dY,        X Min,        Y Min,
 HGrid1, Lat-Long,     {},     {},     {},     {},     {},     {},
-""".format(grid1_nX, grid1_nY, params['resolution'], params['resolution'], CompDom_Xmin, CompDom_Ymin))
+""".format(grid.nx, grid.ny, grid.resolution, grid.resolution, grid.xmin, grid.ymin))
 
     coordsstrings.append("""
 Vertical Grids:
 Name,   Z-Coord,  nZ,      Z0,      dZ,""")
 
-    nzgrids = 0
-    for minele, maxele in params['elevationOut']:
-        nzgrids += 1
-        dZ = maxele - minele
-        Z0 = minele + (dZ/2)
+    for nzgrids, (Z0, dZ) in enumerate(grid.zgrids, 1):
         coordsstrings.append("ZGrid{},   m agl,   1,    {},   {},".format(nzgrids, Z0, dZ))
 
-    if params['timeFmt'] == "days":
-        maxagehours = params['time']*24
-    else:
-        maxagehours = params['time']
+    return "\n".join(coordsstrings)
+
+
+def generate_temporal_grids(params, cur_date, grid=None):
+    """
+    The temporal grids, which depend on the date being run.
+    """
+    grid = grid or GridSpec(params)
+    origins = grid.origins(cur_date)
 
     if params['timestamp'] == '3-hourly':
-        runDuration = maxagehours + 3
-        params['runDuration'] = runDuration
-        coordsstrings.append("""
+        coordsstrings = ["""
 Temporal Grids:
-Name,                      nt,     dt,               t0,""")
-        if params['runBackwards']:
-            for i in range(1,9):
-                coordsstrings.append("TGrid{},              1,  03:00,   {},".format(i,
-                                                                                     dt.datetime.strftime(
-                                                                                         cur_date - dt.timedelta(
-                                                                                             days=params['time']),
-                                                                                         '%d/%m/%Y %H:%M')
-                                                                                     ))
-                cur_date = cur_date + dt.timedelta(hours=3)
-        else:
-            for i in range(1,9):
-                cur_date = cur_date + dt.timedelta(hours=3)
-                coordsstrings.append("TGrid{},              1,  03:00,   {},".format(i,
-                                                                                     dt.datetime.strftime(
-                                                                                         cur_date + dt.timedelta(
-                                                                                             days=params['time']),
-                                                                                         '%d/%m/%Y %H:%M')
-                                                                                     ))
+Name,                      nt,     dt,               t0,"""]
+        for i, t0 in enumerate(origins, 1):
+            coordsstrings.append("TGrid{},              1,  03:00,   {},".format(i, t0))
+        return "\n".join(coordsstrings)
 
-
-    else:
-        runDuration = maxagehours + params['dailyreleaselen']
-        params['runDuration'] = runDuration
-        coordsstrings.append("""
+    return """
 Temporal Grids:
 Name,                      nt,     dt,               t0,
 TGrid1,              1,  {}:00,   {},
-""".format(str(params['dailyreleaselen']).zfill(2), dt.datetime.strftime(cur_date - dt.timedelta(days=params['time']), '%d/%m/%Y %H:%M')))
+""".format(str(params['dailyreleaselen']).zfill(2), origins[0])
 
-    coordsstrings.append("""
-Domains:
-Name,              H Unbounded?,  H-Coord,          X Min,          X Max,          Y Min,          Y Max, Z Unbounded?, Z-Coord,   Z Max, T Unbounded?, Start Time, End Time,  Max Travel Time,
-Dispersion Domain,           No, Lat-Long,    {},   {},   {},   {},           No,   m asl, 15000.0,          Yes,           ,         , {}:00,
-""".format(CompDom_Xmin, CompDom_Xmax, CompDom_Ymin, CompDom_Ymax, runDuration))
-
-
-    return "\n".join(coordsstrings)
-
-
-def generate_inputfile(params, rundate, i):
 
+def generate_domain(params):
     """
-    This will take the input parameters and generate the appropriate file for running NAME
-    :param params: Dictionary of input parameters
-    :param rundate: Current date
-    :param i: run index
-    :return: file contents
+    The computational domain, the same for every day.
     """
 
-    nthreads = 1 # Taken from original script file
-    ParticlesPerSource = '10000/hr'
-    MaxNumParticles = 1000000
-    SyncTime_Minutes = 15
-    nIntTimesPerHour = 4
-    if params['timestamp'] == '3-hourly':
-        SamplingPeriod_Hours = 3 # Is this specific to running it 3-hourly??
-    else:
-        SamplingPeriod_Hours = params['dailyreleaselen']
-
-    backwards = "No"
-    runtype = "FWD"
-    if params['runBackwards']:
-        backwards = "Yes"
-        runtype= "BCK"
-
-    # This will need editing, will need loggedin username, and a run id sub dir.
-
-    jasminconfigs = getjasminconfigs()
-
-    userdir = jasminconfigs.get('jasmin', 'userdir')
-    workdir = os.path.join(userdir, 'WPStest', params['runid'])
-
-    utilsdir = jasminconfigs.get('jasmin', 'utilsdir')
-    namedir = jasminconfigs.get('jasmin', 'namedir')
-    topodir = jasminconfigs.get('jasmin', 'topodir')
-    metdir = os.path.join(workdir, "met_data", "input{}".format(i))
-
-    cur_date = dt.datetime.combine(rundate, dt.time(0))
-    if 'dailytime' in params and params['timestamp'] == 'daily':
-        cur_date = dt.datetime.combine(rundate, params['dailytime'])
+    # Values come in as minY,minX,maxY,maxX
+    CompDom_Xmin = params['domain'][1]
+    CompDom_Xmax = params['domain'][3]
+    CompDom_Ymin = params['domain'][0]
+    CompDom_Ymax = params['domain'][2]
 
-    start_globalMk = get_Mk_global(cur_date + dt.timedelta(days=1))
-    end_globalMK = get_Mk_global(cur_date - dt.timedelta(days=params['time']))
+    return """
+Domains:
+Name,              H Unbounded?,  H-Coord,          X Min,          X Max,          Y Min,          Y Max, Z Unbounded?, Z-Coord,   Z Max, T Unbounded?, Start Time, End Time,  Max Travel Time,
+Dispersion Domain,           No, Lat-Long,    {},   {},   {},   {},           No,   m asl, 15000.0,          Yes,           ,         , {}:00,
+""".format(CompDom_Xmin, CompDom_Xmax, CompDom_Ymin, CompDom_Ymax, run_duration(params))
 
-    if start_globalMk == 0 or end_globalMK == 0:
-        raise Exception("Date is before the earliest available Global met data")
-    elif start_globalMk != end_globalMK:
-        raise Exception("The start and stop dates of the NAME run do not use the same 'Mk' Global met data")
 
-    MetVals = get_Met_vals(start_globalMk)
+def generate_coords(params, cur_date, grid=None):
 
-    MetDefnFile = os.path.join(namedir, "Resources", "Defns", MetVals['MetDefnFileName'])
-    MetDeclnFile = os.path.join(utilsdir, "MetDeclarations", MetVals['MetDeclFileName'])
-    MetRestoreScript = os.path.join(userdir, "MetRestore_JASMIN.ksh")
+    grid = grid or GridSpec(params)
+    return "\n".join([generate_grids(params, grid), generate_temporal_grids(params, cur_date, grid),
+                      generate_domain(params)])
 
-    params['npart'] = ParticlesPerSource
-    params['ntimesperhour'] = nIntTimesPerHour
 
-    header = """
+HEADER_TOP = """
   ******************************************************************************
 !
 ! Project: Template files and scripts for research users on NAME-JASMIN
@@ -231,7 +327,9 @@ def generate_inputfile(params, rundate, i):
 ! Authors: Andrew Jones, Atmospheric Dispersion, UK Met Office
 !          Teri Forey, ReSET, University of Leicester
 !
-! Date:    Generated by NAME WPS for release on {}
+! Date:    Generated by NAME WPS for release on """
+
+HEADER_REST = """
 ! ******************************************************************************
 
 Main Options:
@@ -249,9 +347,9 @@ Dispersion Options Ensemble Size, Met Ensemble Size,
 OpenMP Options:
 Use OpenMP?,    Threads, Parallel MetRead, Parallel MetProcess,
          No,         {},               No,                  No,
-""".format(params['runid'], dt.datetime.strftime(cur_date, "%d/%m/%Y"), params['title'], backwards, nthreads)
+"""
 
-    inandout = """
+INANDOUT = """
 Output Options:
 Folder
 {}
@@ -259,11 +357,9 @@ Folder
 Input Files:
 File names
 {}
-""".format(os.path.join(workdir, 'outputs'), MetDefnFile)
-
-    coordstr = generate_coords(params, cur_date)
+"""
 
-    footer = """
+FOOTER = """
 Species:
         Name, Category, Half Life, UV Loss Rate, Surface Resistance, Deposition Velocity,  Molecular Weight, Material Unit
 TRACER1,    Tracer,    Stable,     0.00E+00,                   ,                 0.0,            0,             g
@@ -275,38 +371,184 @@ TRACER1,          Yes,         No,            No
 Sets of Dispersion Options:
 Max # Particles,   Max # Full Particles, Skew Time, Velocity Memory Time, Mesoscale Velocity Memory Time, Inhomogeneous Time, DeltaOpt,     Sync Time, Time of Fixed Met, Computational Domain, Puff Interval, Deep Convection?, Radioactive Decay?, Agent Decay?, Dry Deposition?, Wet Deposition?, Turbulence?, Mesoscale Motions?, Chemistry? 
 {},                    2,     00:00,                00:00,                          00:00,              00:00,        1,      00:{},                  ,    Dispersion Domain,         00:00,               No,                 No,           No,              Yes,              Yes,         Yes,                Yes,         No 
-""".format(MaxNumParticles, SyncTime_Minutes)
+"""
 
-    hourstrings = []
-    samplingPeriodIndex = 0
-    hour_stop = 0
-    hour_start = SamplingPeriod_Hours
-    while(hour_stop < 24):
-        samplingPeriodIndex += 1
 
-        if params['runBackwards']:
-            hourstrings.append(generate_hourlys(params, samplingPeriodIndex, cur_date, hour_start, hour_stop))
-        else:
-            hourstrings.append(generate_hourlys(params, samplingPeriodIndex, cur_date, hour_stop, hour_start))
+# Buffer size used when writing input files, so the many small sections go to disk in large writes
+WRITE_BUFFER = 64 * 1024
+
+
+class InputFileGenerator(object):
+    """
+    Generates the NAME input files for all the days of a run. The sections that are the same every day
+    (main options, species, dispersion options, grids, domain and JASMIN paths) are worked out once,
+    leaving only the dates, sampling periods and met data to fill in for each day.
+    """
+    nthreads = 1 # Taken from original script file
+    ParticlesPerSource = '10000/hr'
+    MaxNumParticles = 1000000
+    SyncTime_Minutes = 15
+    nIntTimesPerHour = 4
 
-        hour_stop = hour_stop + SamplingPeriod_Hours
-        hour_start = hour_start + SamplingPeriod_Hours
+    def __init__(self, params, grid=None):
+        """
+        :param params: Dictionary of input parameters
+        :param grid: GridSpec of the run, if it has already been worked out
+        """
+        self.params = params
+        self.grid = grid or GridSpec(params)
 
-        if params['timestamp'] == 'daily':
-            break
+        if params['timestamp'] == '3-hourly':
+            self.SamplingPeriod_Hours = 3 # Is this specific to running it 3-hourly??
+        else:
+            self.SamplingPeriod_Hours = params['dailyreleaselen']
 
+        backwards = "No"
+        if params['runBackwards']:
+            backwards = "Yes"
+
+        # This will need editing, will need loggedin username, and a run id sub dir.
+
+        jasminconfigs = getjasminconfigs()
+
+        userdir = jasminconfigs.userdir
+        self.workdir = os.path.join(userdir, 'WPStest', params['runid'])
+
+        self.utilsdir = jasminconfigs.utilsdir
+        self.namedir = jasminconfigs.namedir
+        self.topodir = jasminconfigs.topodir
+        self.MetRestoreScript = os.path.join(userdir, "MetRestore_JASMIN.ksh")
+
+        params['npart'] = self.ParticlesPerSource
+        params['ntimesperhour'] = self.nIntTimesPerHour
+
+        self.header_top = HEADER_TOP.format(params['runid'])
+        self.header_rest = HEADER_REST.format(params['title'], backwards, self.nthreads)
+        self.grids = generate_grids(params, self.grid)
+        self.domain = generate_domain(params)
+        self.footer = FOOTER.format(self.MaxNumParticles, self.SyncTime_Minutes)
+
+    def run_datetime(self, rundate):
+        """
+        :param rundate: date of the run
+        :return: datetime the release starts
+        """
+        cur_date = dt.datetime.combine(rundate, dt.time(0))
+        if 'dailytime' in self.params and self.params['timestamp'] == 'daily':
+            cur_date = dt.datetime.combine(rundate, self.params['dailytime'])
+        return cur_date
+
+    def met_values(self, cur_date):
+        """
+        :param cur_date: datetime the release starts
+        :return: the Met file properties for the global 'Mk' met data the run uses
+        """
+        start_globalMk = get_Mk_global(cur_date + dt.timedelta(days=1))
+        end_globalMK = get_Mk_global(cur_date - dt.timedelta(days=self.params['time']))
+
+        if start_globalMk == 0 or end_globalMK == 0:
+            raise Exception("Date is before the earliest available Global met data")
+        elif start_globalMk != end_globalMK:
+            raise Exception("The start and stop dates of the NAME run do not use the same 'Mk' Global met data")
+
+        return get_Met_vals(start_globalMk)
+
+    def sections(self, rundate, i):
+        """
+        This will generate the appropriate file for running NAME on a single day, one section at a time
+        :param rundate: Current date
+        :param i: run index
+        :return: generator of the file contents
+        """
+        params = self.params
+
+        cur_date = self.run_datetime(rundate)
+        MetVals = self.met_values(cur_date)
+
+        metdir = os.path.join(self.workdir, "met_data", "input{}".format(i))
+        MetDefnFile = os.path.join(self.namedir, "Resources", "Defns", MetVals['MetDefnFileName'])
+        MetDeclnFile = os.path.join(self.utilsdir, "MetDeclarations", MetVals['MetDeclFileName'])
+        declarations = get_metdecl_template(MetDeclnFile)
+
+        yield self.header_top
+        yield dt.datetime.strftime(cur_date, "%d/%m/%Y")
+        yield self.header_rest
+
+        yield INANDOUT.format(os.path.join(self.workdir, 'outputs'), MetDefnFile)
+
+        yield self.grids
+        yield "\n"
+        yield generate_temporal_grids(params, cur_date, self.grid)
+        yield "\n"
+        yield self.domain
+
+        yield self.footer
+
+        samplingPeriodIndex = 0
+        hour_stop = 0
+        hour_start = self.SamplingPeriod_Hours
+        while(hour_stop < 24):
+            samplingPeriodIndex += 1
+
+            if samplingPeriodIndex > 1:
+                yield "\n"
+            if params['runBackwards']:
+                yield generate_hourlys(params, samplingPeriodIndex, cur_date, hour_start, hour_stop)
+            else:
+                yield generate_hourlys(params, samplingPeriodIndex, cur_date, hour_stop, hour_start)
+
+            hour_stop = hour_stop + self.SamplingPeriod_Hours
+            hour_start = hour_start + self.SamplingPeriod_Hours
+
+            if params['timestamp'] == 'daily':
+                break
+
+        yield "\n\n"
+        for section in declarations.sections(metdir, self.topodir, self.MetRestoreScript):
+            yield section
+
+    def generate(self, rundate, i):
+        """
+        :param rundate: Current date
+        :param i: run index
+        :return: file contents
+        """
+        return "".join(self.sections(rundate, i))
+
+    def write(self, fout, rundate, i):
+        """
+        Writes the input file for a single day section by section, without building it up in memory
+        :param fout: file object to write to
+        :param rundate: Current date
+        :param i: run index
+        """
+        for section in self.sections(rundate, i):
+            fout.write(section)
+
+    def write_all(self, dates, inputsdir):
+        """
+        Writes the input file for each date straight to disk as it is generated
+        :param dates: iterable of run dates
+        :param inputsdir: directory to write input1.txt, input2.txt... into
+        :return: number of input files written
+        """
+        dates = list(dates)
+        self.grid.prepare([self.run_datetime(rundate) for rundate in dates])
+        i = 0
+        for i, rundate in enumerate(dates, 1):
+            with open(os.path.join(inputsdir, "input{}.txt".format(i)), 'w', WRITE_BUFFER) as fout:
+                self.write(fout, rundate, i)
+        return i
 
-    if not os.path.exists(MetDeclnFile):
-        raise Exception("Cannot find Met Declaration file {}".format(MetDeclnFile))
 
-    declstrings = []
-    with open(MetDeclnFile, 'r') as ins:
-        for l in ins:
-            l = l.rstrip()
-            l = re.sub('%MetDir%', metdir, l)
-            l = re.sub('%TopogDir%', topodir, l)
-            l = re.sub('%MetRestoreScript%', MetRestoreScript, l)
-            declstrings.append(l)
+def generate_inputfile(params, rundate, i):
 
-    return header+inandout+coordstr+footer+"\n".join(hourstrings)+"\n\n"+"\n".join(declstrings)
+    """
+    This will take the input parameters and generate the appropriate file for running NAME
+    :param params: Dictionary of input parameters
+    :param rundate: Current date
+    :param i: run index
+    :return: file contents
+    """
 
+    return InputFileGenerator(params).generate(rundate, i)
@@ -1,19 +1,71 @@
 import os
+import threading
 from pywps.app.Service import Service
 
 from .processes import processes
+from .tiles import TileServer
+
+_service = None
+_service_key = None
+_service_lock = threading.Lock()
+_tiles = None
 
 
 def application(environ, start_response):
-    app = create_app()
+    return get_tiles()(environ, start_response)
+
+
+def _dispatch(environ, start_response):
+    app = get_app()
     return app(environ, start_response)
 
 
-def create_app(cfgfiles=None):
+def get_tiles():
+    """
+    The tile server for this worker, passing everything but tile requests on to the WPS service. Like the
+    service it is built on the first request, so its tile cache lives as long as the worker.
+    """
+    global _tiles
+    with _service_lock:
+        if _tiles is None:
+            _tiles = TileServer(_dispatch)
+        return _tiles
+
+
+def get_config_files(cfgfiles=None):
     config_files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
     if cfgfiles:
         config_files.extend(cfgfiles)
     if 'PYWPS_CFG' in os.environ:
         config_files.append(os.environ['PYWPS_CFG'])
-    service = Service(processes=processes, cfgfiles=config_files)
+    return config_files
+
+
+def _config_key(config_files):
+    key = []
+    for cfgfile in config_files:
+        try:
+            key.append((cfgfile, os.path.getmtime(cfgfile)))
+        except OSError:
+            key.append((cfgfile, None))
+    return tuple(key)
+
+
+def get_app():
+    """
+    The WPS service for this worker. It is built on the first request and reused after that, only being
+    rebuilt if PYWPS_CFG points somewhere else or one of the config files has changed.
+    """
+    global _service, _service_key
+    files = get_config_files()
+    key = _config_key(files)
+    with _service_lock:
+        if _service is None or key != _service_key:
+            _service = Service(processes=processes, cfgfiles=files)
+            _service_key = key
+        return _service
+
+
+def create_app(cfgfiles=None):
+    service = Service(processes=processes, cfgfiles=get_config_files(cfgfiles))
     return service